@@ -0,0 +1,555 @@
+"""
+Bulk vault maintenance from the shell.
+
+    python admin.py import FILE --user EMAIL_OR_ID [--format csv|jsonl]
+    python admin.py export --user EMAIL_OR_ID [--output FILE] [--format csv|jsonl]
+    python admin.py verify [--report FILE]
+    python admin.py re-encrypt [--new-key-env NEW_VAULT_KEY]
+    python admin.py purge-user EMAIL_OR_ID [--yes]
+    python admin.py stats
+    python admin.py prune-history
+
+import, verify and re-encrypt split their work into batches that a pool of
+--workers processes runs in parallel (each with its own database pool), and
+accept --checkpoint FILE: progress is saved after every completed batch, and
+re-running the same command with the same file resumes where it stopped,
+skipping every batch that had already completed (batches finish out of
+order, so a checkpoint lists them, not just a position).
+verify and re-encrypt walk every shard by id range, so they never hold more
+than one batch per worker in memory.
+
+re-encrypt rewrites every ciphertext (passwords, TOTP seeds, revision history and attachment
+keys) under a new key, and re-wraps the collection keys of shared
+collections for each member. Run it with the web workers stopped, then point
+VAULT_KEY (or the key file) at the new key before starting them again.
+"""
+import argparse
+import base64
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+
+import audit
+import history
+import keys
+import sharding
+import sharing
+import totp
+from main import db, pm
+
+DEFAULT_WORKERS = max(1, min(os.cpu_count() or 1, int(os.getenv("DB_MAX_CONN", "10")))) # One connection each
+DEFAULT_BATCH_SIZE = 1000 # Rows per batch (and per multi-row statement)
+PROGRESS_INTERVAL = 0.2 # Seconds between progress bar redraws
+
+
+class Progress:
+    """A single-line progress bar on stderr."""
+
+    def __init__(self, label: str, total: Optional[int] = None, width: int = 30):
+        self.label = label
+        self.total = total
+        self.width = width
+        self.done = 0
+        self.rows = 0
+        self.started = time.monotonic()
+        self._drawn = 0.0
+
+    def update(self, steps: int = 1, rows: int = 0):
+        self.done += steps
+        self.rows += rows
+        now = time.monotonic()
+        if now - self._drawn >= PROGRESS_INTERVAL or (self.total and self.done >= self.total):
+            self._drawn = now
+            self._draw(now)
+
+    def _draw(self, now: float):
+        elapsed = max(now - self.started, 1e-9)
+        rate = f"{self.rows / elapsed:,.0f} rows/s"
+        if self.total:
+            fraction = min(self.done / self.total, 1.0)
+            filled = int(self.width * fraction)
+            eta = elapsed / fraction - elapsed if fraction else 0
+            bar = f"[{'#' * filled}{'.' * (self.width - filled)}] {fraction:6.1%} {self.rows:,} rows, {rate}, ETA {eta:,.0f}s"
+        else:
+            bar = f"{self.rows:,} rows, {rate}"
+        sys.stderr.write(f"\r{self.label} {bar}")
+        sys.stderr.flush()
+
+    def close(self):
+        self._draw(time.monotonic())
+        sys.stderr.write("\n")
+
+
+class Checkpoint:
+    """
+    Persists progress as a small JSON file, rewritten atomically, so an
+    interrupted run can be resumed. A file belongs to one command; using it
+    with another is refused rather than silently skipping work.
+    """
+
+    def __init__(self, path: Optional[str], command: str):
+        self.path = path
+        self.command = command
+        self.state: Dict[str, Any] = {}
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as checkpoint_file:
+                saved = json.load(checkpoint_file)
+            if saved.get("command") != command:
+                raise SystemExit(f"❌ Checkpoint {path} belongs to '{saved.get('command')}', not '{command}'.")
+            self.state = saved.get("progress", {})
+            print(f"↪️ Resuming from checkpoint {path}.")
+
+    def watermark(self, key: str, start: int) -> "Watermark":
+        """Returns the saved progress under key, or a Watermark at start if there is none."""
+        saved = self.state.get(key)
+        if isinstance(saved, int): # Written before finished batches were recorded
+            return Watermark(saved)
+        if saved is None:
+            return Watermark(start)
+        return Watermark(saved["done"], saved["finished"])
+
+    def save(self, key: str, watermark: "Watermark"):
+        self.state[key] = {"done": watermark.value, "finished": watermark.finished()}
+        if not self.path:
+            return
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as checkpoint_file:
+            json.dump({"command": self.command, "progress": self.state}, checkpoint_file)
+        os.replace(temporary, self.path)
+
+
+def run_batches(tasks: Iterator[tuple], workers: int, on_result, in_flight: int = None):
+    """
+    Runs (key, function, *args) tasks on a process pool and calls
+    on_result(key, result) in the parent as each one finishes. At most
+    in_flight tasks are queued at once, so task arguments are produced lazily.
+    If the run is interrupted or a task fails, tasks not started yet are
+    cancelled, and those that still complete are reported before the error
+    is raised, so a checkpoint records every batch that was committed.
+    """
+    in_flight = in_flight or workers * 2
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        try:
+            for key, function, *args in tasks:
+                pending[executor.submit(function, *args)] = key
+                if len(pending) >= in_flight:
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        on_result(pending.pop(future), future.result())
+            while pending:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    on_result(pending.pop(future), future.result())
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            for future in wait(pending)[0]:
+                if not future.cancelled() and future.exception() is None:
+                    on_result(pending[future], future.result())
+            raise
+
+
+class Watermark:
+    """
+    Tracks out-of-order batch completion: value is the position below which
+    every batch is done, and finished() lists the batches done above it.
+    A checkpoint records both, so a resumed run redoes no completed batch.
+    """
+
+    def __init__(self, start: int, finished: Iterable[Tuple[int, int]] = ()):
+        self.value = start
+        self._finished: Dict[int, int] = {} # batch start -> batch end
+        for batch_start, batch_end in finished:
+            self.finish(batch_start, batch_end)
+
+    def finish(self, start: int, end: int) -> int:
+        self._finished[start] = end
+        while self.value in self._finished:
+            self.value = self._finished.pop(self.value)
+        return self.value
+
+    def finished(self) -> List[List[int]]:
+        """The [start, end) ranges done above value, in order."""
+        return [[start, end] for start, end in sorted(self._finished.items())]
+
+    def is_done(self, position: int) -> bool:
+        return position < self.value or any(start <= position < end for start, end in self._finished.items())
+
+    def pending(self, start: int, end: int) -> Iterator[Tuple[int, int]]:
+        """Yields the parts of [start, end) that are not done, as [start, end) ranges."""
+        start = max(start, self.value)
+        for done_start, done_end in sorted(self._finished.items()):
+            if done_end <= start:
+                continue
+            if done_start >= end:
+                break
+            if done_start > start:
+                yield start, done_start
+            start = max(start, done_end)
+        if start < end:
+            yield start, end
+
+
+# --- Worker tasks (run in the pool's processes) ---
+
+def _import_batch(user_id: int, first_row: int, entries: List[dict]) -> Tuple[int, List[str]]:
+    creates, errors = [], []
+    for row_number, entry in enumerate(entries, start=first_row):
+        try:
+            website = entry.get("website") or entry.get("url") or entry.get("name")
+            username, password = entry.get("username"), entry.get("password")
+            if not website or not username or not password:
+                raise ValueError("website, username and password are required")
+            secret = entry.get("totp") or None
+            creates.append((website, username, pm.encrypt_password(password),
+                            pm.fernet.encrypt(totp.parse_secret(secret)) if secret else None))
+        except ValueError as e:
+            errors.append(f"row {row_number}: {e}")
+    if creates:
+        success, data = db.batch_vault_operations(user_id, creates=creates, updates=[], deletes=[])
+        if not success:
+            raise RuntimeError(f"rows {first_row}-{first_row + len(entries) - 1}: {data}")
+    return len(creates), errors
+
+
+def _verify_range(table: str, shard: Optional[str], start: int, end: int) -> Tuple[int, List[tuple]]:
+    columns = db.CIPHERTEXT_COLUMNS[table]
+    rows = db.scan_ciphertexts(table, start, end, shard=shard)
+    failures = []
+    for row in rows:
+        for column, value in zip(columns, row[2:]):
+            if value is None:
+                continue
+            try:
+                pm.fernet.decrypt(bytes(value))
+            except InvalidToken:
+                failures.append((shard or "", table, row[0], row[1], column))
+    return len(rows), failures
+
+
+def _reencrypt_range(table: str, shard: Optional[str], start: int, end: int, new_key: bytes) -> Tuple[int, List[tuple]]:
+    # rotate() decrypts with any listed key and encrypts with the first, so rows a
+    # previous (interrupted) run already converted are handled too
+    rotator = MultiFernet([Fernet(new_key), pm.fernet])
+    rows = db.scan_ciphertexts(table, start, end, shard=shard)
+    rewritten, failures = [], []
+    for row in rows:
+        try:
+            rewritten.append((row[0], *(rotator.rotate(bytes(value)) if value is not None else None for value in row[2:])))
+        except InvalidToken:
+            failures.append((shard or "", table, row[0], row[1], "*"))
+    db.rewrite_ciphertexts(table, rewritten, shard=shard)
+    return len(rows), failures
+
+
+# --- Commands ---
+
+def resolve_user(value: str) -> Tuple[int, str]:
+    """Returns (user_id, email) for an email address or a numeric user id."""
+    user = db.get_user_by_id(int(value)) if value.isdigit() else db.get_user(value)
+    if not user:
+        raise SystemExit(f"❌ User '{value}' not found.")
+    return user[0], user[2]
+
+
+def read_entries(path: str, file_format: str) -> Iterator[dict]:
+    """Streams entries from a CSV file (with a header row) or a JSON-lines file."""
+    with open(path, newline="", encoding="utf-8") as entries_file:
+        if file_format == "csv":
+            for row in csv.DictReader(entries_file):
+                yield {key.strip().lower(): value for key, value in row.items() if key}
+        else:
+            for line in entries_file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def command_import(args):
+    user_id, email = resolve_user(args.user)
+    checkpoint = Checkpoint(args.checkpoint, f"import {os.path.abspath(args.file)} {user_id}")
+    watermark = checkpoint.watermark("rows", 0)
+    progress = Progress(f"import → user {user_id}")
+    imported, errors = 0, []
+
+    def tasks():
+        # Creates are not idempotent: every row of a batch that completed before an
+        # interruption is skipped, and a batch never spans such rows
+        batch, first_row = [], 0
+        for row_number, entry in enumerate(read_entries(args.file, args.format)):
+            if watermark.is_done(row_number):
+                if batch:
+                    yield (first_row, len(batch)), _import_batch, user_id, first_row, batch
+                    batch = []
+                continue
+            if not batch:
+                first_row = row_number
+            batch.append(entry)
+            if len(batch) >= args.batch_size:
+                yield (first_row, len(batch)), _import_batch, user_id, first_row, batch
+                batch = []
+        if batch:
+            yield (first_row, len(batch)), _import_batch, user_id, first_row, batch
+
+    def on_result(key, result):
+        nonlocal imported
+        first_row, size = key
+        count, batch_errors = result
+        imported += count
+        errors.extend(batch_errors)
+        watermark.finish(first_row, first_row + size)
+        checkpoint.save("rows", watermark)
+        progress.update(rows=size)
+
+    try:
+        run_batches(tasks(), args.workers, on_result)
+    finally:
+        progress.close()
+        audit.record("admin_import", user_id=user_id, success=not errors, detail=f"{imported} entries imported")
+    for error in errors[:20]:
+        print(f"⚠️ Skipped {error}")
+    print(f"✅ Imported {imported} entries for {email}; {len(errors)} row(s) skipped.")
+
+
+def command_export(args):
+    user_id, email = resolve_user(args.user)
+    success, entries = pm.get_passwords(user_id)
+    if not success:
+        raise SystemExit(f"❌ {entries}")
+    success, seeds = db.list_totp_secrets(user_id)
+    if not success:
+        raise SystemExit(f"❌ {seeds}")
+    totp_seeds = {
+        password_id: base64.b32encode(pm.fernet.decrypt(bytes(encrypted))).decode().rstrip("=")
+        for password_id, encrypted in seeds
+    }
+
+    if args.output:
+        # Plaintext secrets: create the file readable by its owner only
+        output = os.fdopen(os.open(args.output, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w",
+                           newline="", encoding="utf-8")
+    else:
+        output = sys.stdout
+    print(f"⚠️ Exporting decrypted entries of {email}; handle the output as a secret.", file=sys.stderr)
+    progress = Progress(f"export ← user {user_id}")
+    fields = ("website", "username", "password", "totp")
+    writer = csv.DictWriter(output, fieldnames=fields) if args.format == "csv" else None
+    try:
+        if writer:
+            writer.writeheader()
+        for entry in entries:
+            if entry["collection_id"] is not None:
+                continue # Shared entries belong to their organization, not to this user's vault
+            record = {"website": entry["website"], "username": entry["username"], "password": entry["password"],
+                      "totp": totp_seeds.get(entry["id"], "")}
+            if writer:
+                writer.writerow(record)
+            else:
+                output.write(json.dumps(record) + "\n")
+            progress.update(rows=1)
+    finally:
+        progress.close()
+        if output is not sys.stdout:
+            output.close()
+    audit.record("admin_export", user_id=user_id, detail=f"{progress.rows} entries exported")
+
+
+def scan_tables(command: str, args, task, *task_args) -> Tuple[int, List[tuple]]:
+    """Runs task over every id range of every encrypted table on every shard."""
+    checkpoint = Checkpoint(args.checkpoint, command)
+    # Ids are striped across shards, so one shard only holds every SHARD_ID_STRIDE-th id
+    step = args.batch_size * (sharding.SHARD_ID_STRIDE if sharding.SHARD_URLS else 1)
+    total_rows, failures = 0, []
+    for table in db.CIPHERTEXT_COLUMNS:
+        for shard in db.shard_names():
+            bounds = db.id_range(table, shard)
+            if bounds is None:
+                continue
+            key = f"{table}@{shard or 'primary'}"
+            watermark = checkpoint.watermark(key, bounds[0])
+            ranges = [batch for low in range(watermark.value, bounds[1] + 1, step)
+                      for batch in watermark.pending(low, min(low + step, bounds[1] + 1))]
+            if not ranges:
+                continue
+            progress = Progress(f"{command} {key}", total=len(ranges))
+
+            def on_result(batch, result):
+                rows, batch_failures = result
+                failures.extend(batch_failures)
+                watermark.finish(*batch)
+                checkpoint.save(key, watermark)
+                progress.update(rows=rows)
+
+            try:
+                run_batches(((batch, task, table, shard, *batch, *task_args) for batch in ranges), args.workers, on_result)
+            finally:
+                progress.close()
+            total_rows += progress.rows
+    return total_rows, failures
+
+
+def member_keys(args, new_key: bytes = None) -> Tuple[int, List[tuple]]:
+    """
+    Checks that every member's copy of a collection key unwraps or, given
+    new_key, re-wraps them all for it. Collection entries are encrypted with
+    the collection keys themselves, so they never need rewriting.
+    """
+    rows = db.list_member_keys()
+    new_keyring = sharing.MemberKeyring(new_key) if new_key else None
+    progress = Progress("member keys", total=len(rows))
+    rewrapped, failures = [], []
+    try:
+        for collection_id, user_id, wrapped_key in rows:
+            try:
+                if new_keyring is None:
+                    pm.keyring.unwrap(user_id, wrapped_key)
+                else:
+                    try:
+                        new_keyring.unwrap(user_id, wrapped_key) # Already converted by an earlier run
+                    except InvalidToken:
+                        rewrapped.append((collection_id, user_id,
+                                          new_keyring.wrap(user_id, pm.keyring.unwrap(user_id, wrapped_key))))
+            except InvalidToken:
+                failures.append(("", "collection_members", collection_id, user_id, "wrapped_key"))
+            if len(rewrapped) >= args.batch_size:
+                db.rewrite_member_keys(rewrapped)
+                rewrapped = []
+            progress.update(rows=1)
+        db.rewrite_member_keys(rewrapped)
+    finally:
+        progress.close()
+    return len(rows), failures
+
+
+def command_verify(args):
+    rows, failures = scan_tables("verify", args, _verify_range)
+    key_rows, key_failures = member_keys(args)
+    rows, failures = rows + key_rows, failures + key_failures
+    if args.report:
+        with open(args.report, "w", newline="", encoding="utf-8") as report_file:
+            writer = csv.writer(report_file)
+            writer.writerow(("shard", "table", "id", "user_id", "column"))
+            writer.writerows(failures)
+    audit.record("admin_verify", success=not failures, detail=f"{rows} rows checked, {len(failures)} failed")
+    if failures:
+        print(f"❌ {len(failures)} of {rows} rows failed to decrypt with key {pm.key_fingerprint}.")
+        sys.exit(1)
+    print(f"✅ All {rows} rows decrypt with key {pm.key_fingerprint}.")
+
+
+def command_reencrypt(args):
+    value = os.getenv(args.new_key_env)
+    if not value:
+        raise SystemExit(f"❌ Set {args.new_key_env} to the new Fernet key.")
+    new_key = value.strip().encode()
+    try:
+        Fernet(new_key)
+    except ValueError as e:
+        raise SystemExit(f"❌ {args.new_key_env} is not a valid Fernet key: {e}")
+    fingerprint = keys.key_fingerprint(new_key)
+    if fingerprint == pm.key_fingerprint:
+        raise SystemExit("❌ The new key is the key currently in use.")
+
+    rows, failures = scan_tables(f"re-encrypt {fingerprint}", args, _reencrypt_range, new_key)
+    key_rows, key_failures = member_keys(args, new_key)
+    rows, failures = rows + key_rows, failures + key_failures
+    audit.record("admin_reencrypt", success=not failures,
+                 detail=f"{pm.key_fingerprint} -> {fingerprint}: {rows} rows, {len(failures)} unreadable")
+    for shard, table, row_id, user_id, _ in failures[:20]:
+        print(f"⚠️ {table} {row_id} (user {user_id}{', shard ' + shard if shard else ''}) could not be decrypted; left as is.")
+    print(f"✅ Re-encrypted {rows - len(failures)} rows to key {fingerprint}. "
+          f"Switch the vault key to it before restarting the web workers.")
+
+
+def command_purge_user(args):
+    user_id, email = resolve_user(args.user)
+    if not args.yes:
+        answer = input(f"Delete {email} (user {user_id}) and their whole vault? Type the email to confirm: ")
+        if answer.strip() != email:
+            raise SystemExit("Aborted.")
+    success, message = db.delete_user(email)
+    audit.record("admin_purge_user", user_id=user_id, actor_email=email, success=success)
+    if not success:
+        raise SystemExit(f"❌ {message}")
+    print(f"✅ {message}")
+
+
+def command_stats(args):
+    totals: Dict[str, int] = {}
+    print(f"🔑 Vault key fingerprint {pm.key_fingerprint}")
+    for shard in db.shard_names():
+        stats = db.vault_stats(shard)
+        for name, value in stats.items():
+            totals[name] = totals.get(name, 0) + value
+        if shard is not None:
+            print(f"{shard}: " + ", ".join(f"{name}={value:,}" for name, value in stats.items()))
+    print("total: " + ", ".join(f"{name}={value:,}" for name, value in totals.items()))
+
+
+def command_prune_history(args):
+    deleted = history.pruner.run_once(db)
+    print(f"✅ Deleted {deleted} revision(s) older than {history.HISTORY_MAX_AGE_DAYS:g} days "
+          f"or beyond the newest {history.HISTORY_KEEP_REVISIONS} per entry.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk SecureVault maintenance.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_pool_options(subparser):
+        subparser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="worker processes")
+        subparser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="rows per batch")
+        subparser.add_argument("--checkpoint", help="file recording progress, for resuming")
+
+    import_parser = subparsers.add_parser("import", help="import entries into a user's vault")
+    import_parser.add_argument("file")
+    import_parser.add_argument("--user", required=True, help="email or user id")
+    import_parser.add_argument("--format", choices=("csv", "jsonl"), default="csv")
+    add_pool_options(import_parser)
+    import_parser.set_defaults(handler=command_import)
+
+    export_parser = subparsers.add_parser("export", help="export a user's decrypted entries")
+    export_parser.add_argument("--user", required=True, help="email or user id")
+    export_parser.add_argument("--output", help="file to write (default: stdout)")
+    export_parser.add_argument("--format", choices=("csv", "jsonl"), default="csv")
+    export_parser.set_defaults(handler=command_export)
+
+    verify_parser = subparsers.add_parser("verify", help="check that every ciphertext decrypts with the current key")
+    verify_parser.add_argument("--report", help="CSV file listing the rows that fail")
+    add_pool_options(verify_parser)
+    verify_parser.set_defaults(handler=command_verify)
+
+    reencrypt_parser = subparsers.add_parser("re-encrypt", help="re-encrypt every ciphertext under a new key")
+    reencrypt_parser.add_argument("--new-key-env", default="NEW_VAULT_KEY", help="environment variable holding the new key")
+    add_pool_options(reencrypt_parser)
+    reencrypt_parser.set_defaults(handler=command_reencrypt)
+
+    purge_parser = subparsers.add_parser("purge-user", help="delete a user and their whole vault")
+    purge_parser.add_argument("user", help="email or user id")
+    purge_parser.add_argument("--yes", action="store_true", help="do not ask for confirmation")
+    purge_parser.set_defaults(handler=command_purge_user)
+
+    stats_parser = subparsers.add_parser("stats", help="row counts and table sizes per shard")
+    stats_parser.set_defaults(handler=command_stats)
+
+    prune_parser = subparsers.add_parser("prune-history", help="apply the revision history retention policy now")
+    prune_parser.set_defaults(handler=command_prune_history)
+
+    args = parser.parse_args()
+    if getattr(args, "workers", 1) < 1 or getattr(args, "batch_size", 1) < 1:
+        parser.error("--workers and --batch-size must be at least 1.")
+    audit.audit_log.start(db.get_connection)
+    try:
+        args.handler(args)
+    finally:
+        audit.audit_log.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Iterator, List, Optional, Tuple, Union
+
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from dotenv import load_dotenv
+from starlette.concurrency import run_in_threadpool
+
+import audit
+
+load_dotenv()
+
+ATTACHMENT_CHUNK_SIZE = int(os.getenv("ATTACHMENT_CHUNK_SIZE", str(256 * 1024))) # Plaintext bytes per chunk
+ATTACHMENT_CHUNKS_PER_WRITE = int(os.getenv("ATTACHMENT_CHUNKS_PER_WRITE", "4")) # Chunks buffered per INSERT
+ATTACHMENT_QUOTA_BYTES = int(os.getenv("ATTACHMENT_QUOTA_BYTES", str(500 * 1024 * 1024))) # Per-user storage limit
+# Hours an upload may take; unfinished uploads older than this were interrupted and are deleted
+ATTACHMENT_UPLOAD_TIMEOUT_HOURS = float(os.getenv("ATTACHMENT_UPLOAD_TIMEOUT_HOURS", "24"))
+QUOTA_EXCEEDED = "Storage quota exceeded."
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def abandoned_before() -> datetime:
+    """Unfinished uploads started before this time are considered abandoned."""
+    return datetime.now(timezone.utc) - timedelta(hours=ATTACHMENT_UPLOAD_TIMEOUT_HOURS)
+
+
+def _nonce(index: int) -> bytes:
+    # Every attachment has its own random key, so the chunk index alone is a unique nonce
+    return index.to_bytes(12, "big")
+
+
+def _aad(attachment_id: int, index: int, final: bool) -> bytes:
+    # Binds each chunk to its attachment and position, and marks the last chunk,
+    # so chunks cannot be swapped, reordered or silently truncated
+    return b"%d:%d:%d" % (attachment_id, index, final)
+
+
+class ChunkEncryptor:
+    """
+    Splits a byte stream into ATTACHMENT_CHUNK_SIZE pieces and seals each with
+    AES-GCM. One chunk is held back until more data arrives, so the last chunk
+    can be marked final. Memory use is bounded by about two chunks.
+    """
+
+    def __init__(self, attachment_id: int, data_key: bytes, chunk_size: int = ATTACHMENT_CHUNK_SIZE):
+        self.attachment_id = attachment_id
+        self.chunk_size = chunk_size
+        self._aes = AESGCM(data_key)
+        self._buffer = bytearray()
+        self._index = 0
+
+    def _seal(self, plaintext: bytes, final: bool) -> Tuple[int, bytes]:
+        index = self._index
+        self._index += 1
+        return index, self._aes.encrypt(_nonce(index), plaintext, _aad(self.attachment_id, index, final))
+
+    def feed(self, data: bytes) -> List[Tuple[int, bytes]]:
+        """Adds data; returns the (index, ciphertext) chunks that are now complete."""
+        self._buffer += data
+        sealed = []
+        # Strictly greater: keep a full chunk back until we know it is not the last one
+        while len(self._buffer) > self.chunk_size:
+            sealed.append(self._seal(bytes(self._buffer[:self.chunk_size]), final=False))
+            del self._buffer[:self.chunk_size]
+        return sealed
+
+    def finish(self) -> List[Tuple[int, bytes]]:
+        """Seals whatever is left as the final chunk (an empty file gets one empty chunk)."""
+        sealed = [self._seal(bytes(self._buffer), final=True)]
+        self._buffer.clear()
+        return sealed
+
+
+async def store_stream(db, fernet: Fernet, user_id: int, stream: AsyncIterator[bytes], kind: str, filename: str,
+                       content_type: str, password_id: Optional[int] = None) -> Tuple[bool, Union[int, str]]:
+    """
+    Encrypts and stores an upload as it streams in.
+    Returns (success, attachment_id or error message). A failed or over-quota
+    upload is deleted again, so it never leaves partial chunks behind.
+    """
+    success, used = await run_in_threadpool(db.attachment_usage, user_id, abandoned_before())
+    if not success:
+        return False, used
+    if used >= ATTACHMENT_QUOTA_BYTES:
+        return False, QUOTA_EXCEEDED
+
+    data_key = AESGCM.generate_key(bit_length=256)
+    success, attachment_id = await run_in_threadpool(
+        db.create_attachment, user_id, kind, filename, content_type, ATTACHMENT_CHUNK_SIZE,
+        fernet.encrypt(data_key), password_id
+    )
+    if not success:
+        return False, attachment_id
+
+    encryptor = ChunkEncryptor(attachment_id, data_key)
+    pending: List[Tuple[int, bytes]] = []
+    size = 0
+    message = None
+    try:
+        async for data in stream:
+            size += len(data)
+            if used + size > ATTACHMENT_QUOTA_BYTES:
+                success, message = False, QUOTA_EXCEEDED
+                break
+            pending.extend(encryptor.feed(data))
+            if len(pending) >= ATTACHMENT_CHUNKS_PER_WRITE:
+                success, message = await run_in_threadpool(db.add_attachment_chunks, user_id, attachment_id, pending, size)
+                pending = []
+                if not success:
+                    break
+                message = None
+        if message is None:
+            pending.extend(encryptor.finish())
+            success, message = await run_in_threadpool(db.add_attachment_chunks, user_id, attachment_id, pending, size)
+            if success:
+                success, message = await run_in_threadpool(db.finish_attachment, user_id, attachment_id,
+                                                            ATTACHMENT_QUOTA_BYTES, abandoned_before())
+    except Exception as e:
+        success, message = False, f"Upload failed: {e}"
+
+    if not success:
+        await run_in_threadpool(db.delete_attachment, user_id, attachment_id)
+        audit.record("attachment_upload", user_id=user_id, entry_id=password_id, success=False, detail=message)
+        return False, message
+    audit.record("attachment_upload", user_id=user_id, entry_id=password_id, detail=f"{kind} {size} bytes")
+    return True, attachment_id
+
+
+async def bytes_stream(data: bytes) -> AsyncIterator[bytes]:
+    """Feeds an in-memory value (e.g. a secure note) through store_stream."""
+    for offset in range(0, len(data), ATTACHMENT_CHUNK_SIZE):
+        yield data[offset:offset + ATTACHMENT_CHUNK_SIZE]
+
+
+def parse_range(header: Optional[str], size: int) -> Union[Tuple[int, int], None, bool]:
+    """
+    Parses a single-range "Range: bytes=..." header into an inclusive (start, end).
+    Returns None when there is no usable Range header (send everything), and
+    False when the range cannot be satisfied.
+    """
+    if not header:
+        return None
+    match = _RANGE.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        return None # Multi-range or malformed: ignore it, as RFC 9110 allows
+    first, last = match.groups()
+    if first == "":
+        length = int(last) # Suffix range: the last N bytes
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def iter_plaintext(db, fernet: Fernet, user_id: int, meta: dict, start: int, end: int) -> Iterator[bytes]:
+    """
+    Yields the plaintext bytes start..end (inclusive), decrypting only the
+    chunks that overlap the range, one at a time.
+    """
+    aes = AESGCM(fernet.decrypt(meta["wrapped_key"]))
+    chunk_size = meta["chunk_size"]
+    last_index = meta["chunk_count"] - 1
+    for index in range(start // chunk_size, end // chunk_size + 1):
+        ciphertext = db.get_attachment_chunk(user_id, meta["id"], index)
+        if ciphertext is None:
+            raise IOError(f"Chunk {index} of attachment {meta['id']} is missing.")
+        try:
+            plaintext = aes.decrypt(_nonce(index), bytes(ciphertext), _aad(meta["id"], index, index == last_index))
+        except InvalidTag:
+            raise IOError(f"Chunk {index} of attachment {meta['id']} failed authentication.")
+        offset = index * chunk_size
+        yield plaintext[max(start - offset, 0):end - offset + 1]
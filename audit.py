@@ -0,0 +1,234 @@
+import atexit
+import csv
+import io
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Optional, Tuple, Union
+
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv()
+
+AUDIT_BUFFER_SIZE = int(os.getenv("AUDIT_BUFFER_SIZE", "10000")) # Events held in memory before backpressure applies
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500")) # Events written per COPY
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "1.0")) # Max seconds an event waits in the buffer
+AUDIT_BACKPRESSURE_MS = float(os.getenv("AUDIT_BACKPRESSURE_MS", "5")) # Max time a full buffer may block a request
+AUDIT_RETRY_MAX_SECONDS = float(os.getenv("AUDIT_RETRY_MAX_SECONDS", "30")) # Longest pause between failed flushes
+AUDIT_QUERY_LIMIT = 1000
+
+COLUMNS = ("occurred_at", "user_id", "actor_email", "action", "entry_id", "success", "detail")
+
+
+def _partition_name(moment: datetime) -> str:
+    return f"audit_log_{moment:%Y%m}"
+
+
+def _month_bounds(moment: datetime) -> Tuple[datetime, datetime]:
+    start = moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start, end
+
+
+class AuditLog:
+    """
+    Buffered, batched writer for the append-only audit_log table.
+
+    Call sites only append a tuple to an in-memory ring buffer; a background
+    thread drains it in batches with COPY into monthly partitions of
+    audit_log. When the buffer is full a caller waits at most
+    AUDIT_BACKPRESSURE_MS for the flusher to make room, after which the event
+    is dropped and counted rather than slowing the request down further.
+    """
+
+    def __init__(self, capacity: int = AUDIT_BUFFER_SIZE):
+        self.capacity = capacity
+        self.dropped = 0
+        self._buffer = deque()
+        self._condition = threading.Condition()
+        self._connection_factory: Optional[Callable] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._partitions = set() # Partitions known to exist
+        self._pid = os.getpid()
+
+    def record(self, action: str, user_id: Optional[int] = None, entry_id: Optional[int] = None,
+               success: bool = True, actor_email: Optional[str] = None, detail: Optional[str] = None):
+        """Queues one audit event. Never pass secrets (passwords, keys) in detail."""
+        event = (datetime.now(timezone.utc), user_id, actor_email, action, entry_id, success, detail)
+        with self._condition:
+            if len(self._buffer) >= self.capacity:
+                self._condition.notify_all() # Wake the flusher
+                if self._thread is not None:
+                    self._condition.wait(AUDIT_BACKPRESSURE_MS / 1000)
+                if len(self._buffer) >= self.capacity:
+                    self.dropped += 1
+                    if self.dropped % 1000 == 1:
+                        print(f"⚠️ Audit buffer full; {self.dropped} event(s) dropped so far.")
+                    return
+            self._buffer.append(event)
+            if len(self._buffer) >= AUDIT_BATCH_SIZE:
+                self._condition.notify_all()
+
+    def start(self, connection_factory: Callable):
+        """
+        Creates the audit table and starts the background flusher.
+        connection_factory is Database.get_connection (a context manager yielding (conn, cursor)).
+        """
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        self._connection_factory = connection_factory
+        self._pid = os.getpid()
+        self._stopping = False
+        self._create_table()
+        self._thread = threading.Thread(target=self._run, name="audit-flusher", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stops the flusher and writes every buffered event."""
+        if self._thread is None:
+            return
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        self._thread.join(timeout=10)
+        self._thread = None
+        while self._buffer:
+            if not self.flush():
+                break
+
+    def _run(self):
+        failures = 0
+        while True:
+            with self._condition:
+                if failures:
+                    # The write failed: back off (ignoring "buffer full" wake-ups) instead of spinning
+                    delay = min(AUDIT_FLUSH_INTERVAL * 2 ** min(failures - 1, 10), AUDIT_RETRY_MAX_SECONDS)
+                    deadline = time.monotonic() + delay
+                    while not self._stopping and time.monotonic() < deadline:
+                        self._condition.wait(deadline - time.monotonic())
+                elif not self._stopping and len(self._buffer) < AUDIT_BATCH_SIZE:
+                    self._condition.wait(AUDIT_FLUSH_INTERVAL)
+                if self._stopping:
+                    return
+            failures = 0 if self.flush() else failures + 1
+
+    def flush(self) -> bool:
+        """Writes up to AUDIT_BATCH_SIZE buffered events. Returns False if the write failed."""
+        with self._condition:
+            batch = [self._buffer.popleft() for _ in range(min(AUDIT_BATCH_SIZE, len(self._buffer)))]
+            self._condition.notify_all() # Room was made for blocked producers
+        if not batch or self._connection_factory is None:
+            return True
+
+        try:
+            with self._connection_factory() as (conn, cursor):
+                if not conn:
+                    raise ConnectionError("Database connection error.")
+                self._ensure_partitions(conn, cursor, {event[0] for event in batch})
+                data = io.StringIO()
+                csv.writer(data).writerows(
+                    (occurred_at.isoformat(), *("" if v is None else v for v in rest))
+                    for occurred_at, *rest in batch
+                )
+                data.seek(0)
+                cursor.copy_expert(
+                    f"COPY audit_log ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv)", data
+                )
+                conn.commit()
+            return True
+        except (psycopg2.Error, ConnectionError) as e:
+            print(f"❌ Failed to write {len(batch)} audit event(s): {e}")
+            with self._condition:
+                # Put the batch back (oldest first) if there is room; otherwise it is lost
+                room = self.capacity - len(self._buffer)
+                self._buffer.extendleft(reversed(batch[:room]))
+                self.dropped += max(0, len(batch) - room)
+            return False
+
+    def _ensure_partitions(self, conn, cursor, moments):
+        for moment in moments:
+            name = _partition_name(moment)
+            if name in self._partitions:
+                continue
+            start, end = _month_bounds(moment)
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF audit_log FOR VALUES FROM (%s) TO (%s);",
+                (start, end),
+            )
+            conn.commit()
+            self._partitions.add(name)
+
+    def _create_table(self):
+        with self._connection_factory() as (conn, cursor):
+            if not conn:
+                print("❌ Cannot create audit_log table: No database connection.")
+                return
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS audit_log (
+                    occurred_at TIMESTAMPTZ NOT NULL,
+                    user_id INTEGER,
+                    actor_email TEXT,
+                    action TEXT NOT NULL,
+                    entry_id INTEGER,
+                    success BOOLEAN NOT NULL,
+                    detail TEXT
+                ) PARTITION BY RANGE (occurred_at);
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS audit_log_user_time ON audit_log (user_id, occurred_at);')
+            # Append-only: rows can be added, and whole partitions dropped for retention, but never edited
+            cursor.execute('''
+                CREATE OR REPLACE FUNCTION audit_log_append_only() RETURNS trigger AS $$
+                BEGIN
+                    RAISE EXCEPTION 'audit_log is append-only';
+                END;
+                $$ LANGUAGE plpgsql;
+            ''')
+            cursor.execute('DROP TRIGGER IF EXISTS audit_log_no_change ON audit_log;')
+            cursor.execute('''
+                CREATE TRIGGER audit_log_no_change BEFORE UPDATE OR DELETE ON audit_log
+                FOR EACH ROW EXECUTE FUNCTION audit_log_append_only();
+            ''')
+            conn.commit()
+            print("Table 'audit_log' is ready.")
+
+    def query(self, user_id: int, since: datetime, until: datetime, action: Optional[str] = None,
+              limit: int = 100) -> Tuple[bool, Union[List[dict], str]]:
+        """
+        Returns a user's events in [since, until), newest first. The time range
+        lets Postgres prune the scan to the matching monthly partitions.
+        """
+        sql = '''
+            SELECT occurred_at, action, entry_id, success, detail FROM audit_log
+            WHERE user_id = %s AND occurred_at >= %s AND occurred_at < %s
+        '''
+        params = [user_id, since, until]
+        if action:
+            sql += " AND action = %s"
+            params.append(action)
+        sql += " ORDER BY occurred_at DESC LIMIT %s;"
+        params.append(min(limit, AUDIT_QUERY_LIMIT))
+
+        if self._connection_factory is None:
+            return False, "Audit log is not started."
+        try:
+            with self._connection_factory(read_only=True) as (conn, cursor):
+                if not conn:
+                    return False, "Database connection error."
+                cursor.execute(sql, params)
+                return True, [
+                    {"occurred_at": row[0].isoformat(), "action": row[1], "entry_id": row[2],
+                     "success": row[3], "detail": row[4]}
+                    for row in cursor
+                ]
+        except psycopg2.Error as e:
+            return False, f"Database error: {e}"
+
+
+# Shared instance used by the call sites
+audit_log = AuditLog()
+record = audit_log.record
+atexit.register(audit_log.close)
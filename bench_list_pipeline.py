@@ -0,0 +1,83 @@
+"""
+tracemalloc measurement of the password listing pipeline.
+
+Feeds the same simulated cursor rows (id, website, username, memoryview)
+through a dict-based pipeline and the current one, and reports blocks still
+allocated and peak traced memory per request. The dict-based pipeline is a
+reconstruction of the code before the listing changes, not that code itself:
+dicts + bytes copies in list_passwords, a second list of dicts in
+get_passwords, then json. The current one builds VaultRow records, and
+responses.vault_list_response streams them through lazy iter_decrypted,
+serializing and compressing one entry at a time.
+Run with:  python bench_list_pipeline.py
+"""
+import asyncio
+import json
+import tracemalloc
+
+from cryptography.fernet import Fernet
+from starlette.requests import Request
+
+import responses
+from vault_rows import VaultRow, iter_decrypted
+
+
+def make_rows(fernet: Fernet, count: int) -> list:
+    """Simulates what psycopg2 returns for the listing query."""
+    return [
+        (i, f"service-{i}.example.com", f"user{i}@example.com",
+         memoryview(fernet.encrypt(f"S3cure!Pass-{i:08d}".encode())))
+        for i in range(count)
+    ]
+
+
+def reconstructed_pipeline(fernet: Fernet, cursor_rows: list) -> int:
+    rows = list(cursor_rows) # cursor.fetchall()
+    data = [
+        {"id": row[0], "website": row[1], "username": row[2], "encrypted_password": bytes(row[3])}
+        for row in rows
+    ]
+    decrypted = []
+    for p_entry in data:
+        decrypted.append({
+            "id": p_entry["id"],
+            "website": p_entry["website"],
+            "username": p_entry["username"],
+            "password": fernet.decrypt(p_entry["encrypted_password"]).decode(),
+        })
+    return len(json.dumps({"passwords": decrypted}).encode("utf-8"))
+
+
+def current_pipeline(fernet: Fernet, cursor_rows: list) -> int:
+    rows = [VaultRow(*row) for row in iter(cursor_rows)] # Database.list_passwords
+    request = Request({"type": "http", "method": "GET", "path": "/list_passwords", "headers": []})
+    response = responses.vault_list_response(request, "passwords", iter_decrypted(fernet, rows))
+
+    async def send_body() -> int: # Each chunk is sent and dropped, as the server would
+        sent = 0
+        async for chunk in response.body_iterator:
+            sent += len(chunk)
+        return sent
+    return asyncio.run(send_body())
+
+
+def measure(pipeline, fernet: Fernet, cursor_rows: list):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    body_len = pipeline(fernet, cursor_rows)
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    allocations = sum(stat.count for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+    return body_len, allocations, peak
+
+
+if __name__ == "__main__":
+    fernet = Fernet(Fernet.generate_key())
+    for count in (1_000, 10_000):
+        cursor_rows = make_rows(fernet, count)
+        print(f"\n{count} entries")
+        print(f"{'pipeline':<12}{'live blocks':>14}{'peak KiB':>12}{'body bytes':>12}")
+        for name, pipeline in (("dict-based", reconstructed_pipeline), ("current", current_pipeline)):
+            body_len, allocations, peak = measure(pipeline, fernet, cursor_rows)
+            print(f"{name:<12}{allocations:>14}{peak / 1024:>12.1f}{body_len:>12}")
@@ -0,0 +1,152 @@
+"""
+Load benchmark for the static-ish pages (/, /login, /signup, ...).
+
+Serves the same templates through a bare ASGI app in two ways: rendered on
+every request with templates.TemplateResponse in a sync route (the previous
+path) and from pages.PageCache in an async route, as web.py now does. Then it drives many concurrent requests through each and
+reports throughput, latency and bytes sent. Browsers send Accept-Encoding
+and, on repeat visits, If-None-Match; both cases are measured. It also times
+compiling every template in a fresh worker with and without the bytecode
+cache, and rendering the emails. Run with:  python bench_pages.py
+"""
+import asyncio
+import shutil
+import statistics
+import tempfile
+import time
+import timeit
+
+import jinja2
+from fastapi import FastAPI, Request
+from fastapi.templating import Jinja2Templates
+from starlette.middleware.sessions import SessionMiddleware
+
+import pages
+import sendmail
+
+PAGES = ["index.html", "login.html", "signup.html", "forgotpassword.html",
+         "reset_password_code_verification.html", "reset_password.html"]
+CONCURRENCY = 64
+REQUESTS = 3000
+
+
+def make_app() -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(SessionMiddleware, secret_key="bench")
+    templates = Jinja2Templates(directory=pages.TEMPLATE_DIRECTORY)
+    page_cache = pages.PageCache(Jinja2Templates(env=pages.template_environment()))
+
+    @app.get("/rendered/{name}")
+    def rendered(request: Request, name: str):
+        return templates.TemplateResponse(request=request, name=name)
+
+    @app.get("/cached/{name}")
+    async def cached(request: Request, name: str):
+        return page_cache.response(request, name)
+
+    return app
+
+
+async def call(app, path: str, headers: list) -> tuple:
+    """Sends one GET straight to the ASGI app; returns (status, response headers, body size)."""
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+             "path": path, "raw_path": path.encode(), "query_string": b"", "headers": headers,
+             "client": ("127.0.0.1", 5000), "server": ("testserver", 80), "root_path": ""}
+    status, response_headers, size = 0, {}, 0
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal status, response_headers, size
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            response_headers = dict(message.get("headers", []))
+        elif message["type"] == "http.response.body":
+            size += len(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return status, response_headers, size
+
+
+async def load(app, prefix: str, headers: list, names: list = PAGES) -> dict:
+    """Sends REQUESTS requests spread over names, CONCURRENCY at a time."""
+    latencies, sent = [], 0
+    queue = iter(range(REQUESTS))
+
+    async def client():
+        nonlocal sent
+        for i in queue:
+            started = time.perf_counter()
+            status, _, size = await call(app, f"/{prefix}/{names[i % len(names)]}", headers)
+            latencies.append(time.perf_counter() - started)
+            assert status in (200, 304), status
+            sent += size
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(CONCURRENCY)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {"rps": REQUESTS / elapsed, "p50": statistics.median(latencies) * 1000,
+            "p99": latencies[int(len(latencies) * 0.99)] * 1000, "bytes": sent / REQUESTS}
+
+
+async def run_load():
+    app = make_app()
+    browser = [(b"accept-encoding", b"gzip, deflate, br")]
+    for name in PAGES: # Warm both paths: templates compiled, pages rendered
+        await call(app, f"/rendered/{name}", browser)
+        await call(app, f"/cached/{name}", browser)
+    # A repeat visit revalidates with the ETag the browser got last time
+    _, headers, _ = await call(app, "/cached/login.html", browser)
+    revalidating = browser + [(b"if-none-match", headers[b"etag"])]
+
+    print(f"\n{REQUESTS} requests, {CONCURRENCY} concurrent")
+    print(f"{'path':<40}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'bytes':>10}")
+    cases = [
+        ("TemplateResponse (previous)", "rendered", browser, PAGES),
+        ("PageCache, compressed", "cached", browser, PAGES),
+        ("PageCache, no Accept-Encoding", "cached", [], PAGES),
+        ("PageCache, If-None-Match (304)", "cached", revalidating, ["login.html"]),
+    ]
+    for label, prefix, request_headers, names in cases:
+        result = await load(app, prefix, request_headers, names)
+        print(f"{label:<40}{result['rps']:>10.0f}{result['p50']:>10.2f}{result['p99']:>10.2f}{result['bytes']:>10.0f}")
+
+
+def compile_times():
+    """Time for a fresh worker to load every template, without and with a warm bytecode cache."""
+    directory = tempfile.mkdtemp()
+    try:
+        def cold():
+            env = jinja2.Environment(loader=jinja2.FileSystemLoader(pages.TEMPLATE_DIRECTORY),
+                                     autoescape=jinja2.select_autoescape())
+            for name in PAGES + ["dashbord.html", "email/code.html"]:
+                env.get_template(name)
+
+        def warm():
+            env = jinja2.Environment(loader=jinja2.FileSystemLoader(pages.TEMPLATE_DIRECTORY),
+                                     autoescape=jinja2.select_autoescape(),
+                                     bytecode_cache=jinja2.FileSystemBytecodeCache(directory))
+            for name in PAGES + ["dashbord.html", "email/code.html"]:
+                env.get_template(name)
+
+        warm() # Fill the cache
+        print("\nLoading every template in a new worker")
+        print(f"{'compile from source':<40}{min(timeit.repeat(cold, number=1, repeat=20)) * 1000:>10.2f} ms")
+        print(f"{'from bytecode cache':<40}{min(timeit.repeat(warm, number=1, repeat=20)) * 1000:>10.2f} ms")
+    finally:
+        shutil.rmtree(directory)
+
+
+def email_times():
+    print("\nBuilding one verification email body")
+    seconds = min(timeit.repeat(lambda: sendmail.CODE_EMAIL.render(code="123456", **sendmail.VERIFICATION_EMAIL),
+                                number=1000, repeat=5))
+    print(f"{'precompiled template':<40}{seconds:>10.2f} ms") # 1000 renders, so seconds == ms per render
+
+
+if __name__ == "__main__":
+    asyncio.run(run_load())
+    compile_times()
+    email_times()
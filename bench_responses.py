@@ -0,0 +1,60 @@
+"""
+Benchmark for the /list_passwords payload.
+
+Compares the previous path (stdlib json via JSONResponse, uncompressed) with
+responses.vault_response (orjson, gzip/brotli, MessagePack) at 1k and 10k
+entries. Run with:  python bench_responses.py
+"""
+import json
+import timeit
+
+from fastapi.responses import JSONResponse
+from starlette.requests import Request
+
+import responses
+
+
+def make_payload(count: int) -> dict:
+    """Builds a list_passwords-shaped payload with count entries."""
+    return {"passwords": [
+        {
+            "id": i,
+            "website": f"service-{i}.example.com",
+            "username": f"user{i}@example.com",
+            "password": f"S3cure!Pass-{i:08d}",
+        } for i in range(count)
+    ]}
+
+
+def make_request(accept: str = "application/json", accept_encoding: str = "") -> Request:
+    """Builds a bare ASGI request carrying only the negotiation headers."""
+    headers = [(b"accept", accept.encode()), (b"accept-encoding", accept_encoding.encode())]
+    return Request({"type": "http", "method": "GET", "path": "/list_passwords", "headers": headers})
+
+
+def run(count: int, repeat: int = 20):
+    payload = make_payload(count)
+    cases = [
+        ("stdlib json (current)", lambda: JSONResponse(payload)),
+        ("orjson", lambda: responses.vault_response(make_request(), payload)),
+        ("orjson + gzip", lambda: responses.vault_response(make_request(accept_encoding="gzip"), payload)),
+    ]
+    if responses.brotli is not None:
+        cases.append(("orjson + br", lambda: responses.vault_response(make_request(accept_encoding="br"), payload)))
+    if responses.msgpack is not None:
+        cases.append(("msgpack", lambda: responses.vault_response(make_request(accept=responses.MSGPACK_MEDIA_TYPE), payload)))
+        cases.append(("msgpack + br", lambda: responses.vault_response(
+            make_request(accept=responses.MSGPACK_MEDIA_TYPE, accept_encoding="br"), payload)))
+
+    print(f"\n{count} entries (orjson={'yes' if responses.orjson else 'no'})")
+    print(f"{'path':<24}{'ms/response':>14}{'bytes':>12}")
+    for name, build in cases:
+        seconds = min(timeit.repeat(build, number=1, repeat=repeat))
+        print(f"{name:<24}{seconds * 1000:>14.2f}{len(build().body):>12}")
+
+
+if __name__ == "__main__":
+    # Sanity check that both paths carry the same data
+    assert json.loads(responses.dumps_json(make_payload(3))) == make_payload(3)
+    for size in (1_000, 10_000):
+        run(size)
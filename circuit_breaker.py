@@ -0,0 +1,84 @@
+import threading
+import time
+
+
+class CircuitBreaker:
+    """
+    A closed / open / half-open circuit breaker.
+
+    closed:    calls go through; consecutive failures are counted.
+    open:      after failure_threshold consecutive failures every call is
+               rejected immediately for reset_timeout seconds.
+    half_open: after reset_timeout a single probe call is let through; its
+               success closes the circuit, its failure opens it again.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 10.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """Returns True if a call may proceed. Cheap enough to run on every request."""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = self.HALF_OPEN
+                self._probe_in_flight = False
+            # Half-open: let exactly one probe through at a time
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                print(f"✅ Circuit '{self.name}' closed again.")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    print(f"❌ Circuit '{self.name}' opened after {self._failures} failure(s); "
+                          f"failing fast for {self.reset_timeout:g}s.")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def release_probe(self):
+        """
+        Gives back a half-open probe slot when the call never reached the node
+        (e.g. the local pool was exhausted), counting it as neither success nor failure.
+        """
+        with self._lock:
+            self._probe_in_flight = False
+
+    def reset(self):
+        """Returns the breaker to its initial closed state."""
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
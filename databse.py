@@ -1,14 +1,75 @@
 import psycopg2
 from psycopg2 import pool # Import the connection pool module
 import os
+import time
+import random
+import threading
 from dotenv import load_dotenv
 from contextlib import contextmanager
-from typing import Union, Optional, Tuple, Dict, Any
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Union, Optional, Tuple, Dict, Any, List
 from urllib.parse import urlparse, parse_qs # For parsing DATABASE_URL if needed
+from vault_rows import VaultRow
+from circuit_breaker import CircuitBreaker
+import audit
+import tracing
+import sharding
 
 # Load environment variables from a .env file
 load_dotenv()
 
+# Read replicas (optional): comma-separated DSNs in the same format as DATABASE_URL
+REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+REPLICA_STICKY_SECONDS = float(os.getenv("DB_REPLICA_STICKY_SECONDS", "5")) # Reads go to the primary this long after a write
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "2"))
+REPLICA_LAG_CHECK_SECONDS = float(os.getenv("DB_REPLICA_LAG_CHECK_SECONDS", "1")) # How often each replica's lag is measured
+REPLICA_RETRY_SECONDS = float(os.getenv("DB_REPLICA_RETRY_SECONDS", "10")) # How long a failed or lagging replica is skipped
+
+# Outage handling
+CONNECT_TIMEOUT_SECONDS = int(os.getenv("DB_CONNECT_TIMEOUT", "3"))
+STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "5000")) # Session default for every query
+READ_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_READ_STATEMENT_TIMEOUT_MS", "2000")) # Tighter limit for the hot read paths
+READ_RETRIES = int(os.getenv("DB_READ_RETRIES", "2")) # Extra attempts for idempotent reads
+RETRY_BASE_DELAY = float(os.getenv("DB_RETRY_BASE_DELAY", "0.05"))
+RETRY_MAX_DELAY = float(os.getenv("DB_RETRY_MAX_DELAY", "0.5"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("DB_BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("DB_BREAKER_RESET_SECONDS", "5"))
+
+# The current request's session-wide write marker: {"at": wall-clock time of the session's
+# last write, or None}. ReadYourWritesMiddleware loads it from and saves it to the session
+# cookie, so read-your-writes holds even when the next request lands on another worker.
+session_last_write: ContextVar[Optional[dict]] = ContextVar("session_last_write", default=None)
+
+
+class ReadYourWritesMiddleware:
+    """
+    ASGI middleware carrying the time of a session's last database write in
+    the session cookie (key "db_last_write"). Add it inside SessionMiddleware.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not Database._replica_pools or "session" not in scope:
+            await self.app(scope, receive, send)
+            return
+        loaded = scope["session"].get("db_last_write")
+        marker = {"at": loaded} # Mutated in place, so writes from threadpool endpoints are seen here
+        token = session_last_write.set(marker)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and marker["at"] != loaded:
+                scope["session"]["db_last_write"] = marker["at"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            session_last_write.reset(token)
+
+
 class Database:
     """
     Handles all database operations for the application.
@@ -16,6 +77,26 @@ class Database:
     and cursors safely using a context manager.
     """
     _connection_pool: Optional[pool.SimpleConnectionPool] = None
+    _pool_pid: Optional[int] = None # PID of the process that created _connection_pool
+    _inherited_pools: list = [] # Pools copied across fork(); kept referenced so they are never closed here
+    _replica_pools: Dict[str, pool.SimpleConnectionPool] = {} # One pool per replica DSN
+    _replica_down_until: Dict[str, float] = {} # Replica DSN -> monotonic time until which it is skipped
+    _replica_lag_checked: Dict[str, float] = {} # Replica DSN -> monotonic time of the last lag check
+    _replica_cursor = 0 # Round-robin position among replicas
+    _recent_writes: Dict[str, float] = {} # Sticky key -> monotonic time of the last write
+    _routing_lock = threading.Lock()
+    _breaker = CircuitBreaker("primary", BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS) # Guards the primary
+    _shard_pools: Dict[str, pool.SimpleConnectionPool] = {} # Shard name -> pool (sharded mode only)
+    _shard_breakers: Dict[str, CircuitBreaker] = {}
+    _directory_cache: Dict[str, Tuple[float, int, str, bool]] = {} # "email:x"/"user_id:n" -> (expires, user_id, shard, fenced)
+
+    UNROUTABLE = "__unroutable__" # Shard value for requests that must not run (unknown route or fenced user)
+    # Per-user tables whose ids must stay unique across shards: (table, id sequence)
+    STRIPED_ID_TABLES = (("passwords", "passwords_id_seq"), ("attachments", "attachments_id_seq"),
+                         ("password_revisions", "password_revisions_id_seq"))
+    # Fernet-encrypted columns per table, for maintenance scans (verify, re-encrypt)
+    CIPHERTEXT_COLUMNS = {"passwords": ("password", "totp_secret"), "password_revisions": ("password", "totp_secret"),
+                          "attachments": ("wrapped_key",)}
 
     def __init__(self):
         """Initializes the database connection details and the connection pool."""
@@ -23,55 +104,9 @@ class Database:
             print("Database instance already initialized. Reusing existing pool.")
             return
 
-        conn_params: Dict[str, Any] = {}
-        try:
-            DATABASE_URL = os.environ.get('DATABASE_URL')
-
-            if DATABASE_URL:
-                # Parse the DATABASE_URL into a dictionary of connection parameters
-                # This is a common way to parse DSNs when psycopg2.connect doesn't directly
-                # take individual kwargs, or when building a pool with kwargs.
-                # psycopg2.connect() can take the DSN string directly, but the pool needs kwargs.
-                parsed_url = urlparse(DATABASE_URL)
-                conn_params = {
-                    "host": parsed_url.hostname,
-                    "port": parsed_url.port or 5432, # Default to 5432 if not specified
-                    "database": parsed_url.path[1:] if parsed_url.path else None, # Remove leading '/'
-                    "user": parsed_url.username,
-                    "password": parsed_url.password,
-                    # Add any query parameters as connection options, e.g., sslmode
-                    **{k: v[0] for k, v in parse_qs(parsed_url.query).items()}
-                }
-                # Remove None values
-                conn_params = {k: v for k, v in conn_params.items() if v is not None}
-                
-                # Add SSL mode for Render if not already in URL (Render usually requires SSL)
-                if 'sslmode' not in conn_params and 'render' in (conn_params.get('host') or '').lower():
-                    conn_params['sslmode'] = 'require'
-
-            else:
-                # Fallback for local development if needed, using individual local credentials
-                conn_params = {
-                    "host": os.getenv("DB_HOST", "localhost"),
-                    "port": int(os.getenv("DB_PORT", "5432")), # Ensure port is int
-                    "database": os.getenv("DB_NAME"),
-                    "user": os.getenv("DB_USER"),
-                    "password": os.getenv("DB_PASSWORD")
-                }
-                # Filter out None values in case env vars are missing
-                conn_params = {k: v for k, v in conn_params.items() if v is not None}
-
-            if not conn_params.get("database"):
-                raise ValueError("Database name (DB_NAME or part of DATABASE_URL) is not set.")
+        try:
+            Database._create_pool()
 
-            # Initialize the connection pool
-            # Min and max connections in the pool
-            min_conn = int(os.getenv("DB_MIN_CONN", "1"))
-            max_conn = int(os.getenv("DB_MAX_CONN", "10"))
-            Database._connection_pool = pool.SimpleConnectionPool(min_conn, max_conn, **conn_params)
-            
-            print("✅ Database connection pool initialized successfully.")
-            
             # Test connection and create tables on startup
             with self.get_connection() as (conn, cursor):
                 if conn:
@@ -79,46 +114,324 @@ class Database:
                     self._create_tables() # Call the _create_tables method
                 else:
                     raise ConnectionError("Failed to establish database connection from pool.")
+            for shard in Database._shard_pools:
+                self._create_tables(shard=shard)
 
         except Exception as e:
             print(f"❌ Critical Error during Database initialization: {e}")
             Database._connection_pool = None # Ensure pool is None on failure
             raise # Re-raise the exception to indicate a critical setup failure
 
+    @staticmethod
+    def _connection_params(database_url: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Builds psycopg2 connection parameters from database_url (a replica DSN),
+        or for the primary from DATABASE_URL or the DB_* variables.
+        """
+        DATABASE_URL = database_url or os.environ.get('DATABASE_URL')
+
+        if DATABASE_URL:
+            # Parse the DATABASE_URL into a dictionary of connection parameters
+            # This is a common way to parse DSNs when psycopg2.connect doesn't directly
+            # take individual kwargs, or when building a pool with kwargs.
+            # psycopg2.connect() can take the DSN string directly, but the pool needs kwargs.
+            parsed_url = urlparse(DATABASE_URL)
+            conn_params = {
+                "host": parsed_url.hostname,
+                "port": parsed_url.port or 5432, # Default to 5432 if not specified
+                "database": parsed_url.path[1:] if parsed_url.path else None, # Remove leading '/'
+                "user": parsed_url.username,
+                "password": parsed_url.password,
+                # Add any query parameters as connection options, e.g., sslmode
+                **{k: v[0] for k, v in parse_qs(parsed_url.query).items()}
+            }
+            # Remove None values
+            conn_params = {k: v for k, v in conn_params.items() if v is not None}
+            
+            # Add SSL mode for Render if not already in URL (Render usually requires SSL)
+            if 'sslmode' not in conn_params and 'render' in (conn_params.get('host') or '').lower():
+                conn_params['sslmode'] = 'require'
+
+        else:
+            # Fallback for local development if needed, using individual local credentials
+            conn_params = {
+                "host": os.getenv("DB_HOST", "localhost"),
+                "port": int(os.getenv("DB_PORT", "5432")), # Ensure port is int
+                "database": os.getenv("DB_NAME"),
+                "user": os.getenv("DB_USER"),
+                "password": os.getenv("DB_PASSWORD")
+            }
+            # Filter out None values in case env vars are missing
+            conn_params = {k: v for k, v in conn_params.items() if v is not None}
+
+        if not conn_params.get("database"):
+            raise ValueError("Database name (DB_NAME or part of DATABASE_URL) is not set.")
+
+        # Bound how long a dead server can hold a request, unless the DSN says otherwise
+        conn_params.setdefault("connect_timeout", CONNECT_TIMEOUT_SECONDS)
+        conn_params.setdefault("options", f"-c statement_timeout={STATEMENT_TIMEOUT_MS}")
+        return conn_params
+
+    @staticmethod
+    def _create_pool():
+        """Creates the connection pool for the current process."""
+        # Min and max connections in the pool
+        min_conn = int(os.getenv("DB_MIN_CONN", "1"))
+        max_conn = int(os.getenv("DB_MAX_CONN", "10"))
+        Database._connection_pool = pool.SimpleConnectionPool(min_conn, max_conn, **Database._connection_params())
+        Database._pool_pid = os.getpid()
+        print(f"✅ Database connection pool initialized successfully (pid {Database._pool_pid}).")
+
+        # Replica pools start empty (minconn 0) so an unreachable replica never blocks startup
+        Database._replica_pools = {
+            url: pool.SimpleConnectionPool(0, max_conn, **Database._connection_params(url))
+            for url in REPLICA_URLS
+        }
+        Database._replica_down_until = {}
+        Database._replica_lag_checked = {}
+        if REPLICA_URLS:
+            print(f"✅ {len(REPLICA_URLS)} read replica pool(s) configured.")
+
+        Database._shard_pools = {
+            name: pool.SimpleConnectionPool(0, max_conn, **Database._connection_params(url))
+            for name, url in sharding.SHARD_URLS.items()
+        }
+        Database._shard_breakers = {
+            name: Database._shard_breakers.get(name) or CircuitBreaker(f"shard {name}", BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS)
+            for name in sharding.SHARD_URLS
+        }
+        if sharding.SHARD_URLS:
+            print(f"✅ {len(sharding.SHARD_URLS)} shard pool(s) configured: {', '.join(sharding.SHARD_URLS)}.")
+
+    @staticmethod
+    def _discard_inherited_pool():
+        """
+        Runs in a forked child. The parent's connections share sockets with the
+        child, so they must not be used or closed here; the pool is parked and a
+        fresh one is created on first use in this process.
+        """
+        if Database._connection_pool is not None and Database._pool_pid != os.getpid():
+            Database._inherited_pools.append(Database._connection_pool)
+            Database._inherited_pools.extend(Database._replica_pools.values())
+            Database._inherited_pools.extend(Database._shard_pools.values())
+            Database._connection_pool = None
+            Database._replica_pools = {}
+            Database._shard_pools = {}
+            # The lock may have been held by another thread of the parent at fork time
+            Database._routing_lock = threading.Lock()
+
+    @staticmethod
+    def _note_write(sticky_key: Optional[str]):
+        """Records a write so reads for the same key stay on the primary for REPLICA_STICKY_SECONDS."""
+        if not Database._replica_pools:
+            return
+        marker = session_last_write.get()
+        if marker is not None:
+            marker["at"] = time.time()
+        if sticky_key is None:
+            return
+        now = time.monotonic()
+        with Database._routing_lock:
+            Database._recent_writes[sticky_key] = now
+            # Keep the map from growing without bound
+            if len(Database._recent_writes) > 10000:
+                Database._recent_writes = {
+                    k: t for k, t in Database._recent_writes.items() if now - t < REPLICA_STICKY_SECONDS
+                }
+
+    @staticmethod
+    def _is_sticky(sticky_key: Optional[str]) -> bool:
+        """
+        True if the key wrote recently enough (in this worker), or the current
+        session did (in any worker), that a replica may not have the change yet.
+        """
+        marker = session_last_write.get()
+        if marker is not None and marker["at"] is not None and time.time() - marker["at"] < REPLICA_STICKY_SECONDS:
+            return True
+        written_at = Database._recent_writes.get(sticky_key) if sticky_key is not None else None
+        return written_at is not None and time.monotonic() - written_at < REPLICA_STICKY_SECONDS
+
+    @staticmethod
+    def _mark_replica_down(url: str, reason: str):
+        Database._replica_down_until[url] = time.monotonic() + REPLICA_RETRY_SECONDS
+        print(f"⚠️ Read replica {urlparse(url).hostname} skipped for {REPLICA_RETRY_SECONDS:g}s: {reason}")
+
+    def _acquire_replica(self) -> Tuple[Optional[pool.SimpleConnectionPool], Optional[psycopg2.extensions.connection]]:
+        """
+        Returns (pool, connection) for a healthy replica, trying them round-robin,
+        or (None, None) when every replica is down or lagging.
+        """
+        urls = list(Database._replica_pools)
+        with Database._routing_lock:
+            start = Database._replica_cursor
+            Database._replica_cursor = (start + 1) % max(len(urls), 1)
+
+        for offset in range(len(urls)):
+            url = urls[(start + offset) % len(urls)]
+            now = time.monotonic()
+            if Database._replica_down_until.get(url, 0) > now:
+                continue
+            replica_pool = Database._replica_pools[url]
+            conn = None
+            try:
+                conn = replica_pool.getconn()
+                if now - Database._replica_lag_checked.get(url, 0) >= REPLICA_LAG_CHECK_SECONDS:
+                    with conn.cursor() as cursor:
+                        # A replica that has replayed all the WAL it received is current, however long ago the
+                        # primary's last commit was; otherwise the lag is the age of the last replayed commit.
+                        # A NULL replay timestamp means the node is not replaying WAL (e.g. a promoted node).
+                        cursor.execute("""
+                            SELECT CASE
+                                WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                                ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                            END;
+                        """)
+                        lag = float(cursor.fetchone()[0])
+                    conn.rollback()
+                    Database._replica_lag_checked[url] = now
+                    if lag > REPLICA_MAX_LAG_SECONDS:
+                        replica_pool.putconn(conn)
+                        self._mark_replica_down(url, f"replication lag {lag:.1f}s")
+                        continue
+                return replica_pool, conn
+            except pool.PoolError:
+                continue # Every connection to this replica is busy; it is not unhealthy
+            except psycopg2.Error as e:
+                if conn:
+                    replica_pool.putconn(conn, close=True)
+                self._mark_replica_down(url, str(e).strip())
+        return None, None
+
     @contextmanager
-    def get_connection(self) -> Tuple[Optional[psycopg2.extensions.connection], Optional[psycopg2.extensions.cursor]]:
+    def get_connection(self, read_only: bool = False, sticky_key: Optional[str] = None,
+                       statement_timeout_ms: Optional[int] = None, shard: Optional[str] = None) -> Tuple[Optional[psycopg2.extensions.connection], Optional[psycopg2.extensions.cursor]]:
         """
         Provides a database connection from the pool.
         This method is a context manager, ensuring that connections are
         returned to the pool safely and automatically.
+
+        With read_only=True the connection comes from a read replica when one is
+        configured and healthy, unless sticky_key wrote within the last
+        REPLICA_STICKY_SECONDS; otherwise it comes from the primary.
+
+        Primary access goes through a circuit breaker: while it is open this
+        yields (None, None) immediately instead of waiting on a dead server.
+        statement_timeout_ms overrides the session statement timeout for the
+        transaction opened on this connection.
+
+        Connection-level errors raised inside the block are recorded and
+        re-raised; the broken connection is closed instead of being reused.
+
+        shard selects a shard's pool instead of the primary (see _user_shard);
+        Database.UNROUTABLE yields (None, None).
         """
-        if Database._connection_pool is None:
-            print("❌ Database pool not initialized. Cannot get connection.")
+        if Database._pool_pid is not None and Database._pool_pid != os.getpid():
+            # First use after a fork: build this worker's own pool
+            Database._discard_inherited_pool()
+            try:
+                Database._create_pool()
+            except Exception as e:
+                print(f"❌ Could not create connection pool in worker {os.getpid()}: {e}")
+
+        if shard == Database.UNROUTABLE:
             yield None, None
             return
-            
-        conn = None
+
+        node_pool, conn, replica_url = None, None, None
+        breaker = Database._breaker
+        if shard is not None:
+            node_pool = Database._shard_pools.get(shard)
+            breaker = Database._shard_breakers.get(shard)
+            if node_pool is None:
+                print(f"❌ Unknown shard '{shard}'. Cannot get connection.")
+                yield None, None
+                return
+        elif read_only and Database._replica_pools and not self._is_sticky(sticky_key):
+            with tracing.span("db.pool_wait", node="replica"):
+                node_pool, conn = self._acquire_replica()
+            if conn is not None:
+                replica_url = next(url for url, p in Database._replica_pools.items() if p is node_pool)
+
+        if conn is None:
+            if node_pool is None:
+                if Database._connection_pool is None:
+                    print("❌ Database pool not initialized. Cannot get connection.")
+                    yield None, None
+                    return
+                node_pool = Database._connection_pool
+            if not breaker.allow():
+                # Fail fast while the node is known to be down
+                yield None, None
+                return
+            try:
+                with tracing.span("db.pool_wait", node=shard or "primary"):
+                    conn = node_pool.getconn() # Get connection from pool
+            except (psycopg2.Error, pool.PoolError) as e:
+                print(f"❌ Database Connection Error: {e}")
+                if not isinstance(e, pool.PoolError): # An exhausted pool is not an outage
+                    breaker.record_failure()
+                else:
+                    breaker.release_probe() # Nothing reached the node, so this says nothing about its health
+                yield None, None
+                return
+
+        discard = False
         try:
-            conn = Database._connection_pool.getconn() # Get connection from pool
-            cursor = conn.cursor()
+            cursor = conn.cursor(cursor_factory=tracing.TracedCursor)
+            if statement_timeout_ms is not None:
+                cursor.execute("SET LOCAL statement_timeout = %s;", (int(statement_timeout_ms),))
             yield conn, cursor
-        except psycopg2.Error as e:
+        except psycopg2.OperationalError as e:
             print(f"❌ Database Connection Error: {e}")
-            if conn:
-                # If an error occurs, return the connection to the pool (it might be broken)
-                # or consider closing and discarding it if it's truly unrecoverable.
-                # For SimpleConnectionPool, putconn handles this.
-                Database._connection_pool.putconn(conn)
-            yield None, None
+            # A cancelled statement (timeout) leaves a healthy connection; anything else means a broken one
+            if not isinstance(e, psycopg2.extensions.QueryCanceledError):
+                discard = True
+                if replica_url is None:
+                    breaker.record_failure()
+                else:
+                    self._mark_replica_down(replica_url, str(e).strip())
+            raise
         finally:
-            if conn:
-                # Return the connection to the pool after use
-                # This is crucial for connection pooling to work correctly
-                Database._connection_pool.putconn(conn)
+            if replica_url is None and not discard:
+                # The server answered (even if with an error), so the node is reachable
+                breaker.record_success()
+            # Return the connection to the pool after use
+            # This is crucial for connection pooling to work correctly
+            node_pool.putconn(conn, close=discard or conn.closed != 0)
 
-    def _create_tables(self):
-        """Creates the USER and PASSWORDS tables if they don't exist."""
-        with self.get_connection() as (conn, cursor):
+    def _read_with_retry(self, sticky_key: Optional[str], work, unavailable, shard: Optional[str] = None):
+        """
+        Runs an idempotent read, work(cursor), retrying connection-level failures
+        up to READ_RETRIES times with full-jitter exponential backoff.
+        Returns unavailable when no attempt could reach the database.
+        Retries stop as soon as the node's circuit is open.
+        """
+        if shard == Database.UNROUTABLE:
+            return unavailable
+        breaker = Database._shard_breakers.get(shard, Database._breaker) if shard else Database._breaker
+        for attempt in range(READ_RETRIES + 1):
+            try:
+                with self.get_connection(read_only=True, sticky_key=sticky_key, shard=shard,
+                                         statement_timeout_ms=READ_STATEMENT_TIMEOUT_MS) as (conn, cursor):
+                    if conn:
+                        return work(cursor)
+            except psycopg2.extensions.QueryCanceledError:
+                raise # Timed out: retrying would only add load
+            except psycopg2.OperationalError as e:
+                print(f"⚠️ Read attempt {attempt + 1} failed: {e}")
+            if attempt == READ_RETRIES or breaker.state == CircuitBreaker.OPEN:
+                break
+            time.sleep(random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)))
+        return unavailable
+
+    def _create_tables(self, shard: Optional[str] = None):
+        """
+        Creates the USER, PASSWORDS and attachment tables if they don't exist, on
+        the primary or on the given shard. In sharded mode the primary also gets
+        the user_directory, and each shard's STRIPED_ID_TABLES ids are striped by
+        SHARD_ID_STRIDE so ids stay unique when rows move between shards.
+        """
+        with self.get_connection(shard=shard) as (conn, cursor):
             if not conn:
                 print("❌ Cannot create tables: No database connection.")
                 return
@@ -147,13 +460,223 @@ class Database:
                 );
             ''')
             conn.commit()
+            # Optional 2FA seed, encrypted like the password; the partial index serves the TOTP lookup
+            cursor.execute('ALTER TABLE passwords ADD COLUMN IF NOT EXISTS totp_secret BYTEA;')
+            cursor.execute('CREATE INDEX IF NOT EXISTS passwords_user_id ON passwords (user_id);')
+            cursor.execute(
+                'CREATE INDEX IF NOT EXISTS passwords_totp_user_id ON passwords (user_id) WHERE totp_secret IS NOT NULL;'
+            )
+            conn.commit()
+
+            # Earlier versions of vault entries, written by the same statement that updates
+            # or deletes the entry. Kept apart so history never bloats the passwords table;
+            # history.py prunes it by count and age.
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS password_revisions (
+                    id SERIAL PRIMARY KEY,
+                    password_id INTEGER NOT NULL, -- No FK: a deleted entry's history outlives it
+                    user_id INTEGER NOT NULL REFERENCES "USER"(user_id) ON DELETE CASCADE,
+                    website TEXT NOT NULL,
+                    username TEXT NOT NULL,
+                    password BYTEA NOT NULL,
+                    totp_secret BYTEA,
+                    action TEXT NOT NULL CHECK (action IN ('update', 'delete', 'restore')), -- What replaced this version
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                );
+            ''')
+            cursor.execute(
+                'CREATE INDEX IF NOT EXISTS password_revisions_entry ON password_revisions (user_id, password_id, id);'
+            )
+            cursor.execute('CREATE INDEX IF NOT EXISTS password_revisions_created_at ON password_revisions (created_at);')
+            conn.commit()
+
+            # Encrypted file attachments and secure notes, stored as fixed-size chunks
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS attachments (
+                    id SERIAL PRIMARY KEY,
+                    user_id INTEGER NOT NULL REFERENCES "USER"(user_id) ON DELETE CASCADE,
+                    password_id INTEGER REFERENCES passwords(id) ON DELETE SET NULL, -- Optional vault entry it belongs to
+                    detached_from INTEGER, -- The deleted entry it belonged to, so undelete can re-attach it
+                    kind TEXT NOT NULL, -- 'file' or 'note'
+                    filename TEXT NOT NULL,
+                    content_type TEXT NOT NULL,
+                    size BIGINT NOT NULL DEFAULT 0,
+                    chunk_size INTEGER NOT NULL,
+                    chunk_count INTEGER NOT NULL DEFAULT 0,
+                    wrapped_key BYTEA NOT NULL, -- Per-attachment data key, encrypted with the vault key
+                    complete BOOLEAN NOT NULL DEFAULT FALSE,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                );
+            ''')
+            # Older tables cascaded entry deletes to attachments, which made undelete lose them
+            cursor.execute('ALTER TABLE attachments ADD COLUMN IF NOT EXISTS detached_from INTEGER;')
+            cursor.execute("""
+                SELECT 1 FROM pg_constraint
+                WHERE conrelid = 'attachments'::regclass AND contype = 'f' AND confdeltype = 'c'
+                  AND confrelid = 'passwords'::regclass;
+            """)
+            if cursor.fetchone():
+                cursor.execute('''
+                    ALTER TABLE attachments DROP CONSTRAINT attachments_password_id_fkey,
+                        ADD CONSTRAINT attachments_password_id_fkey
+                        FOREIGN KEY (password_id) REFERENCES passwords(id) ON DELETE SET NULL;
+                ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS attachments_user_id ON attachments (user_id);')
+            cursor.execute(
+                'CREATE INDEX IF NOT EXISTS attachments_detached ON attachments (detached_from) WHERE detached_from IS NOT NULL;'
+            )
+            cursor.execute('CREATE INDEX IF NOT EXISTS attachments_unfinished ON attachments (created_at) WHERE NOT complete;')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS attachment_chunks (
+                    attachment_id INTEGER NOT NULL REFERENCES attachments(id) ON DELETE CASCADE,
+                    chunk_index INTEGER NOT NULL,
+                    data BYTEA NOT NULL,
+                    PRIMARY KEY (attachment_id, chunk_index)
+                );
+            ''')
+            conn.commit()
+
+            if shard is not None:
+                slot = list(sharding.SHARD_URLS).index(shard) + 1
+                for table, sequence in Database.STRIPED_ID_TABLES:
+                    self._stripe_ids(conn, cursor, table, sequence, slot)
+                print(f"Tables 'USER' and 'passwords' are ready on shard {shard}.")
+                return
+
+            # Organizations and shared collections live on the primary, next to the
+            # directory, because their members may sit on different shards
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS organizations (
+                    id SERIAL PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                );
+                CREATE TABLE IF NOT EXISTS organization_members (
+                    organization_id INTEGER NOT NULL REFERENCES organizations(id) ON DELETE CASCADE,
+                    user_id INTEGER NOT NULL, -- No FK: with sharding, users live on the shards
+                    role TEXT NOT NULL CHECK (role IN ('owner', 'admin', 'member')),
+                    PRIMARY KEY (organization_id, user_id)
+                );
+                CREATE INDEX IF NOT EXISTS organization_members_user_id ON organization_members (user_id);
+                CREATE TABLE IF NOT EXISTS collections (
+                    id SERIAL PRIMARY KEY,
+                    organization_id INTEGER NOT NULL REFERENCES organizations(id) ON DELETE CASCADE,
+                    name TEXT NOT NULL,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                );
+                CREATE INDEX IF NOT EXISTS collections_organization_id ON collections (organization_id);
+                CREATE TABLE IF NOT EXISTS collection_members (
+                    user_id INTEGER NOT NULL,
+                    collection_id INTEGER NOT NULL REFERENCES collections(id) ON DELETE CASCADE,
+                    permission TEXT NOT NULL CHECK (permission IN ('read', 'write', 'manage')),
+                    wrapped_key BYTEA NOT NULL, -- The collection's data key, wrapped for this member
+                    PRIMARY KEY (user_id, collection_id) -- user_id first: the listing looks members up by user
+                );
+                CREATE INDEX IF NOT EXISTS collection_members_collection_id ON collection_members (collection_id);
+                CREATE TABLE IF NOT EXISTS collection_entries (
+                    id SERIAL PRIMARY KEY,
+                    collection_id INTEGER NOT NULL REFERENCES collections(id) ON DELETE CASCADE,
+                    website TEXT NOT NULL,
+                    username TEXT NOT NULL,
+                    password BYTEA NOT NULL, -- Encrypted with the collection's data key
+                    updated_by INTEGER,
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                );
+                CREATE INDEX IF NOT EXISTS collection_entries_collection_id ON collection_entries (collection_id);
+            ''')
+            conn.commit()
+
+            if sharding.SHARD_URLS:
+                cursor.execute('CREATE SEQUENCE IF NOT EXISTS user_directory_user_id_seq;')
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS user_directory (
+                        email TEXT PRIMARY KEY,
+                        user_id INTEGER UNIQUE NOT NULL,
+                        shard TEXT NOT NULL,
+                        fenced BOOLEAN NOT NULL DEFAULT FALSE -- TRUE while the user's rows are being moved
+                    );
+                ''')
+                conn.commit()
             print("Tables 'USER' and 'passwords' are ready.")
 
+    @staticmethod
+    def _stripe_ids(conn, cursor, table: str, sequence: str, slot: int):
+        """Makes this shard's ids for table congruent to slot modulo SHARD_ID_STRIDE (done once)."""
+        stride = sharding.SHARD_ID_STRIDE
+        cursor.execute("SELECT increment_by FROM pg_sequences WHERE sequencename = %s;", (sequence,))
+        row = cursor.fetchone()
+        if not row or row[0] == stride:
+            return
+        cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table};")
+        highest = cursor.fetchone()[0]
+        next_id = highest // stride * stride + slot # Smallest id in this shard's slot above every existing id
+        if next_id <= highest:
+            next_id += stride
+        cursor.execute(f"ALTER SEQUENCE {sequence} INCREMENT BY {stride};")
+        cursor.execute("SELECT setval(%s, %s, false);", (sequence, next_id))
+        conn.commit()
+
+    def _directory_lookup(self, column: str, value) -> Union[Tuple[int, str, bool], None, bool]:
+        """
+        Finds a user in the global user_directory by "email" or "user_id".
+        Returns (user_id, shard, fenced), None if there is no such user, or
+        False if the directory could not be reached. Results are cached per
+        worker for SHARD_DIRECTORY_TTL seconds.
+        """
+        now = time.monotonic()
+        cached = Database._directory_cache.get(f"{column}:{value}")
+        if cached and cached[0] > now:
+            return cached[1:]
+
+        with self.get_connection() as (conn, cursor):
+            if not conn:
+                return False
+            cursor.execute(
+                f"SELECT email, user_id, shard, fenced FROM user_directory WHERE {column} = %s;", (value,)
+            )
+            row = cursor.fetchone()
+        if not row:
+            return None
+        email, user_id, shard, fenced = row
+        entry = (now + sharding.SHARD_DIRECTORY_TTL, user_id, shard, fenced)
+        if len(Database._directory_cache) > 100000:
+            Database._directory_cache = {}
+        Database._directory_cache[f"email:{email}"] = entry
+        Database._directory_cache[f"user_id:{user_id}"] = entry
+        return entry[1:]
+
+    def _route(self, column: str, value, write: bool) -> Optional[str]:
+        if not sharding.SHARD_URLS:
+            return None # Unsharded: everything lives on the primary
+        entry = self._directory_lookup(column, value)
+        if entry is False:
+            return Database.UNROUTABLE
+        if entry is None:
+            # Unknown user: ids fall back to the ring; unknown emails go to the primary,
+            # which holds no users in sharded mode, so lookups simply find nothing
+            return sharding.ring.node_for(value) if column == "user_id" else None
+        _, shard, fenced = entry
+        if write and fenced:
+            print(f"⚠️ Write refused: user is being moved to another shard ({column}={value}).")
+            return Database.UNROUTABLE
+        return shard
+
+    def _user_shard(self, user_id: int, write: bool = False) -> Optional[str]:
+        """Returns the shard holding user_id's rows (None when sharding is off)."""
+        return self._route("user_id", user_id, write)
+
+    def _email_shard(self, email: str, write: bool = False) -> Optional[str]:
+        """Returns the shard holding the user with this email (None when sharding is off)."""
+        return self._route("email", email, write)
+
     def create_user(self, username: str, email: str, password: str) -> Tuple[bool, str]:
         """
         Creates a new user in the database.
         Returns a tuple: (success: bool, message: str)
         """
+        if sharding.SHARD_URLS:
+            return self._create_sharded_user(username, email, password)
+
         with self.get_connection() as (conn, cursor):
             if not conn:
                 return False, "Database connection error."
@@ -170,34 +693,97 @@ class Database:
                     (username, email, password, "not_verified")
                 )
                 conn.commit()
+                self._note_write(f"email:{email}")
+                audit.record("signup", actor_email=email)
                 return True, "User created successfully."
             except psycopg2.Error as e:
                 return False, str(e)
 
-    def check_verification_status(self, email: str) -> Optional[str]:
+    def _create_sharded_user(self, username: str, email: str, password: str) -> Tuple[bool, str]:
         """
-        Checks the verification status for a given email.
-        Returns the status string ("verified" or "not_verified") or None if not found.
+        Registers the user in the global directory (which allocates the user_id
+        and claims the email), then creates the USER row on the shard the ring
+        assigns. The directory entry is removed again if the shard insert fails.
         """
         with self.get_connection() as (conn, cursor):
             if not conn:
-                return None
+                return False, "Database connection error."
+            try:
+                cursor.execute("SELECT nextval('user_directory_user_id_seq');")
+                user_id = cursor.fetchone()[0]
+                shard = sharding.ring.node_for(user_id)
+                cursor.execute(
+                    "INSERT INTO user_directory (email, user_id, shard) VALUES (%s, %s, %s) "
+                    "ON CONFLICT (email) DO NOTHING RETURNING user_id;",
+                    (email, user_id, shard)
+                )
+                claimed = cursor.fetchone()
+                conn.commit()
+            except psycopg2.Error as e:
+                conn.rollback()
+                return False, str(e)
+        if not claimed:
+            return False, "Email is already registered."
+
+        error = "Database connection error."
+        with self.get_connection(shard=shard) as (conn, cursor):
+            if conn:
+                try:
+                    cursor.execute(
+                        'INSERT INTO "USER" (user_id, username, email, password, verification_status) VALUES (%s, %s, %s, %s, %s)',
+                        (user_id, username, email, password, "not_verified")
+                    )
+                    conn.commit()
+                    self._note_write(f"email:{email}")
+                    audit.record("signup", user_id=user_id, actor_email=email)
+                    return True, "User created successfully."
+                except psycopg2.Error as e:
+                    conn.rollback()
+                    error = str(e)
+        self._forget_directory_entry(email)
+        return False, error
+
+    def _forget_directory_entry(self, email: str):
+        """Removes a user from the global directory (sharded mode only)."""
+        if not sharding.SHARD_URLS:
+            return
+        with self.get_connection() as (conn, cursor):
+            if conn:
+                cursor.execute("DELETE FROM user_directory WHERE email = %s RETURNING user_id;", (email,))
+                row = cursor.fetchone()
+                conn.commit()
+                Database._directory_cache.pop(f"email:{email}", None)
+                if row:
+                    Database._directory_cache.pop(f"user_id:{row[0]}", None)
 
+    def check_verification_status(self, email: str) -> Optional[str]:
+        """
+        Checks the verification status for a given email.
+        Returns the status string ("verified" or "not_verified") or None if not found.
+        """
+        def work(cursor):
             cursor.execute('SELECT verification_status FROM "USER" WHERE email = %s', (email,))
             result = cursor.fetchone()
             return result[0] if result else None
 
+        try:
+            return self._read_with_retry(f"email:{email}", work, None, shard=self._email_shard(email))
+        except psycopg2.Error as e:
+            print(f"❌ Database error while checking verification status: {e}")
+            return None
+
     def update_verification_status(self, email: str, status: str = "verified") -> Tuple[bool, str]:
         """
         Updates the user's verification status.
         Returns a tuple: (success: bool, message: str)
         """
-        with self.get_connection() as (conn, cursor):
+        with self.get_connection(shard=self._email_shard(email, write=True)) as (conn, cursor):
             if not conn:
                 return False, "Database connection error."
             
             cursor.execute('UPDATE "USER" SET verification_status = %s WHERE email = %s', (status, email))
             conn.commit()
+            self._note_write(f"email:{email}")
             # rowcount checks if any row was updated
             if cursor.rowcount > 0:
                 return True, "Verification status updated."
@@ -209,23 +795,26 @@ class Database:
         Retrieves a user by email.
         Returns the user record as a tuple or None if not found.
         """
-        with self.get_connection() as (conn, cursor):
-            if not conn:
-                return None
-            
+        def work(cursor):
             cursor.execute('SELECT * FROM "USER" WHERE email = %s', (email,))
             return cursor.fetchone()
 
+        try:
+            return self._read_with_retry(f"email:{email}", work, None, shard=self._email_shard(email))
+        except psycopg2.Error as e:
+            print(f"❌ Database error while looking up a user: {e}")
+            return None
+
     def get_user_by_id(self, user_id: int) -> Optional[Tuple]:
         """
         Retrieves a user by ID.
         Returns the user record as a tuple or None if not found.
         """
-        with self.get_connection() as (conn, cursor):
+        with self.get_connection(shard=self._user_shard(user_id)) as (conn, cursor):
             if not conn:
                 return None
             
-            cursor.execute('SELECT * FROM "USER" WHERE id = %s', (user_id,))
+            cursor.execute('SELECT * FROM "USER" WHERE user_id = %s', (user_id,))
             return cursor.fetchone()
 
     def update_user_password(self, email: str, password: str) -> Tuple[bool, str]:
@@ -233,12 +822,14 @@ class Database:
         Updates a user's password.
         Returns a tuple: (success: bool, message: str)
         """
-        with self.get_connection() as (conn, cursor):
+        with self.get_connection(shard=self._email_shard(email, write=True)) as (conn, cursor):
             if not conn:
                 return False, "Database connection error."
 
             cursor.execute('UPDATE "USER" SET password = %s WHERE email = %s', (password, email))
             conn.commit()
+            self._note_write(f"email:{email}")
+            audit.record("password_reset", actor_email=email, success=cursor.rowcount > 0)
             if cursor.rowcount > 0:
                 return True, "Password updated successfully."
             else:
@@ -250,10 +841,7 @@ class Database:
         Returns a tuple: (success: bool, data: Union[str, dict])
         On success, data is a dict with user info. On failure, it's an error message.
         """
-        with self.get_connection() as (conn, cursor):
-            if not conn:
-                return False, "Database connection error."
-            
+        def work(cursor):
             cursor.execute(
                 'SELECT user_id, username, email FROM "USER" WHERE email = %s AND password = %s AND verification_status = %s',
                 (email, password, "verified")
@@ -272,24 +860,39 @@ class Database:
                 if result[0] == 'not_verified':
                     return False, "Account not verified. Please check your email."
                 return False, "Invalid email or password."
+
+        try:
+            success, data = self._read_with_retry(f"email:{email}", work, (False, "Database connection error."),
+                                                 shard=self._email_shard(email))
+        except psycopg2.Error as e: # e.g. the read statement timeout
+            success, data = False, f"Database error: {e}"
+        audit.record("login", user_id=data["id"] if success else None, actor_email=email, success=success,
+                     detail=None if success else data)
+        return success, data
     
     def delete_user(self, email: str) -> Tuple[bool, str]:
         """
         Deletes a user by email.
         Returns a tuple: (success: bool, message: str)
         """
-        with self.get_connection() as (conn, cursor):
+        with self.get_connection(shard=self._email_shard(email, write=True)) as (conn, cursor):
             if not conn:
                 return False, "Database connection error."
 
-            cursor.execute('DELETE FROM "USER" WHERE email = %s', (email,))
+            cursor.execute('DELETE FROM "USER" WHERE email = %s RETURNING user_id', (email,))
+            user = cursor.fetchone()
             conn.commit()
+            self._note_write(f"email:{email}")
             if cursor.rowcount > 0:
+                self._forget_directory_entry(email)
+                if user:
+                    self._forget_memberships(user[0])
                 return True, "User deleted successfully."
             else:
                 return False, "User not found."
             
-    def save_password(self, user_id: int, website: str, username: str, encrypted_password: bytes) -> Tuple[bool, str]:
+    def save_password(self, user_id: int, website: str, username: str, encrypted_password: bytes,
+                      encrypted_totp: Optional[bytes] = None) -> Tuple[bool, str]:
         """
         Saves an encrypted password for a specific user.
 
@@ -298,58 +901,92 @@ class Database:
             website (str): The name of the website or service.
             username (str): The username for the external service.
             encrypted_password (bytes): The password, ALREADY ENCRYPTED by the application.
+            encrypted_totp (bytes): Optional TOTP key, ALREADY ENCRYPTED by the application.
 
         Returns:
             A tuple: (success: bool, message: str)
         """
         sql = """
-            INSERT INTO passwords (user_id, website, username, password) 
-            VALUES (%s, %s, %s, %s);
+            INSERT INTO passwords (user_id, website, username, password, totp_secret) 
+            VALUES (%s, %s, %s, %s, %s);
         """
         print(f"Saving password: user_id={user_id}, website={website}, username={username}, encrypted_password_len={len(encrypted_password)}") # Debugging line
         
         try:
-            with self.get_connection() as (conn, cursor):
+            with self.get_connection(shard=self._user_shard(user_id, write=True)) as (conn, cursor):
                 if not conn:
                     return False, "Database connection error."
-                cursor.execute(sql, (user_id, website, username, encrypted_password))
+                cursor.execute(sql, (user_id, website, username, encrypted_password, encrypted_totp))
                 conn.commit()
+                self._note_write(f"user:{user_id}")
                 return True, "Password saved successfully."
         except psycopg2.Error as e:
             return False, f"Database error: {e}"
         
     def list_passwords(self, user_id: int) -> Tuple[bool, Union[list, str]]:
         """
-        Lists all passwords for a specific user.
+        Lists all passwords for a specific user, personal and shared.
 
         Args:
             user_id (int): The ID of the user whose passwords are to be listed.
 
         Returns:
             A tuple: (success: bool, data: Union[list, str])
-            On success, data is a list of dictionaries containing password details.
+            On success, data is a list of VaultRow records whose encrypted_password
+            is the memoryview of the BYTEA column (not copied until decryption).
+            Entries of shared collections the user belongs to are included, with
+            their collection_id and the member's wrapped collection key.
             On failure, data is an error message.
         """
-        sql = "SELECT id, website, username, password FROM passwords WHERE user_id = %s;"
+        personal_sql = """
+            SELECT id, website, username, password, totp_secret IS NOT NULL, NULL::integer, NULL::bytea
+            FROM passwords WHERE user_id = %s
+        """
+        shared_sql = """
+            SELECT e.id, e.website, e.username, e.password, FALSE, e.collection_id, m.wrapped_key
+            FROM collection_members m JOIN collection_entries e ON e.collection_id = m.collection_id
+            WHERE m.user_id = %s
+        """
 
+        def work(cursor, sql, params):
+            cursor.execute(sql, params)
+            # Iterate the cursor instead of fetchall() so no intermediate list of tuples is kept
+            return True, [VaultRow(*row) for row in cursor]
+
+        unavailable = (False, "Database connection error.")
         try:
-            with self.get_connection() as (conn, cursor):
-                if not conn:
-                    return False, "Database connection error."
-                cursor.execute(sql, (user_id,))
-                rows = cursor.fetchall()
-                passwords = [
-                    {
-                        "id": row[0],
-                        "website": row[1],
-                        "username": row[2],
-                        "encrypted_password": bytes(row[3]) # This will now be bytes from BYTEA column
-                    } for row in rows
-                ]
-                return True, passwords
+            if not sharding.SHARD_URLS:
+                # Personal and shared entries are in the same database: one statement,
+                # served by the passwords_user_id and collection_members primary key indexes
+                return self._read_with_retry(
+                    f"user:{user_id}", lambda cursor: work(cursor, f"{personal_sql} UNION ALL {shared_sql};", (user_id, user_id)),
+                    unavailable
+                )
+            # Sharded: personal entries are on the user's shard, shared ones on the primary
+            success, rows = self._read_with_retry(f"user:{user_id}", lambda cursor: work(cursor, personal_sql, (user_id,)),
+                                                  unavailable, shard=self._user_shard(user_id))
+            if not success:
+                return success, rows
+            success, shared = self._read_with_retry(f"user:{user_id}", lambda cursor: work(cursor, shared_sql, (user_id,)),
+                                                    unavailable)
+            return (True, rows + shared) if success else (success, shared)
         except psycopg2.Error as e:
             return False, f"Database error: {e}"
 
+    @staticmethod
+    def _detach_attachments(cursor, user_id: int, password_ids: List[int]):
+        """
+        Unlinks the attachments of entries about to be deleted, remembering the
+        entry in detached_from, so undelete_password can bring them back.
+        """
+        cursor.execute(
+            """
+                UPDATE attachments SET detached_from = password_id, password_id = NULL
+                WHERE user_id = %s AND password_id = ANY(%s);
+            """,
+            (user_id, password_ids),
+        )
+
     def delete_password(self, password_id: int, user_id: int) -> Tuple[bool, str]:
         """
         Deletes a password entry from the database.
@@ -361,44 +998,76 @@ class Database:
         Returns:
             A tuple: (success: bool, message: str)
         """
-        sql = "DELETE FROM passwords WHERE id = %s AND user_id = %s;"
+        # The DELETE and the copy into password_revisions are one statement, so a
+        # deleted entry can always be brought back with undelete_password; its
+        # attachments are detached in the same transaction rather than deleted
+        sql = """
+            WITH gone AS (
+                DELETE FROM passwords WHERE id = %s AND user_id = %s
+                RETURNING id, user_id, website, username, password, totp_secret
+            )
+            INSERT INTO password_revisions (password_id, user_id, website, username, password, totp_secret, action)
+            SELECT id, user_id, website, username, password, totp_secret, 'delete' FROM gone;
+        """
 
         try:
-            with self.get_connection() as (conn, cursor):
+            with self.get_connection(shard=self._user_shard(user_id, write=True)) as (conn, cursor):
                 if not conn:
                     return False, "Database connection error."
+                self._detach_attachments(cursor, user_id, [password_id])
                 cursor.execute(sql, (password_id, user_id))
-                conn.commit()
-                if cursor.rowcount > 0:
-                    return True, "Password deleted successfully."
-                else:
+                if cursor.rowcount == 0:
+                    conn.rollback()
                     return False, "Password not found or you do not have permission to delete it."
+                conn.commit()
+                self._note_write(f"user:{user_id}")
+                return True, "Password deleted successfully."
         except psycopg2.Error as e:
             return False, f"Database error: {e}"
             
-    def update_password(self, password_id: int, user_id: int, encrypted_password: bytes) -> Tuple[bool, str]:
+    def update_password(self, password_id: int, user_id: int, website: Optional[str] = None,
+                        username: Optional[str] = None, encrypted_password: Optional[bytes] = None,
+                        encrypted_totp: Optional[bytes] = None, clear_totp: bool = False) -> Tuple[bool, str]:
         """
-        Updates an encrypted password for a specific password entry.
+        Updates a password entry. Fields left as None keep their current value.
+        The previous version is saved to password_revisions by the same statement.
 
         Args:
             password_id (int): The ID of the password entry to update.
             user_id (int): The ID of the user who owns this password (for security).
-            encrypted_password (bytes): The new encrypted password.
+            website (str): The new website, or None.
+            username (str): The new username, or None.
+            encrypted_password (bytes): The new encrypted password, or None.
+            encrypted_totp (bytes): The new encrypted TOTP key, or None.
+            clear_totp (bool): Removes the entry's TOTP key.
 
         Returns:
             A tuple: (success: bool, message: str)
         """
         sql = """
-            UPDATE passwords SET password = %s WHERE id = %s AND user_id = %s;
+            WITH old AS (
+                SELECT id, user_id, website, username, password, totp_secret FROM passwords
+                WHERE id = %s AND user_id = %s
+                FOR UPDATE
+            ), saved AS (
+                INSERT INTO password_revisions (password_id, user_id, website, username, password, totp_secret, action)
+                SELECT id, user_id, website, username, password, totp_secret, 'update' FROM old
+            )
+            UPDATE passwords AS p SET
+                website = COALESCE(%s, p.website),
+                username = COALESCE(%s, p.username),
+                password = COALESCE(%s, p.password),
+                totp_secret = CASE WHEN %s THEN NULL ELSE COALESCE(%s, p.totp_secret) END
+            FROM old WHERE p.id = old.id;
         """
-        print(f"Updating password ID {password_id} for user {user_id}: encrypted_password_len={len(encrypted_password)}") # Debugging line
         
         try:
-            with self.get_connection() as (conn, cursor):
+            with self.get_connection(shard=self._user_shard(user_id, write=True)) as (conn, cursor):
                 if not conn:
                     return False, "Database connection error."
-                cursor.execute(sql, (encrypted_password, password_id, user_id))
+                cursor.execute(sql, (password_id, user_id, website, username, encrypted_password, clear_totp, encrypted_totp))
                 conn.commit()
+                self._note_write(f"user:{user_id}")
                 if cursor.rowcount > 0:
                     return True, "Password updated successfully."
                 else:
@@ -406,6 +1075,1110 @@ class Database:
         except psycopg2.Error as e:
             return False, f"Database error: {e}"
 
+    def list_totp_secrets(self, user_id: int) -> Tuple[bool, Union[list, str]]:
+        """
+        Lists the encrypted TOTP keys of a user's entries.
+
+        Args:
+            user_id (int): The ID of the user whose TOTP keys are to be listed.
+
+        Returns:
+            A tuple: (success: bool, data: Union[list, str])
+            On success, data is a list of (password_id, encrypted_totp) tuples.
+        """
+        sql = "SELECT id, totp_secret FROM passwords WHERE user_id = %s AND totp_secret IS NOT NULL;"
+
+        def work(cursor):
+            cursor.execute(sql, (user_id,))
+            return True, cursor.fetchall()
+
+        try:
+            return self._read_with_retry(f"user:{user_id}", work, (False, "Database connection error."),
+                                        shard=self._user_shard(user_id))
+        except psycopg2.Error as e:
+            return False, f"Database error: {e}"
+
+    def batch_vault_operations(
+        self,
+        user_id: int,
+        creates: List[Tuple[str, str, bytes, Optional[bytes]]],
+        updates: List[Tuple[int, Optional[str], Optional[str], Optional[bytes]]],
+        deletes: List[int],
+    ) -> Tuple[bool, Union[Dict[str, list], str]]:
+        """
+        Applies many vault changes for one user inside a single transaction.
+
+        Each kind of operation is sent as one multi-row statement, so a batch
+        costs at most three round-trips and one commit regardless of its size.
+        Updated and deleted entries keep their previous version in password_revisions.
+
+        Args:
+            user_id (int): The ID of the user who owns the entries.
+            creates (list): (website, username, encrypted_password, encrypted_totp) tuples to insert;
+                            encrypted_totp may be None.
+            updates (list): (password_id, website, username, encrypted_password) tuples.
+                            None leaves the corresponding column unchanged.
+            deletes (list): IDs of the password entries to delete.
+
+        Returns:
+            A tuple: (success: bool, data: Union[dict, str])
+            On success, data holds the "created" IDs (in input order) and the
+            "updated" and "deleted" IDs that matched a row owned by the user.
+            On failure, nothing is applied and data is an error message.
+        """
+        result: Dict[str, list] = {"created": [], "updated": [], "deleted": []}
+
+        try:
+            with self.get_connection(shard=self._user_shard(user_id, write=True)) as (conn, cursor):
+                if not conn:
+                    return False, "Database connection error."
+                try:
+                    if creates:
+                        rows = cursor.execute_values(
+                            "INSERT INTO passwords (user_id, website, username, password, totp_secret) VALUES %s RETURNING id;",
+                            [(user_id, website, username, encrypted, encrypted_totp)
+                             for website, username, encrypted, encrypted_totp in creates],
+                            fetch=True,
+                        )
+                        result["created"] = [row[0] for row in rows]
+
+                    if updates:
+                        rows = cursor.execute_values(
+                            """
+                                WITH v(id, user_id, website, username, password) AS (VALUES %s),
+                                old AS (
+                                    SELECT p.id, p.user_id, p.website, p.username, p.password, p.totp_secret
+                                    FROM passwords AS p JOIN v ON p.id = v.id AND p.user_id = v.user_id
+                                    FOR UPDATE OF p
+                                ), saved AS (
+                                    INSERT INTO password_revisions
+                                        (password_id, user_id, website, username, password, totp_secret, action)
+                                    SELECT id, user_id, website, username, password, totp_secret, 'update' FROM old
+                                )
+                                UPDATE passwords AS p SET
+                                    website = COALESCE(v.website, p.website),
+                                    username = COALESCE(v.username, p.username),
+                                    password = COALESCE(v.password, p.password)
+                                FROM old JOIN v ON v.id = old.id
+                                WHERE p.id = old.id
+                                RETURNING p.id;
+                            """,
+                            [(password_id, user_id, website, username, encrypted)
+                             for password_id, website, username, encrypted in updates],
+                            template="(%s::integer, %s::integer, %s::text, %s::text, %s::bytea)",
+                            fetch=True,
+                        )
+                        result["updated"] = [row[0] for row in rows]
+
+                    if deletes:
+                        self._detach_attachments(cursor, user_id, list(deletes))
+                        cursor.execute(
+                            """
+                                WITH gone AS (
+                                    DELETE FROM passwords WHERE id = ANY(%s) AND user_id = %s
+                                    RETURNING id, user_id, website, username, password, totp_secret
+                                ), saved AS (
+                                    INSERT INTO password_revisions
+                                        (password_id, user_id, website, username, password, totp_secret, action)
+                                    SELECT id, user_id, website, username, password, totp_secret, 'delete' FROM gone
+                                )
+                                SELECT id FROM gone;
+                            """,
+                            (list(deletes), user_id),
+                        )
+                        result["deleted"] = [row[0] for row in cursor.fetchall()]
+
+                    conn.commit()
+                    self._note_write(f"user:{user_id}")
+                    return True, result
+                except psycopg2.Error as e:
+                    # Roll back here so a failed batch leaves no partial changes behind
+                    conn.rollback()
+                    return False, f"Database error: {e}"
+        except psycopg2.Error as e:
+            return False, f"Database error: {e}"
+
+    def list_revisions(self, user_id: int, password_id: int) -> Tuple[bool, Union[list, str]]:
+        """
+        Lists the saved earlier versions of one entry, newest first.
+
+        Args:
+            user_id (int): The ID of the user who owns the entry.
+            password_id (int): The ID of the entry (which may since have been deleted).
+
+        Returns:
+            A tuple: (success: bool, data: Union[list, str])
+            On success, data is a list of dicts; "password" is still encrypted.
+        """
+        sql = """
+            SELECT id, action, website, username, password, totp_secret IS NOT NULL, created_at
+            FROM password_revisions WHERE user_id = %s AND password_id = %s
+            ORDER BY id DESC;
+        """
+
+        def work(cursor):
+            cursor.execute(sql, (user_id, password_id))
+            return True, [
+                {"id": row[0], "action": row[1], "website": row[2], "username": row[3], "password": row[4],
+                 "has_totp": row[5], "created_at": row[6].isoformat()}
+                for row in cursor
+            ]
+
+        try:
+            return self._read_with_retry(f"user:{user_id}", work, (False, "Database connection error."),
+                                        shard=self._user_shard(user_id))
+        except psycopg2.Error as e:
+            return False, f"Database error: {e}"
+
+    def list_deleted_passwords(self, user_id: int) -> Tuple[bool, Union[list, str]]:
+        """
+        Lists a user's deleted entries that can still be undeleted (their
+        history has not been pruned yet), most recently deleted first.
+
+        Args:
+            user_id (int): The ID of the user whose deleted entries are to be listed.
+
+        Returns:
+            A tuple: (success: bool, data: Union[list, str])
+        """
+        sql = """
+            SELECT * FROM (
+                SELECT DISTINCT ON (r.password_id) r.password_id, r.website, r.username, r.created_at
+                FROM password_revisions AS r
+                WHERE r.user_id = %s AND r.action = 'delete'
+                    AND NOT EXISTS (SELECT 1 FROM passwords AS p WHERE p.id = r.password_id)
+                ORDER BY r.password_id, r.id DESC
+            ) AS deleted ORDER BY created_at DESC;
+        """
+
+        def work(cursor):
+            cursor.execute(sql, (user_id,))
+            return True, [
+                {"id": row[0], "website": row[1], "username": row[2], "deleted_at": row[3].isoformat()}
+                for row in cursor
+            ]
+
+        try:
+            return self._read_with_retry(f"user:{user_id}", work, (False, "Database connection error."),
+                                        shard=self._user_shard(user_id))
+        except psycopg2.Error as e:
+            return False, f"Database error: {e}"
+
+    def restore_revision(self, user_id: int, password_id: int, revision_id: int) -> Tuple[bool, str]:
+        """
+        Puts an earlier version of an entry back. If the entry still exists its
+        current version is saved to the history first; if it was deleted it is
+        recreated under its old ID.
+
+        Args:
+            user_id (int): The ID of the user who owns the entry.
+            password_id (int): The ID of the entry.
+            revision_id (int): The ID of the revision to restore.
+
+        Returns:
+            A tuple: (success: bool, message: str)
+        """
+        try:
+            with self.get_connection(shard=self._user_shard(user_id, write=True)) as (conn, cursor):
+                if not conn:
+                    return False, "Database connection error."
+                try:
+                    cursor.execute(
+                        """
+                            SELECT website, username, password, totp_secret FROM password_revisions
+                            WHERE id = %s AND password_id = %s AND user_id = %s;
+                        """,
+                        (revision_id, password_id, user_id),
+                    )
+                    revision = cursor.fetchone()
+                    if revision is None:
+                        conn.rollback()
+                        return False, "Revision not found or you do not have permission to restore it."
+
+                    cursor.execute(
+                        """
+                            WITH old AS (
+                                SELECT id, user_id, website, username, password, totp_secret FROM passwords
+                                WHERE id = %s AND user_id = %s
+                                FOR UPDATE
+                            ), saved AS (
+                                INSERT INTO password_revisions
+                                    (password_id, user_id, website, username, password, totp_secret, action)
+                                SELECT id, user_id, website, username, password, totp_secret, 'restore' FROM old
+                            )
+                            UPDATE passwords AS p SET website = %s, username = %s, password = %s, totp_secret = %s
+                            FROM old WHERE p.id = old.id;
+                        """,
+                        (password_id, user_id, *revision),
+                    )
+                    message = "Password restored successfully."
+                    if cursor.rowcount == 0:
+                        # The entry was deleted: bring it back under the same ID
+                        cursor.execute(
+                            """
+                                INSERT INTO passwords (id, user_id, website, username, password, totp_secret)
+                                VALUES (%s, %s, %s, %s, %s, %s) ON CONFLICT (id) DO NOTHING;
+                            """,
+                            (password_id, user_id, *revision),
+                        )
+                        if cursor.rowcount == 0:
+                            conn.rollback()
+                            return False, "Password not found or you do not have permission to restore it."
+                        cursor.execute(
+                            """
+                                UPDATE attachments SET password_id = detached_from, detached_from = NULL
+                                WHERE user_id = %s AND detached_from = %s;
+                            """,
+                            (user_id, password_id),
+                        )
+                        message = "Password undeleted successfully."
+                    conn.commit()
+                    self._note_write(f"user:{user_id}")
+                    return True, message
+                except psycopg2.Error as e:
+                    conn.rollback()
+                    return False, f"Database error: {e}"
+        except psycopg2.Error as e:
+            return False, f"Database error: {e}"
+
+    def undelete_password(self, user_id: int, password_id: int) -> Tuple[bool, str]:
+        """
+        Recreates a deleted entry from the version saved when it was deleted.
+
+        Args:
+            user_id (int): The ID of the user who owned the entry.
+            password_id (int): The ID the entry had.
+
+        Returns:
+            A tuple: (success: bool, message: str)
+        """
+        sql = """
+            SELECT r.id FROM password_revisions AS r
+            WHERE r.user_id = %s AND r.password_id = %s AND r.action = 'delete'
+                AND NOT EXISTS (SELECT 1 FROM passwords AS p WHERE p.id = r.password_id)
+            ORDER BY r.id DESC LIMIT 1;
+        """
+        try:
+            with self.get_connection(shard=self._user_shard(user_id, write=True)) as (conn, cursor):
+                if not conn:
+                    return False, "Database connection error."
+                cursor.execute(sql, (user_id, password_id))
+                row = cursor.fetchone()
+                conn.rollback()
+        except psycopg2.Error as e:
+            return False, f"Database error: {e}"
+        if row is None:
+            return False, "No deleted password with that ID, or its history has expired."
+        return self.restore_revision(user_id, password_id, row[0])
+
+    # Quota usage: complete attachments plus uploads started after the abandonment cutoff
+    _USAGE_SQL = "SELECT COALESCE(SUM(size), 0) FROM attachments WHERE user_id = %s AND (complete OR created_at >= %s);"
+
+    def attachment_usage(self, user_id: int, abandoned_before: datetime) -> Tuple[bool, Union[int, str]]:
+        """
+        Returns the total size in bytes of a user's attachments, including
+        uploads still in progress, for quota checks. Unfinished uploads started
+        before abandoned_before were interrupted and no longer count.
+        """
+        try:
+            with self.get_connection(shard=self._user_shard(user_id)) as (conn, cursor):
+                if not conn:
+                    return False, "Database connection error."
+                cursor.execute(self._USAGE_SQL, (user_id, abandoned_before))
+                return True, int(cursor.fetchone()[0])
+        except psycopg2.Error as e:
+            return False, f"Database error: {e}"
+
+    def create_attachment(self, user_id: int, kind: str, filename: str, content_type: str, chunk_size: int,
+                          wrapped_key: bytes, password_id: Optional[int] = None) -> Tuple[bool, Union[int, str]]:
+        """
+        Creates an (incomplete) attachment record that chunks can be added to.
+
+        Args:
+            user_id (int): The ID of the user who owns the attachment.
+            kind (str): "file" or "note".
+            filename (str): Original file name (or note title).
+            content_type (str): MIME type served on download.
+            chunk_size (int): Plaintext bytes per chunk.
+            wrapped_key (bytes): The attachment's data key, ALREADY ENCRYPTED with the vault key.
+            password_id (int): Optional vault entry the attachment belongs to.
+
+        Returns:
+            A tuple: (success: bool, data: Union[int, str]) with the new attachment ID on success.
+        """
+        try:
+            with self.get_connection(shard=self._user_shard(user_id, write=True)) as (conn, cursor):
+                if not conn:
+                    return False, "Database connection error."
+                if password_id is not None:
+                    cursor.execute("SELECT 1 FROM passwords WHERE id = %s AND user_id = %s;", (password_id, user_id))
+                    if not cursor.fetchone():
+                        return False, "Password not found or you do not have permission to attach to it."
+                cursor.execute(
+                    """
+                        INSERT INTO attachments (user_id, password_id, kind, filename, content_type, chunk_size, wrapped_key)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id;
+                    """,
+                    (user_id, password_id, kind, filename, content_type, chunk_size, wrapped_key)
+                )
+                attachment_id = cursor.fetchone()[0]
+                conn.commit()
+                self._note_write(f"user:{user_id}")
+                return True, attachment_id
+        except psycopg2.Error as e:
+            return False, f"Database error: {e}"
+
+    def add_attachment_chunks(self, user_id: int, attachment_id: int, chunks: List[Tuple[int, bytes]],
+                              size: int) -> Tuple[bool, str]:
+        """
+        Stores encrypted chunks, given as (chunk_index, ciphertext) pairs, and
+        records the plaintext size uploaded so far.
+        """
+        try:
+            with self.get_connection(shard=self._user_shard(user_id, write=True)) as (conn, cursor):
+                if not conn:
+                    return False, "Database connection error."
+                cursor.execute_values(
+                    "INSERT INTO attachment_chunks (attachment_id, chunk_index, data) VALUES %s;",
+                    [(attachment_id, index, data) for index, data in chunks]
+                )
+                cursor.execute(
+                    "UPDATE attachments SET size = %s, chunk_count = %s WHERE id = %s AND user_id = %s AND NOT complete;",
+                    (size, chunks[-1][0] + 1, attachment_id, user_id)
+                )
+                if cursor.rowcount == 0:
+                    conn.rollback()
+                    return False, "Attachment not found or already complete."
+                conn.commit()
+                return True, "Chunks stored."
+        except psycopg2.Error as e:
+            return False, f"Database error: {e}"
+
+    def finish_attachment(self, user_id: int, attachment_id: int, quota: int,
+                          abandoned_before: datetime) -> Tuple[bool, str]:
+        """
+        Marks an upload complete, unless the user's total attachment size now
+        exceeds quota (concurrent uploads are only caught here).
+        """
+        try:
+            with self.get_connection(shard=self._user_shard(user_id, write=True)) as (conn, cursor):
+                if not conn:
+                    return False, "Database connection error."
+                cursor.execute(self._USAGE_SQL, (user_id, abandoned_before))
+                if cursor.fetchone()[0] > quota:
+                    conn.rollback()
+                    return False, "Storage quota exceeded."
+                cursor.execute(
+                    "UPDATE attachments SET complete = TRUE WHERE id = %s AND user_id = %s;", (attachment_id, user_id)
+                )
+                conn.commit()
+                self._note_write(f"user:{user_id}")
+                if cursor.rowcount > 0:
+                    return True, "Attachment saved successfully."
+                return False, "Attachment not found."
+        except psycopg2.Error as e:
+            return False, f"Database error: {e}"
+
+    def list_attachments(self, user_id: int) -> Tuple[bool, Union[list, str]]:
+        """
+        Lists a user's complete attachments and notes (metadata only). Those of
+        deleted entries are left out until the entry is undeleted.
+        """
+        sql = """
+            SELECT id, password_id, kind, filename, content_type, size, created_at
+            FROM attachments WHERE user_id = %s AND complete AND detached_from IS NULL ORDER BY id;
+        """
+        try:
+            with self.get_connection(read_only=True, sticky_key=f"user:{user_id}",
+                                     shard=self._user_shard(user_id)) as (conn, cursor):
+                if not conn:
+                    return False, "Database connection error."
+                cursor.execute(sql, (user_id,))
+                return True, [
+                    {"id": row[0], "password_id": row[1], "kind": row[2], "filename": row[3],
+                     "content_type": row[4], "size": row[5], "created_at": row[6].isoformat()}
+                    for row in cursor
+                ]
+        except psycopg2.Error as e:
+            return False, f"Database error: {e}"
+
+    def get_attachment(self, user_id: int, attachment_id: int) -> Optional[Dict[str, Any]]:
+        """Returns a complete attachment's metadata and wrapped key, or None if not found."""
+        sql = """
+            SELECT id, kind, filename, content_type, size, chunk_size, chunk_count, wrapped_key
+            FROM attachments WHERE id = %s AND user_id = %s AND complete AND detached_from IS NULL;
+        """
+
+        def work(cursor):
+            cursor.execute(sql, (attachment_id, user_id))
+            row = cursor.fetchone()
+            if not row:
+                return None
+            keys = ("id", "kind", "filename", "content_type", "size", "chunk_size", "chunk_count", "wrapped_key")
+            return {**dict(zip(keys, row)), "wrapped_key": bytes(row[7])}
+
+        return self._read_with_retry(f"user:{user_id}", work, None, shard=self._user_shard(user_id))
+
+    def get_attachment_chunk(self, user_id: int, attachment_id: int, chunk_index: int) -> Optional[memoryview]:
+        """Returns one encrypted chunk (as a memoryview), or None if it does not exist."""
+        sql = """
+            SELECT c.data FROM attachment_chunks c JOIN attachments a ON a.id = c.attachment_id
+            WHERE c.attachment_id = %s AND c.chunk_index = %s AND a.user_id = %s;
+        """
+
+        def work(cursor):
+            cursor.execute(sql, (attachment_id, chunk_index, user_id))
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+        return self._read_with_retry(f"user:{user_id}", work, None, shard=self._user_shard(user_id))
+
+    def delete_attachment(self, user_id: int, attachment_id: int) -> Tuple[bool, str]:
+        """Deletes an attachment and its chunks."""
+        try:
+            with self.get_connection(shard=self._user_shard(user_id, write=True)) as (conn, cursor):
+                if not conn:
+                    return False, "Database connection error."
+                cursor.execute("DELETE FROM attachments WHERE id = %s AND user_id = %s;", (attachment_id, user_id))
+                conn.commit()
+                self._note_write(f"user:{user_id}")
+                if cursor.rowcount > 0:
+                    return True, "Attachment deleted successfully."
+                return False, "Attachment not found or you do not have permission to delete it."
+        except psycopg2.Error as e:
+            return False, f"Database error: {e}"
+
+    def _forget_memberships(self, user_id: int):
+        """Removes a deleted user from every organization and collection."""
+        with self.get_connection() as (conn, cursor):
+            if conn:
+                cursor.execute("DELETE FROM collection_members WHERE user_id = %s;", (user_id,))
+                cursor.execute("DELETE FROM organization_members WHERE user_id = %s;", (user_id,))
+                conn.commit()
+
+    def create_organization(self, user_id: int, name: str) -> Tuple[bool, Union[int, str]]:
+        """
+        Creates an organization owned by user_id.
+
+        Returns:
+            A tuple: (success: bool, data: Union[int, str]) with the new organization ID on success.
+        """
+        try:
+            with self.get_connection() as (conn, cursor):
+                if not conn:
+                    return False, "Database connection error."
+                cursor.execute("INSERT INTO organizations (name) VALUES (%s) RETURNING id;", (name,))
+                organization_id = cursor.fetchone()[0]
+                cursor.execute(
+                    "INSERT INTO organization_members (organization_id, user_id, role) VALUES (%s, %s, 'owner');",
+                    (organization_id, user_id)
+                )
+                conn.commit()
+                self._note_write(f"user:{user_id}")
+                return True, organization_id
+        except psycopg2.Error as e:
+            return False, f"Database error: {e}"
+
+    def list_organizations(self, user_id: int) -> Tuple[bool, Union[list, str]]:
+        """Lists the organizations a user belongs to, with their role in each."""
+        sql = """
+            SELECT o.id, o.name, m.role FROM organization_members m JOIN organizations o ON o.id = m.organization_id
+            WHERE m.user_id = %s ORDER BY o.name;
+        """
+
+        def work(cursor):
+            cursor.execute(sql, (user_id,))
+            return True, [{"id": row[0], "name": row[1], "role": row[2]} for row in cursor]
+
+        try:
+            return self._read_with_retry(f"user:{user_id}", work, (False, "Database connection error."))
+        except psycopg2.Error as e:
+            return False, f"Database error: {e}"
+
+    def set_organization_member(self, organization_id: int, actor_id: int, user_id: int, role: str) -> Tuple[bool, str]:
+        """
+        Adds a user to an organization, or changes their role.
+        Owners and admins may add members; only owners may grant or change the owner role.
+        The last owner cannot be demoted.
+        """
+        sql = """
+            INSERT INTO organization_members (organization_id, user_id, role)
+            SELECT %(org)s, %(user)s, %(role)s
+            WHERE EXISTS (
+                SELECT 1 FROM organization_members
+                WHERE organization_id = %(org)s AND user_id = %(actor)s
+                  AND (role = 'owner' OR (role = 'admin' AND %(role)s <> 'owner'))
+            )
+            ON CONFLICT (organization_id, user_id) DO UPDATE SET role = EXCLUDED.role
+            WHERE organization_members.role <> 'owner' OR %(actor)s IN (
+                SELECT user_id FROM organization_members WHERE organization_id = %(org)s AND role = 'owner'
+            );
+        """
+        try:
+            with self.get_connection() as (conn, cursor):
+                if not conn:
+                    return False, "Database connection error."
+                # Locking the owners keeps two owners from demoting each other at the same time
+                cursor.execute(
+                    "SELECT user_id FROM organization_members WHERE organization_id = %s AND role = 'owner' FOR UPDATE;",
+                    (organization_id,)
+                )
+                owners = {row[0] for row in cursor.fetchall()}
+                if role != "owner" and owners == {user_id}:
+                    conn.rollback()
+                    return False, "An organization must keep at least one owner."
+                cursor.execute(sql, {"org": organization_id, "user": user_id, "role": role, "actor": actor_id})
+                conn.commit()
+                self._note_write(f"user:{user_id}")
+                if cursor.rowcount > 0:
+                    return True, "Member saved successfully."
+                return False, "Organization not found or you do not have permission to manage its members."
+        except psycopg2.Error as e:
+            return False, f"Database error: {e}"
+
+    def remove_organization_member(self, organization_id: int, actor_id: int, user_id: int) -> Tuple[bool, str]:
+        """
+        Removes a user from an organization and from all of its collections.
+        Owners and admins may remove members, and anyone may leave. The last
+        owner cannot leave, nor can the last manager of a collection (its
+        key would be lost with them).
+        """
+        try:
+            with self.get_connection() as (conn, cursor):
+                if not conn:
+                    return False, "Database connection error."
+                cursor.execute(
+                    """
+                    SELECT
+                        (SELECT role FROM organization_members WHERE organization_id = %(org)s AND user_id = %(actor)s),
+                        (SELECT role FROM organization_members WHERE organization_id = %(org)s AND user_id = %(user)s),
+                        (SELECT COUNT(*) FROM organization_members WHERE organization_id = %(org)s AND role = 'owner'),
+                        EXISTS (
+                            SELECT 1 FROM collections c JOIN collection_members m ON m.collection_id = c.id
+                            WHERE c.organization_id = %(org)s AND m.user_id = %(user)s AND m.permission = 'manage'
+                              AND NOT EXISTS (
+                                  SELECT 1 FROM collection_members o
+                                  WHERE o.collection_id = c.id AND o.user_id <> %(user)s AND o.permission = 'manage'
+                              )
+                        );
+                    """,
+                    {"org": organization_id, "actor": actor_id, "user": user_id}
+                )
+                actor_role, member_role, owners, sole_manager = cursor.fetchone()
+                if member_role is None or (actor_id != user_id and actor_role not in ("owner", "admin")) \
+                        or (member_role == "owner" and actor_role != "owner"):
+                    conn.rollback()
+                    return False, "Member not found or you do not have permission to remove them."
+                if member_role == "owner" and owners == 1:
+                    conn.rollback()
+                    return False, "An organization must keep at least one owner."
+                if sole_manager:
+                    conn.rollback()
+                    return False, "This member is the only manager of a collection; share it with another manager first."
+                cursor.execute(
+                    """
+                    DELETE FROM collection_members WHERE user_id = %(user)s
+                      AND collection_id IN (SELECT id FROM collections WHERE organization_id = %(org)s);
+                    DELETE FROM organization_members WHERE organization_id = %(org)s AND user_id = %(user)s;
+                    """,
+                    {"org": organization_id, "user": user_id}
+                )
+                conn.commit()
+                self._note_write(f"user:{user_id}")
+                return True, "Member removed successfully."
+        except psycopg2.Error as e:
+            return False, f"Database error: {e}"
+
+    def create_collection(self, organization_id: int, actor_id: int, name: str,
+                          wrapped_key: bytes) -> Tuple[bool, Union[int, str]]:
+        """
+        Creates a collection in an organization (owners and admins only); the
+        creator becomes its first manager.
+
+        Args:
+            organization_id (int): The organization the collection belongs to.
+            actor_id (int): The ID of the user creating it.
+            name (str): The collection's name.
+            wrapped_key (bytes): The new collection key, ALREADY WRAPPED for actor_id.
+
+        Returns:
+            A tuple: (success: bool, data: Union[int, str]) with the new collection ID on success.
+        """
+        try:
+            with self.get_connection() as (conn, cursor):
+                if not conn:
+                    return False, "Database connection error."
+                cursor.execute(
+                    """
+                    INSERT INTO collections (organization_id, name)
+                    SELECT %s, %s WHERE EXISTS (
+                        SELECT 1 FROM organization_members
+                        WHERE organization_id = %s AND user_id = %s AND role IN ('owner', 'admin')
+                    )
+                    RETURNING id;
+                    """,
+                    (organization_id, name, organization_id, actor_id)
+                )
+                row = cursor.fetchone()
+                if not row:
+                    conn.rollback()
+                    return False, "Organization not found or you do not have permission to create collections in it."
+                cursor.execute(
+                    "INSERT INTO collection_members (user_id, collection_id, permission, wrapped_key) VALUES (%s, %s, 'manage', %s);",
+                    (actor_id, row[0], wrapped_key)
+                )
+                conn.commit()
+                self._note_write(f"user:{actor_id}")
+                return True, row[0]
+        except psycopg2.Error as e:
+            return False, f"Database error: {e}"
+
+    def list_collections(self, user_id: int) -> Tuple[bool, Union[list, str]]:
+        """Lists the collections shared with a user, with their permission and entry count."""
+        sql = """
+            SELECT c.id, c.name, o.id, o.name, m.permission,
+                   (SELECT COUNT(*) FROM collection_entries e WHERE e.collection_id = c.id)
+            FROM collection_members m
+            JOIN collections c ON c.id = m.collection_id
+            JOIN organizations o ON o.id = c.organization_id
+            WHERE m.user_id = %s ORDER BY o.name, c.name;
+        """
+        keys = ("id", "name", "organization_id", "organization", "permission", "entries")
+
+        def work(cursor):
+            cursor.execute(sql, (user_id,))
+            return True, [dict(zip(keys, row)) for row in cursor]
+
+        try:
+            return self._read_with_retry(f"user:{user_id}", work, (False, "Database connection error."))
+        except psycopg2.Error as e:
+            return False, f"Database error: {e}"
+
+    def get_collection_access(self, collection_id: int, user_id: int) -> Optional[Tuple[str, bytes]]:
+        """
+        Returns (permission, wrapped_key) for a member of a collection, or None.
+        Always reads the primary, so a revoked member loses access immediately.
+        """
+        with self.get_connection() as (conn, cursor):
+            if not conn:
+                return None
+            cursor.execute(
+                "SELECT permission, wrapped_key FROM collection_members WHERE user_id = %s AND collection_id = %s;",
+                (user_id, collection_id)
+            )
+            row = cursor.fetchone()
+            return (row[0], bytes(row[1])) if row else None
+
+    def set_collection_member(self, collection_id: int, actor_id: int, user_id: int, permission: str,
+                              wrapped_key: bytes) -> Tuple[bool, str]:
+        """
+        Shares a collection with a member of its organization, or changes their
+        permission. Only the collection's managers may do this. The entries are
+        untouched: the member only gets their own wrapped copy of the key.
+
+        Args:
+            collection_id (int): The collection to share.
+            actor_id (int): The ID of the manager sharing it.
+            user_id (int): The member to share it with.
+            permission (str): 'read', 'write' or 'manage'.
+            wrapped_key (bytes): The collection key, ALREADY WRAPPED for user_id.
+
+        Returns:
+            A tuple: (success: bool, message: str)
+        """
+        sql = """
+            INSERT INTO collection_members (user_id, collection_id, permission, wrapped_key)
+            SELECT %(user)s, %(collection)s, %(permission)s, %(key)s
+            WHERE EXISTS (
+                SELECT 1 FROM collection_members
+                WHERE user_id = %(actor)s AND collection_id = %(collection)s AND permission = 'manage'
+            ) AND EXISTS (
+                SELECT 1 FROM collections c JOIN organization_members o ON o.organization_id = c.organization_id
+                WHERE c.id = %(collection)s AND o.user_id = %(user)s
+            )
+            ON CONFLICT (user_id, collection_id) DO UPDATE SET permission = EXCLUDED.permission, wrapped_key = EXCLUDED.wrapped_key;
+        """
+        try:
+            with self.get_connection() as (conn, cursor):
+                if not conn:
+                    return False, "Database connection error."
+                cursor.execute(sql, {"user": user_id, "collection": collection_id, "permission": permission,
+                                     "key": wrapped_key, "actor": actor_id})
+                conn.commit()
+                self._note_write(f"user:{user_id}")
+                if cursor.rowcount > 0:
+                    return True, "Collection shared successfully."
+                return False, "Collection not found, you do not manage it, or the user is not in its organization."
+        except psycopg2.Error as e:
+            return False, f"Database error: {e}"
+
+    def remove_collection_member(self, collection_id: int, actor_id: int, user_id: int) -> Tuple[bool, str]:
+        """
+        Revokes a member's access by deleting their wrapped key; nothing is
+        re-encrypted. Managers may remove anyone and members may leave, but the
+        last manager cannot be removed.
+        """
+        sql = """
+            DELETE FROM collection_members
+            WHERE collection_id = %(collection)s AND user_id = %(user)s
+              AND (%(user)s = %(actor)s OR EXISTS (
+                  SELECT 1 FROM collection_members
+                  WHERE collection_id = %(collection)s AND user_id = %(actor)s AND permission = 'manage'
+              ))
+              AND EXISTS (
+                  SELECT 1 FROM collection_members
+                  WHERE collection_id = %(collection)s AND user_id <> %(user)s AND permission = 'manage'
+              );
+        """
+        try:
+            with self.get_connection() as (conn, cursor):
+                if not conn:
+                    return False, "Database connection error."
+                cursor.execute(sql, {"collection": collection_id, "user": user_id, "actor": actor_id})
+                conn.commit()
+                self._note_write(f"user:{user_id}")
+                if cursor.rowcount > 0:
+                    return True, "Access revoked successfully."
+                return False, "Member not found, you do not manage this collection, or they are its last manager."
+        except psycopg2.Error as e:
+            return False, f"Database error: {e}"
+
+    def save_collection_entry(self, collection_id: int, user_id: int, website: str, username: str,
+                              encrypted_password: bytes) -> Tuple[bool, Union[int, str]]:
+        """
+        Adds an entry to a collection the user may write to.
+
+        Args:
+            encrypted_password (bytes): The password, ALREADY ENCRYPTED with the collection key.
+
+        Returns:
+            A tuple: (success: bool, data: Union[int, str]) with the new entry ID on success.
+        """
+        sql = """
+            INSERT INTO collection_entries (collection_id, website, username, password, updated_by)
+            SELECT %(collection)s, %(website)s, %(username)s, %(password)s, %(user)s
+            WHERE EXISTS (
+                SELECT 1 FROM collection_members
+                WHERE user_id = %(user)s AND collection_id = %(collection)s AND permission IN ('write', 'manage')
+            )
+            RETURNING id;
+        """
+        try:
+            with self.get_connection() as (conn, cursor):
+                if not conn:
+                    return False, "Database connection error."
+                cursor.execute(sql, {"collection": collection_id, "website": website, "username": username,
+                                     "password": encrypted_password, "user": user_id})
+                row = cursor.fetchone()
+                conn.commit()
+                self._note_write(f"user:{user_id}")
+                if row:
+                    return True, row[0]
+                return False, "Collection not found or you do not have permission to add entries to it."
+        except psycopg2.Error as e:
+            return False, f"Database error: {e}"
+
+    def update_collection_entry(self, collection_id: int, entry_id: int, user_id: int, website: Optional[str] = None,
+                                username: Optional[str] = None, encrypted_password: Optional[bytes] = None) -> Tuple[bool, str]:
+        """Updates a collection entry; fields left as None keep their current value."""
+        sql = """
+            UPDATE collection_entries AS e SET
+                website = COALESCE(%(website)s, e.website),
+                username = COALESCE(%(username)s, e.username),
+                password = COALESCE(%(password)s, e.password),
+                updated_by = %(user)s,
+                updated_at = now()
+            FROM collection_members m
+            WHERE e.id = %(entry)s AND e.collection_id = %(collection)s
+              AND m.collection_id = e.collection_id AND m.user_id = %(user)s AND m.permission IN ('write', 'manage');
+        """
+        try:
+            with self.get_connection() as (conn, cursor):
+                if not conn:
+                    return False, "Database connection error."
+                cursor.execute(sql, {"website": website, "username": username, "password": encrypted_password,
+                                     "user": user_id, "entry": entry_id, "collection": collection_id})
+                conn.commit()
+                self._note_write(f"user:{user_id}")
+                if cursor.rowcount > 0:
+                    return True, "Entry updated successfully."
+                return False, "Entry not found or you do not have permission to update it."
+        except psycopg2.Error as e:
+            return False, f"Database error: {e}"
+
+    def delete_collection_entry(self, collection_id: int, entry_id: int, user_id: int) -> Tuple[bool, str]:
+        """Deletes a collection entry (write permission required)."""
+        sql = """
+            DELETE FROM collection_entries AS e USING collection_members m
+            WHERE e.id = %(entry)s AND e.collection_id = %(collection)s
+              AND m.collection_id = e.collection_id AND m.user_id = %(user)s AND m.permission IN ('write', 'manage');
+        """
+        try:
+            with self.get_connection() as (conn, cursor):
+                if not conn:
+                    return False, "Database connection error."
+                cursor.execute(sql, {"entry": entry_id, "collection": collection_id, "user": user_id})
+                conn.commit()
+                self._note_write(f"user:{user_id}")
+                if cursor.rowcount > 0:
+                    return True, "Entry deleted successfully."
+                return False, "Entry not found or you do not have permission to delete it."
+        except psycopg2.Error as e:
+            return False, f"Database error: {e}"
+
+    def list_member_keys(self) -> list:
+        """Returns every (collection_id, user_id, wrapped_key) membership row, for key rotation."""
+        with self.get_connection() as (conn, cursor):
+            if not conn:
+                raise ConnectionError("Database connection error.")
+            cursor.execute("SELECT collection_id, user_id, wrapped_key FROM collection_members ORDER BY collection_id;")
+            rows = cursor.fetchall()
+            conn.rollback()
+            return rows
+
+    def rewrite_member_keys(self, rows: List[Tuple[int, int, bytes]]) -> int:
+        """Replaces the wrapped keys of many (collection_id, user_id, wrapped_key) memberships in one statement."""
+        if not rows:
+            return 0
+        with self.get_connection() as (conn, cursor):
+            if not conn:
+                raise ConnectionError("Database connection error.")
+            try:
+                updated = cursor.execute_values(
+                    """
+                        UPDATE collection_members AS m SET wrapped_key = v.wrapped_key
+                        FROM (VALUES %s) AS v(collection_id, user_id, wrapped_key)
+                        WHERE m.collection_id = v.collection_id AND m.user_id = v.user_id
+                        RETURNING m.user_id;
+                    """,
+                    rows,
+                    template="(%s::integer, %s::integer, %s::bytea)",
+                    fetch=True,
+                )
+                conn.commit()
+            except psycopg2.Error:
+                conn.rollback()
+                raise
+            return len(updated)
+
+    def shard_names(self) -> List[Optional[str]]:
+        """Returns every shard name, or [None] for the single (unsharded) database."""
+        return list(sharding.SHARD_URLS) or [None]
+
+    def id_range(self, table: str, shard: Optional[str] = None) -> Optional[Tuple[int, int]]:
+        """Returns (min id, max id) of a table in CIPHERTEXT_COLUMNS, or None if it is empty."""
+        if table not in Database.CIPHERTEXT_COLUMNS:
+            raise ValueError(f"Unknown table '{table}'.")
+        with self.get_connection(shard=shard) as (conn, cursor):
+            if not conn:
+                raise ConnectionError("Database connection error.")
+            cursor.execute(f"SELECT MIN(id), MAX(id) FROM {table};")
+            low, high = cursor.fetchone()
+            conn.rollback()
+            return None if low is None else (low, high)
+
+    def scan_ciphertexts(self, table: str, start_id: int, end_id: int, shard: Optional[str] = None) -> list:
+        """
+        Returns (id, user_id, *ciphertexts) for the rows with start_id <= id < end_id,
+        the ciphertexts being the table's CIPHERTEXT_COLUMNS (memoryviews, or None).
+        Always reads from the primary or shard, never a replica.
+        """
+        columns = ", ".join(Database.CIPHERTEXT_COLUMNS[table])
+        with self.get_connection(shard=shard) as (conn, cursor):
+            if not conn:
+                raise ConnectionError("Database connection error.")
+            cursor.execute(
+                f"SELECT id, user_id, {columns} FROM {table} WHERE id >= %s AND id < %s ORDER BY id;", (start_id, end_id)
+            )
+            rows = cursor.fetchall()
+            conn.rollback()
+            return rows
+
+    def rewrite_ciphertexts(self, table: str, rows: List[tuple], shard: Optional[str] = None) -> int:
+        """
+        Replaces the ciphertexts of many rows in one statement.
+
+        Args:
+            table (str): A table in CIPHERTEXT_COLUMNS.
+            rows (list): (id, *ciphertexts) tuples, in CIPHERTEXT_COLUMNS order.
+            shard (str): The shard holding the rows, or None.
+
+        Returns:
+            The number of rows updated.
+        """
+        if not rows:
+            return 0
+        columns = Database.CIPHERTEXT_COLUMNS[table]
+        assignments = ", ".join(f"{column} = v.{column}" for column in columns)
+        with self.get_connection(shard=shard) as (conn, cursor):
+            if not conn:
+                raise ConnectionError("Database connection error.")
+            try:
+                updated = cursor.execute_values(
+                    f"UPDATE {table} AS t SET {assignments} FROM (VALUES %s) AS v(id, {', '.join(columns)}) "
+                    f"WHERE t.id = v.id RETURNING t.id;",
+                    rows,
+                    template="(%s::integer" + ", %s::bytea" * len(columns) + ")",
+                    fetch=True,
+                )
+                conn.commit()
+            except psycopg2.Error:
+                conn.rollback()
+                raise
+            return len(updated)
+
+    def prune_revisions(self, keep: int, cutoff: datetime, batch_size: int, shard: Optional[str] = None,
+                        after: Optional[Tuple[int, int]] = None) -> Optional[Tuple[int, int, Optional[Tuple[int, int]]]]:
+        """
+        Deletes one small batch of expired history on one shard (or the single database).
+
+        The count limit walks the entries in (user_id, password_id) order, a
+        page of batch_size entries per call, so each call reads only that
+        page through the (user_id, password_id, id) index instead of grouping
+        the whole table.
+
+        Args:
+            keep (int): How many of each entry's newest revisions survive the count limit.
+            cutoff (datetime): Revisions created before this are deleted regardless of count.
+            batch_size (int): Upper bound on the revisions deleted by age, and on the
+                              entries trimmed by count, in this call.
+            shard (str): The shard to prune, or None.
+            after (tuple): The (user_id, password_id) the previous call stopped at;
+                           None starts from the first entry.
+
+        Returns:
+            (deleted by age, deleted by count, where to continue the count walk, or
+            None once it reached the last entry), or None if another process is
+            pruning this database right now.
+        """
+        with self.get_connection(shard=shard) as (conn, cursor):
+            if not conn:
+                raise ConnectionError("Database connection error.")
+            try:
+                # One pruner per database at a time; the lock ends with the transaction
+                cursor.execute("SELECT pg_try_advisory_xact_lock(hashtext('password_revisions_prune'));")
+                if not cursor.fetchone()[0]:
+                    conn.rollback()
+                    return None
+                cursor.execute(
+                    """
+                        DELETE FROM password_revisions WHERE id IN (
+                            SELECT id FROM password_revisions WHERE created_at < %s
+                            ORDER BY created_at LIMIT %s
+                        );
+                    """,
+                    (cutoff, batch_size),
+                )
+                aged = cursor.rowcount
+                start = after or (0, 0) # SERIAL ids start at 1
+                cursor.execute(
+                    """
+                        SELECT user_id, password_id FROM password_revisions
+                        WHERE (user_id, password_id) > (%s, %s)
+                        GROUP BY user_id, password_id ORDER BY user_id, password_id
+                        OFFSET %s LIMIT 1;
+                    """,
+                    (*start, batch_size - 1),
+                )
+                last = cursor.fetchone()
+                cursor.execute(
+                    """
+                        DELETE FROM password_revisions WHERE id IN (
+                            SELECT id FROM (
+                                SELECT id, row_number() OVER (PARTITION BY user_id, password_id ORDER BY id DESC) AS age
+                                FROM password_revisions
+                                WHERE (user_id, password_id) > (%s, %s) {}
+                            ) AS ranked WHERE age > %s
+                        );
+                    """.format("AND (user_id, password_id) <= (%s, %s)" if last else ""),
+                    (*start, *(last or ()), keep),
+                )
+                trimmed = cursor.rowcount
+                conn.commit()
+            except psycopg2.Error:
+                conn.rollback()
+                raise
+            return aged, trimmed, tuple(last) if last else None
+
+    def prune_detached_attachments(self, batch_size: int, shard: Optional[str] = None) -> int:
+        """
+        Deletes up to batch_size attachments of deleted entries that can no longer
+        be undeleted (their 'delete' revision was pruned) on one shard (or the
+        single database). Returns how many were deleted.
+        """
+        sql = """
+            DELETE FROM attachments WHERE id IN (
+                SELECT a.id FROM attachments AS a
+                WHERE a.detached_from IS NOT NULL AND NOT EXISTS (
+                    SELECT 1 FROM password_revisions AS r
+                    WHERE r.user_id = a.user_id AND r.password_id = a.detached_from AND r.action = 'delete'
+                )
+                LIMIT %s
+            );
+        """
+        with self.get_connection(shard=shard) as (conn, cursor):
+            if not conn:
+                raise ConnectionError("Database connection error.")
+            try:
+                cursor.execute(sql, (batch_size,))
+                conn.commit()
+            except psycopg2.Error:
+                conn.rollback()
+                raise
+            return cursor.rowcount
+
+    def prune_abandoned_uploads(self, abandoned_before: datetime, batch_size: int, shard: Optional[str] = None) -> int:
+        """
+        Deletes up to batch_size unfinished uploads started before abandoned_before
+        (left behind by a worker that crashed or was stopped mid-upload), with
+        their chunks, on one shard (or the single database). Returns how many
+        were deleted.
+        """
+        sql = """
+            DELETE FROM attachments WHERE id IN (
+                SELECT id FROM attachments WHERE NOT complete AND created_at < %s LIMIT %s
+            );
+        """
+        with self.get_connection(shard=shard) as (conn, cursor):
+            if not conn:
+                raise ConnectionError("Database connection error.")
+            try:
+                cursor.execute(sql, (abandoned_before, batch_size))
+                conn.commit()
+            except psycopg2.Error:
+                conn.rollback()
+                raise
+            return cursor.rowcount
+
+    def vault_stats(self, shard: Optional[str] = None) -> Dict[str, int]:
+        """Returns row counts and on-disk sizes of the vault tables on one shard (or the single database)."""
+        sql = """
+            SELECT
+                (SELECT COUNT(*) FROM "USER"),
+                (SELECT COUNT(*) FROM passwords),
+                (SELECT COUNT(*) FROM passwords WHERE totp_secret IS NOT NULL),
+                (SELECT COUNT(*) FROM attachments WHERE complete),
+                (SELECT COALESCE(SUM(size), 0) FROM attachments WHERE complete),
+                (SELECT COUNT(*) FROM password_revisions),
+                pg_total_relation_size('passwords'),
+                pg_total_relation_size('password_revisions'),
+                pg_total_relation_size('attachment_chunks');
+        """
+        keys = ("users", "entries", "totp_entries", "attachments", "attachment_bytes", "revisions",
+                "passwords_table_bytes", "revisions_table_bytes", "chunks_table_bytes")
+        with self.get_connection(shard=shard) as (conn, cursor):
+            if not conn:
+                raise ConnectionError("Database connection error.")
+            cursor.execute(sql)
+            row = cursor.fetchone()
+            conn.rollback()
+            return dict(zip(keys, row))
+
+# Servers that fork after importing this module (e.g. gunicorn --preload) must not
+# share the parent's connections with their workers
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=Database._discard_inherited_pool)
+
 # Create a global instance of the Database class
 # This will trigger the __init__ and attempt to connect/create tables.
 try:
@@ -0,0 +1,94 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import psycopg2
+from dotenv import load_dotenv
+
+import attachments
+
+load_dotenv()
+
+HISTORY_KEEP_REVISIONS = int(os.getenv("HISTORY_KEEP_REVISIONS", "20")) # Newest versions kept per entry
+HISTORY_MAX_AGE_DAYS = float(os.getenv("HISTORY_MAX_AGE_DAYS", "90")) # Older versions, and deleted entries, are pruned
+HISTORY_PRUNE_BATCH = int(os.getenv("HISTORY_PRUNE_BATCH", "500")) # Rows (or entries) per DELETE
+HISTORY_PRUNE_INTERVAL = float(os.getenv("HISTORY_PRUNE_INTERVAL", "600")) # Seconds between pruning runs
+HISTORY_PRUNE_PAUSE = float(os.getenv("HISTORY_PRUNE_PAUSE", "0.1")) # Pause between batches, to yield to live traffic
+
+
+class HistoryPruner:
+    """
+    Background job enforcing the retention policy of password_revisions.
+
+    Every HISTORY_PRUNE_INTERVAL seconds it walks each shard and deletes
+    revisions older than HISTORY_MAX_AGE_DAYS, plus all but the newest
+    HISTORY_KEEP_REVISIONS of each entry, HISTORY_PRUNE_BATCH at a time in
+    short transactions. Attachments of deleted entries are kept until the
+    entry can no longer be undeleted, then deleted too, as are uploads left
+    unfinished for ATTACHMENT_UPLOAD_TIMEOUT_HOURS. Every worker runs one, but an advisory lock lets only
+    one of them prune a given database at once.
+    """
+
+    def __init__(self):
+        self._db = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._pid = os.getpid()
+
+    def start(self, db):
+        """Starts the background pruner for db (a Database)."""
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        self._db = db
+        self._pid = os.getpid()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="history-pruner", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stops the pruner after its current batch."""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout=10)
+        self._thread = None
+
+    def _run(self):
+        while not self._stopping.wait(HISTORY_PRUNE_INTERVAL):
+            self.run_once()
+
+    def run_once(self, db=None) -> int:
+        """Prunes every shard until nothing is left to delete. Returns the number of revisions deleted."""
+        db = db or self._db
+        cutoff = datetime.now(timezone.utc) - timedelta(days=HISTORY_MAX_AGE_DAYS)
+        deleted = 0
+        for shard in db.shard_names():
+            after = None # The count limit walks the entries page by page from the first one
+            try:
+                while not self._stopping.is_set():
+                    result = db.prune_revisions(HISTORY_KEEP_REVISIONS, cutoff, HISTORY_PRUNE_BATCH, shard, after)
+                    if result is None:
+                        break # Another worker is pruning this database
+                    aged, trimmed, after = result
+                    deleted += aged + trimmed
+                    if aged < HISTORY_PRUNE_BATCH and after is None:
+                        break
+                    time.sleep(HISTORY_PRUNE_PAUSE)
+                # Attachments of deleted entries go once the entry can no longer be undeleted
+                while not self._stopping.is_set() \
+                        and db.prune_detached_attachments(HISTORY_PRUNE_BATCH, shard) >= HISTORY_PRUNE_BATCH:
+                    time.sleep(HISTORY_PRUNE_PAUSE)
+                # Uploads interrupted by a crash or restart were never finished nor cleaned up
+                while not self._stopping.is_set() and db.prune_abandoned_uploads(
+                        attachments.abandoned_before(), HISTORY_PRUNE_BATCH, shard) >= HISTORY_PRUNE_BATCH:
+                    time.sleep(HISTORY_PRUNE_PAUSE)
+            except (psycopg2.Error, ConnectionError) as e:
+                print(f"❌ Pruning revision history{' on ' + shard if shard else ''} failed: {e}")
+        if deleted:
+            print(f"✅ Pruned {deleted} old revision(s).")
+        return deleted
+
+
+pruner = HistoryPruner()
@@ -0,0 +1,197 @@
+"""
+Vault key providers.
+
+    python keys.py init    # create the key file once, before the first start
+"""
+import argparse
+import hashlib
+import os
+from typing import Optional
+
+from cryptography.fernet import Fernet, InvalidToken
+from dotenv import load_dotenv
+
+try:
+    import fcntl # POSIX only; used to serialize key creation across worker processes
+except ImportError:
+    fcntl = None
+
+load_dotenv()
+
+KEY_FILE = os.getenv("VAULT_KEY_FILE", "key.key")
+FINGERPRINT_ENV = "VAULT_KEY_FINGERPRINT"
+
+
+class KeyProviderError(RuntimeError):
+    """Raised when the vault key cannot be loaded. The key is never regenerated to recover."""
+
+
+def key_fingerprint(key: bytes) -> str:
+    """Returns a short, non-secret identifier for a key, safe to log and compare."""
+    return hashlib.sha256(key).hexdigest()[:16]
+
+
+def _validate(key: bytes, source: str) -> bytes:
+    key = key.strip()
+    try:
+        Fernet(key)
+    except (ValueError, TypeError) as e:
+        raise KeyProviderError(f"Invalid Fernet key from {source}: {e}")
+    return key
+
+
+class EnvKeyProvider:
+    """Reads the key from the VAULT_KEY environment variable."""
+
+    def __init__(self, variable: str = "VAULT_KEY"):
+        self.variable = variable
+
+    def load_key(self) -> bytes:
+        value = os.getenv(self.variable)
+        if not value:
+            raise KeyProviderError(f"{self.variable} is not set.")
+        return _validate(value.encode(), self.variable)
+
+
+class FileKeyProvider:
+    """
+    Reads the key from a file. A missing file is an error unless create is
+    set (by `python keys.py init` or `serve.py --init-key`), so a mistyped
+    VAULT_KEY_FILE never silently starts a new, empty vault.
+
+    Creation happens under an exclusive lock on a sidecar lock file, so when
+    several workers start at once exactly one of them generates the key and
+    the others read it. The file is linked into place only once the key is
+    written, so a worker reading it without the lock never sees it half
+    written. An existing but empty or unreadable file is an error, never a
+    reason to write a new key over it.
+    """
+
+    def __init__(self, path: str = KEY_FILE, create: bool = False):
+        self.path = path
+        self.create = create
+
+    def _read(self) -> Optional[bytes]:
+        try:
+            with open(self.path, "rb") as key_file:
+                return _validate(key_file.read(), self.path)
+        except FileNotFoundError:
+            return None
+
+    def load_key(self) -> bytes:
+        key = self._read()
+        if key is not None:
+            return key
+        if not self.create:
+            raise KeyProviderError(f"Key file {self.path} does not exist. Check VAULT_KEY_FILE, or create "
+                                   "the key of a new vault once with `python keys.py init`.")
+
+        with open(self.path + ".lock", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                # Another worker may have created the key while we waited for the lock
+                key = self._read()
+                if key is not None:
+                    return key
+                key = Fernet.generate_key()
+                # Write and fsync a private temporary file, then link it into place: readers that
+                # skip the lock see either no key file or the complete key, never an empty file
+                temp_path = f"{self.path}.{os.getpid()}.tmp"
+                fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                try:
+                    with os.fdopen(fd, "wb") as key_file:
+                        key_file.write(key)
+                        key_file.flush()
+                        os.fsync(key_file.fileno())
+                    try:
+                        os.link(temp_path, self.path) # Fails rather than replace a key file that appeared
+                    except FileExistsError:
+                        return self._read()
+                finally:
+                    os.unlink(temp_path)
+                print(f"🔑 Generated a new encryption key and saved it to {self.path}.")
+                return key
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class LocalKMSKeyProvider:
+    """
+    Local stand-in for a KMS: the data key is stored wrapped (encrypted) by a
+    master key that only lives in the VAULT_KMS_MASTER_KEY environment variable.
+    """
+
+    def __init__(self, wrapped_key_file: str = None, master_variable: str = "VAULT_KMS_MASTER_KEY"):
+        self.wrapped_key_file = wrapped_key_file or os.getenv("VAULT_KMS_WRAPPED_KEY_FILE", KEY_FILE + ".wrapped")
+        self.master_variable = master_variable
+
+    def _master(self) -> Fernet:
+        master_key = os.getenv(self.master_variable)
+        if not master_key:
+            raise KeyProviderError(f"{self.master_variable} is not set.")
+        return Fernet(_validate(master_key.encode(), self.master_variable))
+
+    def wrap_key(self, key: bytes) -> bytes:
+        """Encrypts a data key with the master key, for storing in wrapped_key_file."""
+        return self._master().encrypt(key)
+
+    def load_key(self) -> bytes:
+        try:
+            with open(self.wrapped_key_file, "rb") as wrapped_file:
+                wrapped = wrapped_file.read().strip()
+        except FileNotFoundError:
+            raise KeyProviderError(f"Wrapped key file {self.wrapped_key_file} does not exist.")
+        try:
+            return _validate(self._master().decrypt(wrapped), self.wrapped_key_file)
+        except InvalidToken:
+            raise KeyProviderError(f"{self.master_variable} cannot unwrap {self.wrapped_key_file}.")
+
+
+def get_key_provider(name: str = None):
+    """
+    Returns the key provider selected by VAULT_KEY_PROVIDER ("file", "env" or "kms").
+    The file provider it returns never creates a key; see FileKeyProvider.
+    """
+    name = (name or os.getenv("VAULT_KEY_PROVIDER", "file")).lower()
+    if name == "env":
+        return EnvKeyProvider()
+    if name == "kms":
+        return LocalKMSKeyProvider()
+    if name == "file":
+        return FileKeyProvider()
+    raise KeyProviderError(f"Unknown key provider '{name}'.")
+
+
+def load_vault_key(provider=None) -> bytes:
+    """
+    Loads the vault key and checks it against VAULT_KEY_FINGERPRINT when that is set,
+    so a worker that somehow sees a different key refuses to start instead of
+    writing entries no other worker can decrypt.
+    """
+    key = (provider or get_key_provider()).load_key()
+    expected = os.getenv(FINGERPRINT_ENV)
+    if expected and key_fingerprint(key) != expected:
+        raise KeyProviderError(
+            f"Key fingerprint {key_fingerprint(key)} does not match {FINGERPRINT_ENV}={expected}."
+        )
+    return key
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the SecureVault key file.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    init_parser = subparsers.add_parser("init", help="create the key file of a new vault")
+    init_parser.add_argument("--path", default=KEY_FILE, help="key file (default: VAULT_KEY_FILE or key.key)")
+    args = parser.parse_args()
+
+    if os.path.exists(args.path):
+        raise SystemExit(f"❌ {args.path} already exists; it is never replaced.")
+    key = FileKeyProvider(args.path, create=True).load_key()
+    print(f"✅ Vault key fingerprint {key_fingerprint(key)}. Back up {args.path}: entries cannot be decrypted without it.")
+
+
+if __name__ == "__main__":
+    main()
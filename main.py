@@ -1,7 +1,10 @@
 from cryptography.fernet import Fernet
-import os
 import databse  # Assuming databse.py is in the same directory
-import binascii
+from vault_rows import iter_decrypted
+import keys
+import audit
+import totp
+import sharing
 
 # Initialize the database connection
 db = databse.Database()
@@ -11,28 +14,18 @@ class PasswordManager:
     Manages encryption and decryption of passwords, and interacts with the
     database for storing and retrieving password entries.
     """
-    def __init__(self):
-        self.KEY_FILE = "key.key"
-        key = None
+    def __init__(self, key_provider=None):
         try:
-            if os.path.exists(self.KEY_FILE) and os.path.getsize(self.KEY_FILE) > 0:
-                with open(self.KEY_FILE, "rb") as key_file:
-                    key = key_file.read()
-            if not key:
-                key = Fernet.generate_key()
-                with open(self.KEY_FILE, "wb") as kf:
-                    kf.write(key)
-                print("🔑 Generated a new encryption key and saved it to key.key.")
-            else:
-                print("🔑 Loaded existing encryption key from key.key.")
-        except Exception as e:
-            print(f"❌ Error loading or generating encryption key: {e}")
-            key = Fernet.generate_key()
-            with open(self.KEY_FILE, "wb") as kf:
-                kf.write(key)
-            print("🔑 Recovered by generating a new encryption key due to an error.")
-
+            key = keys.load_vault_key(key_provider)
+        except keys.KeyProviderError as e:
+            # Never fall back to a fresh key: entries encrypted with the real one would become unreadable
+            print(f"❌ Error loading encryption key: {e}")
+            raise
+        self.key_fingerprint = keys.key_fingerprint(key)
+        print(f"🔑 Loaded encryption key (fingerprint {self.key_fingerprint}).")
         self.fernet = Fernet(key)
+        self.totp_cache = totp.SecretCache()
+        self.keyring = sharing.MemberKeyring(key)
 
     def encrypt_password(self, password: str) -> bytes:
         return self.fernet.encrypt(password.encode())
@@ -44,67 +37,282 @@ class PasswordManager:
             print(f"Decryption error for provided data: {e}")
             raise ValueError("Failed to decrypt password. The data might be corrupted or the encryption key has changed.")
 
-    def add_password(self, user_id: int, website: str, username: str, raw_password: str):
+    def add_password(self, user_id: int, website: str, username: str, raw_password: str, totp_secret: str = None):
         try:
             print(raw_password)
             encrypted_password = self.encrypt_password(raw_password)
             print(encrypted_password)
-            return db.save_password(user_id, website, username, encrypted_password)
+            encrypted_totp = self.fernet.encrypt(totp.parse_secret(totp_secret)) if totp_secret else None
+            success, message = db.save_password(user_id, website, username, encrypted_password, encrypted_totp)
+        except ValueError as e:
+            success, message = False, f"Invalid TOTP secret: {e}"
         except Exception as e:
-            return False, f"Error encrypting or saving password: {e}"
+            success, message = False, f"Error encrypting or saving password: {e}"
+        if success and totp_secret:
+            self.totp_cache.invalidate(user_id)
+        audit.record("create", user_id=user_id, success=success)
+        return success, message
 
     def get_passwords(self, user_id: int):
+        """
+        Returns (success, passwords) where passwords is a lazy iterator of
+        decrypted entries; each row is decrypted as it is consumed.
+        """
         success, data = db.list_passwords(user_id)
+        audit.record("list", user_id=user_id, success=success,
+                     detail=f"{len(data)} entries revealed" if success else None)
         if not success:
             return False, data
-
-        decrypted_passwords = []
-        for p_entry in data:
-            try:
-                raw = p_entry["encrypted_password"]
-
-                # Decode from hex if PostgreSQL returned a hex string (BYTEA behavior)
-                if isinstance(raw, str):
-                    raw = binascii.unhexlify(raw[2:] if raw.startswith('\\x') else raw)
-
-                decrypted_pass = self.decrypt_password(raw)
-                decrypted_passwords.append({
-                    "id": p_entry["id"],
-                    "website": p_entry["website"],
-                    "username": p_entry["username"],
-                    "password": decrypted_pass
-                })
-            except ValueError as ve:
-                print(f"Skipping password for website {p_entry.get('website', 'N/A')} due to decryption error: {ve}")
-                decrypted_passwords.append({
-                    "id": p_entry["id"],
-                    "website": p_entry["website"],
-                    "username": p_entry["username"],
-                    "password": "[Decryption Failed - Key Mismatch/Corruption]"
-                })
-            except Exception as e:
-                print(f"Unexpected error for website {p_entry.get('website', 'N/A')}: {e}")
-                decrypted_passwords.append({
-                    "id": p_entry["id"],
-                    "website": p_entry["website"],
-                    "username": p_entry["username"],
-                    "password": "[Processing Error]"
-                })
-
-        return True, decrypted_passwords
+        return True, iter_decrypted(self.fernet, data,
+                                    lambda wrapped_key: self.keyring.collection_fernet(user_id, wrapped_key))
 
     def delete_password(self, password_id: int, user_id: int):
-        return db.delete_password(password_id, user_id)
+        success, message = db.delete_password(password_id, user_id)
+        self.totp_cache.invalidate(user_id)
+        audit.record("delete", user_id=user_id, entry_id=password_id, success=success)
+        return success, message
 
-    def update_password(self, password_id: int, user_id: int, website: str, username: str, raw_password: str = None) -> tuple[bool, str]:
-        
+    def update_password(self, password_id: int, user_id: int, website: str, username: str, raw_password: str = None,
+                        totp_secret: str = None, clear_totp: bool = False) -> tuple[bool, str]:
+        """
+        Updates an entry. raw_password=None keeps the current password;
+        totp_secret=None keeps the current TOTP seed and clear_totp removes it.
+        """
         try:
-            print(raw_password)
-            encrypted_password = self.encrypt_password(raw_password)
-            print(encrypted_password)
-            return db.update_password(password_id, user_id, website, username, encrypted_password)
+            encrypted_password = self.encrypt_password(raw_password) if raw_password else None
+            encrypted_totp = self.fernet.encrypt(totp.parse_secret(totp_secret)) if totp_secret else None
+            success, message = db.update_password(password_id, user_id, website, username, encrypted_password,
+                                                  encrypted_totp=encrypted_totp, clear_totp=clear_totp and not totp_secret)
+        except ValueError as e:
+            success, message = False, f"Invalid TOTP secret: {e}"
         except Exception as e:
-            return False, f"Error encrypting or saving password: {e}"
+            success, message = False, f"Error encrypting or saving password: {e}"
+        if totp_secret or clear_totp:
+            self.totp_cache.invalidate(user_id)
+        audit.record("update", user_id=user_id, entry_id=password_id, success=success)
+        return success, message
+
+    def get_totp_codes(self, user_id: int, session: str, ids: list = None):
+        """
+        Returns (success, codes) with the current TOTP code of each requested
+        entry (all TOTP entries when ids is None). The seeds are fetched and
+        decrypted once per session and TOTP_CACHE_SECONDS, not per call.
+        """
+        keys = self.totp_cache.get(user_id, session)
+        if keys is None:
+            success, rows = db.list_totp_secrets(user_id)
+            if not success:
+                return False, rows
+            keys = {}
+            for password_id, encrypted_totp in rows:
+                try:
+                    keys[password_id] = self.fernet.decrypt(bytes(encrypted_totp))
+                except Exception as e:
+                    print(f"Skipping TOTP seed of entry {password_id} due to decryption error: {e!r}")
+            self.totp_cache.put(user_id, session, keys)
+            audit.record("totp_reveal", user_id=user_id, detail=f"{len(keys)} seeds decrypted")
+        return True, totp.current_codes(totp.select(keys, ids))
+
+    def apply_batch(self, user_id: int, operations: list) -> tuple[bool, list | str]:
+        """
+        Applies a list of create/update/delete operations in one transaction.
+
+        Each operation is a dict with an "op" key ("create", "update" or "delete")
+        and the fields that operation needs. Returns (success, results) where
+        results has one entry per operation, in input order.
+        """
+        creates, updates, deletes = [], [], []
+        results = []
+        touched = set() # Entry IDs already updated or deleted by an earlier operation
+
+        def text(operation: dict, field: str, required: bool = True):
+            value = operation[field] if required else operation.get(field)
+            if value is not None and not isinstance(value, str):
+                raise TypeError(f"'{field}' must be a string")
+            return value
+
+        try:
+            for index, operation in enumerate(operations):
+                if not isinstance(operation, dict):
+                    return False, f"Operation {index}: must be an object."
+                op = operation.get("op")
+                results.append({"index": index, "op": op})
+                if op == "create":
+                    totp_secret = text(operation, "totp", required=False)
+                    creates.append((index, (text(operation, "website"), text(operation, "username"),
+                                            self.encrypt_password(text(operation, "password")),
+                                            self.fernet.encrypt(totp.parse_secret(totp_secret)) if totp_secret else None)))
+                elif op in ("update", "delete"):
+                    password_id = int(operation["id"])
+                    if password_id in touched:
+                        # Two changes to one entry would be applied in no defined order
+                        return False, f"Operation {index}: entry {password_id} appears more than once in the batch."
+                    touched.add(password_id)
+                    if op == "update":
+                        raw_password = text(operation, "password", required=False)
+                        encrypted_password = self.encrypt_password(raw_password) if raw_password else None
+                        updates.append((index, (password_id, text(operation, "website", required=False),
+                                                text(operation, "username", required=False), encrypted_password)))
+                    else:
+                        deletes.append((index, password_id))
+                else:
+                    return False, f"Operation {index}: unknown op '{op}'."
+        except KeyError as e:
+            return False, f"Operation {len(results) - 1}: missing field {e}."
+        except (TypeError, ValueError) as e:
+            return False, f"Operation {len(results) - 1}: invalid field: {e}."
+
+        success, data = db.batch_vault_operations(
+            user_id,
+            creates=[values for _, values in creates],
+            updates=[values for _, values in updates],
+            deletes=[password_id for _, password_id in deletes],
+        )
+        if not success:
+            audit.record("batch", user_id=user_id, success=False, detail=f"{len(operations)} operations")
+            return False, data
+
+        for (index, _), new_id in zip(creates, data["created"]):
+            results[index].update({"success": True, "id": new_id})
+        updated, deleted = set(data["updated"]), set(data["deleted"])
+        for index, values in updates:
+            found = values[0] in updated
+            results[index].update({"success": found, "id": values[0]})
+            if not found:
+                results[index]["message"] = "Password not found or you do not have permission to update it."
+        for index, password_id in deletes:
+            found = password_id in deleted
+            results[index].update({"success": found, "id": password_id})
+            if not found:
+                results[index]["message"] = "Password not found or you do not have permission to delete it."
+        if deletes or any(values[3] for _, values in creates):
+            self.totp_cache.invalidate(user_id)
+        for result in results:
+            audit.record(result["op"], user_id=user_id, entry_id=result.get("id"), success=result["success"], detail="batch")
+        return True, results
+
+    def get_history(self, user_id: int, password_id: int):
+        """Returns (success, revisions) of one entry, newest first, with each earlier password decrypted."""
+        success, data = db.list_revisions(user_id, password_id)
+        audit.record("history", user_id=user_id, entry_id=password_id, success=success,
+                     detail=f"{len(data)} revisions revealed" if success else None)
+        if not success:
+            return False, data
+        for revision in data:
+            try:
+                revision["password"] = self.decrypt_password(bytes(revision["password"]))
+            except ValueError:
+                revision["password"] = None
+        return True, data
+
+    def get_deleted_passwords(self, user_id: int):
+        return db.list_deleted_passwords(user_id)
+
+    def restore_revision(self, user_id: int, password_id: int, revision_id: int):
+        success, message = db.restore_revision(user_id, password_id, revision_id)
+        if success:
+            self.totp_cache.invalidate(user_id)
+        audit.record("restore", user_id=user_id, entry_id=password_id, success=success, detail=f"revision {revision_id}")
+        return success, message
+
+    def undelete_password(self, user_id: int, password_id: int):
+        success, message = db.undelete_password(user_id, password_id)
+        if success:
+            self.totp_cache.invalidate(user_id)
+        audit.record("undelete", user_id=user_id, entry_id=password_id, success=success)
+        return success, message
+
+    def create_organization(self, user_id: int, name: str):
+        success, data = db.create_organization(user_id, name)
+        audit.record("org_create", user_id=user_id, success=success, detail=name)
+        return success, data
+
+    def set_organization_member(self, organization_id: int, actor_id: int, email: str, role: str):
+        if role not in sharing.ROLES:
+            return False, f"Role must be one of: {', '.join(sharing.ROLES)}."
+        user = db.get_user(email)
+        if not user:
+            return False, "User not found."
+        success, message = db.set_organization_member(organization_id, actor_id, user[0], role)
+        audit.record("org_member_set", user_id=actor_id, success=success,
+                     detail=f"organization {organization_id}: user {user[0]} as {role}")
+        return success, message
+
+    def remove_organization_member(self, organization_id: int, actor_id: int, user_id: int):
+        success, message = db.remove_organization_member(organization_id, actor_id, user_id)
+        audit.record("org_member_remove", user_id=actor_id, success=success,
+                     detail=f"organization {organization_id}: user {user_id}")
+        return success, message
+
+    def create_collection(self, organization_id: int, actor_id: int, name: str):
+        """Creates a collection with a fresh data key, wrapped for its creator only."""
+        wrapped_key = self.keyring.wrap(actor_id, sharing.new_collection_key())
+        success, data = db.create_collection(organization_id, actor_id, name, wrapped_key)
+        audit.record("collection_create", user_id=actor_id, success=success,
+                     detail=f"organization {organization_id}: {name}")
+        return success, data
+
+    def _collection_fernet(self, collection_id: int, user_id: int, needs: tuple):
+        """Returns (Fernet, None) for a member whose permission is in needs, else (None, error message)."""
+        access = db.get_collection_access(collection_id, user_id)
+        if not access or access[0] not in needs:
+            return None, "Collection not found or you do not have permission for this action."
+        return self.keyring.collection_fernet(user_id, access[1]), None
+
+    def share_collection(self, collection_id: int, actor_id: int, email: str, permission: str):
+        """
+        Shares a collection with a member of its organization. Only the
+        collection key is re-wrapped for them; no entry is re-encrypted.
+        """
+        if permission not in sharing.PERMISSIONS:
+            return False, f"Permission must be one of: {', '.join(sharing.PERMISSIONS)}."
+        access = db.get_collection_access(collection_id, actor_id)
+        if not access or access[0] != "manage":
+            return False, "Collection not found or you do not manage it."
+        user = db.get_user(email)
+        if not user:
+            return False, "User not found."
+        wrapped_key = self.keyring.wrap(user[0], self.keyring.unwrap(actor_id, access[1]))
+        success, message = db.set_collection_member(collection_id, actor_id, user[0], permission, wrapped_key)
+        audit.record("share", user_id=actor_id, success=success,
+                     detail=f"collection {collection_id}: user {user[0]} can {permission}")
+        return success, message
+
+    def unshare_collection(self, collection_id: int, actor_id: int, user_id: int):
+        """Revokes a member's access by deleting their wrapped key."""
+        success, message = db.remove_collection_member(collection_id, actor_id, user_id)
+        audit.record("unshare", user_id=actor_id, success=success, detail=f"collection {collection_id}: user {user_id}")
+        return success, message
+
+    def add_collection_entry(self, collection_id: int, user_id: int, website: str, username: str, raw_password: str):
+        fernet, message = self._collection_fernet(collection_id, user_id, ("write", "manage"))
+        if fernet is None:
+            success, data = False, message
+        else:
+            success, data = db.save_collection_entry(collection_id, user_id, website, username,
+                                                     fernet.encrypt(raw_password.encode()))
+        # entry_id is reserved for personal entries; collection entries are numbered separately
+        audit.record("create", user_id=user_id, success=success,
+                     detail=f"collection {collection_id} entry {data}" if success else f"collection {collection_id}")
+        return success, data
+
+    def update_collection_entry(self, collection_id: int, entry_id: int, user_id: int, website: str = None,
+                                username: str = None, raw_password: str = None):
+        fernet, message = self._collection_fernet(collection_id, user_id, ("write", "manage"))
+        if fernet is None:
+            success = False
+        else:
+            encrypted_password = fernet.encrypt(raw_password.encode()) if raw_password else None
+            success, message = db.update_collection_entry(collection_id, entry_id, user_id, website, username,
+                                                          encrypted_password)
+        audit.record("update", user_id=user_id, success=success, detail=f"collection {collection_id} entry {entry_id}")
+        return success, message
+
+    def delete_collection_entry(self, collection_id: int, entry_id: int, user_id: int):
+        success, message = db.delete_collection_entry(collection_id, entry_id, user_id)
+        audit.record("delete", user_id=user_id, success=success, detail=f"collection {collection_id} entry {entry_id}")
+        return success, message
+
 # For testing
 pm = password_manager = PasswordManager()
 
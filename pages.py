@@ -0,0 +1,115 @@
+import hashlib
+import os
+import stat
+from typing import Callable, Dict, Optional
+
+import jinja2
+from dotenv import load_dotenv
+from fastapi import Request
+from fastapi.responses import Response
+
+import tracing
+from responses import COMPRESSION_MIN_SIZE, brotli, compress, negotiate_encoding
+
+load_dotenv()
+
+TEMPLATE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+# Compiled templates are shared by every worker and survive restarts. Unset uses Jinja's
+# private per-user folder in the temp directory; a custom folder must be owned by this user
+TEMPLATE_BYTECODE_DIR = os.getenv("TEMPLATE_BYTECODE_DIR")
+TEMPLATE_AUTO_RELOAD = os.getenv("TEMPLATE_AUTO_RELOAD", "false").lower() == "true" # Pick up edited templates (development)
+PAGE_CACHE_CONTROL = os.getenv("PAGE_CACHE_CONTROL", "no-cache") # Browsers revalidate cached pages with If-None-Match
+PAGE_BROTLI_QUALITY = 11 # Pages are compressed once, so the slowest, smallest setting is affordable
+
+
+def _bytecode_cache() -> jinja2.FileSystemBytecodeCache:
+    """
+    Cached bytecode is executed as is, so whoever can write the folder can run
+    code in the app. A custom TEMPLATE_BYTECODE_DIR is created private (0700)
+    and refused unless this user owns it and nobody else can write to it.
+    """
+    if not TEMPLATE_BYTECODE_DIR:
+        return jinja2.FileSystemBytecodeCache() # Jinja checks its own folder the same way
+    os.makedirs(TEMPLATE_BYTECODE_DIR, mode=0o700, exist_ok=True)
+    info = os.lstat(TEMPLATE_BYTECODE_DIR)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise RuntimeError(f"TEMPLATE_BYTECODE_DIR {TEMPLATE_BYTECODE_DIR} must be a directory owned by this user "
+                           "and writable by no one else.")
+    return jinja2.FileSystemBytecodeCache(TEMPLATE_BYTECODE_DIR)
+
+
+def template_environment(directory: str = TEMPLATE_DIRECTORY) -> jinja2.Environment:
+    """
+    Builds the Jinja environment shared by the web pages and the emails.
+    Compiled template code goes to the bytecode cache, so a new worker
+    loads it instead of parsing and compiling every template again.
+    """
+    return jinja2.Environment(
+        loader=jinja2.FileSystemLoader(directory),
+        autoescape=jinja2.select_autoescape(),
+        bytecode_cache=_bytecode_cache(),
+        auto_reload=TEMPLATE_AUTO_RELOAD,
+    )
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    """If-None-Match uses the weak comparison: W/ prefixes are ignored."""
+    if not header:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+class RenderedPage:
+    """One rendered page: its body in every content coding, and the ETag of each."""
+    __slots__ = ("bodies", "etags", "is_current")
+
+    def __init__(self, body: bytes, is_current: Optional[Callable[[], bool]]):
+        self.bodies: Dict[Optional[str], bytes] = {None: body}
+        if len(body) >= COMPRESSION_MIN_SIZE:
+            self.bodies["gzip"] = compress(body, "gzip")
+            if brotli is not None:
+                self.bodies["br"] = brotli.compress(body, quality=PAGE_BROTLI_QUALITY)
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        # Each coding is a different representation, so each gets its own strong ETag
+        self.etags = {encoding: f'"{digest}-{encoding}"' if encoding else f'"{digest}"' for encoding in self.bodies}
+        self.is_current = is_current
+
+
+class PageCache:
+    """
+    Serves pages whose HTML does not depend on the request (the landing,
+    login and signup pages without an error message). Each page is rendered
+    once per worker; requests then get the stored bytes, already compressed,
+    or a bodiless 304 when the browser's copy is still current.
+    Only use it for templates that never read the request or the session.
+    """
+
+    def __init__(self, templates):
+        self._templates = templates
+        self._pages: Dict[str, RenderedPage] = {}
+
+    def _render(self, name: str) -> RenderedPage:
+        template = self._templates.get_template(name)
+        with tracing.span("template.render", template=name):
+            body = template.render().encode("utf-8")
+        return RenderedPage(body, (lambda: template.is_up_to_date) if TEMPLATE_AUTO_RELOAD else None)
+
+    def response(self, request: Request, name: str) -> Response:
+        page = self._pages.get(name)
+        if page is None or (page.is_current is not None and not page.is_current()):
+            # Two requests racing here both render; the result is identical, so no lock is needed
+            page = self._pages[name] = self._render(name)
+
+        encoding = negotiate_encoding(request) if len(page.bodies) > 1 else None
+        if encoding not in page.bodies:
+            encoding = None
+        headers = {"ETag": page.etags[encoding], "Vary": "Accept-Encoding", "Cache-Control": PAGE_CACHE_CONTROL}
+        if _etag_matches(request.headers.get("if-none-match"), page.etags[encoding]):
+            return Response(status_code=304, headers=headers)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(content=page.bodies[encoding], media_type="text/html", headers=headers)
@@ -0,0 +1,184 @@
+"""
+Online shard rebalancing.
+
+    python rebalance.py [--dry-run] [--user USER_ID] [--limit N]
+
+Moves every user whose directory shard differs from the shard the hash ring
+assigns today (e.g. after appending a shard to DATABASE_SHARD_URLS), one user
+at a time. Each move fences only that user's writes:
+
+1. set user_directory.fenced, then wait until every worker's directory cache
+   has expired and any in-flight write has finished;
+2. copy the USER row, its passwords, their revision history and its
+   attachments (ids preserved) to the target shard, streaming attachment chunks rather than loading them at once;
+3. point the directory at the target and lift the fence;
+4. wait for cached routes to the old shard to expire, then delete the old rows.
+
+Reads keep working throughout; writes for the user being moved are refused
+for the few seconds the fence is up.
+"""
+import argparse
+import time
+
+import psycopg2
+
+import sharding
+from databse import Database, STATEMENT_TIMEOUT_MS
+
+FENCE_SETTLE_SECONDS = sharding.SHARD_DIRECTORY_TTL + STATEMENT_TIMEOUT_MS / 1000
+CHUNK_COPY_BATCH = 16 # Attachment chunks fetched and inserted per round trip
+REVISION_COLUMNS = "id, password_id, user_id, website, username, password, totp_secret, action, created_at"
+ATTACHMENT_COLUMNS = "id, user_id, password_id, detached_from, kind, filename, content_type, size, chunk_size, chunk_count, wrapped_key, complete, created_at"
+
+
+def misplaced_users(db: Database, only_user: int = None, limit: int = None):
+    """Yields (user_id, current_shard, target_shard) for users the ring places elsewhere."""
+    with db.get_connection() as (conn, cursor):
+        if not conn:
+            raise ConnectionError("Cannot reach the user directory.")
+        if only_user is not None:
+            cursor.execute("SELECT user_id, shard FROM user_directory WHERE user_id = %s;", (only_user,))
+        else:
+            cursor.execute("SELECT user_id, shard FROM user_directory ORDER BY user_id;")
+        rows = cursor.fetchall()
+    moved = 0
+    for user_id, shard in rows:
+        target = sharding.ring.node_for(user_id)
+        if target != shard:
+            yield user_id, shard, target
+            moved += 1
+            if limit is not None and moved >= limit:
+                return
+
+
+def _set_directory(db: Database, user_id: int, **changes):
+    assignments = ", ".join(f"{column} = %s" for column in changes)
+    with db.get_connection() as (conn, cursor):
+        if not conn:
+            raise ConnectionError("Cannot reach the user directory.")
+        cursor.execute(f"UPDATE user_directory SET {assignments} WHERE user_id = %s;", (*changes.values(), user_id))
+        conn.commit()
+
+
+def _copy_attachment_chunks(db: Database, source: str, attachment_ids, dst_cursor):
+    """Streams the chunks of the given attachments from source into dst_cursor's transaction."""
+    with db.get_connection(shard=source) as (src_conn, _):
+        if not src_conn:
+            raise ConnectionError(f"Cannot reach shard {source}.")
+        # A server-side cursor keeps only CHUNK_COPY_BATCH chunks in memory at a time
+        with src_conn.cursor(name="rebalance_chunks") as chunk_cursor:
+            chunk_cursor.itersize = CHUNK_COPY_BATCH
+            chunk_cursor.execute(
+                "SELECT attachment_id, chunk_index, data FROM attachment_chunks WHERE attachment_id = ANY(%s);",
+                (attachment_ids,)
+            )
+            while True:
+                rows = chunk_cursor.fetchmany(CHUNK_COPY_BATCH)
+                if not rows:
+                    break
+                dst_cursor.execute_values(
+                    "INSERT INTO attachment_chunks (attachment_id, chunk_index, data) VALUES %s;", rows
+                )
+        src_conn.rollback()
+
+
+def move_user(db: Database, user_id: int, source: str, target: str):
+    """Moves one user's rows from source to target behind a short write fence."""
+    _set_directory(db, user_id, fenced=True)
+    copied = False
+    try:
+        time.sleep(FENCE_SETTLE_SECONDS)
+
+        with db.get_connection(shard=source) as (src_conn, src_cursor):
+            if not src_conn:
+                raise ConnectionError(f"Cannot reach shard {source}.")
+            src_cursor.execute(
+                'SELECT user_id, username, email, password, verification_status FROM "USER" WHERE user_id = %s;',
+                (user_id,)
+            )
+            user_row = src_cursor.fetchone()
+            src_cursor.execute(
+                "SELECT id, user_id, website, username, password, totp_secret FROM passwords WHERE user_id = %s;", (user_id,)
+            )
+            password_rows = src_cursor.fetchall()
+            src_cursor.execute(f"SELECT {REVISION_COLUMNS} FROM password_revisions WHERE user_id = %s;", (user_id,))
+            revision_rows = src_cursor.fetchall()
+            src_cursor.execute(f"SELECT {ATTACHMENT_COLUMNS} FROM attachments WHERE user_id = %s;", (user_id,))
+            attachment_rows = src_cursor.fetchall()
+            src_conn.rollback()
+        if user_row is None:
+            raise LookupError(f"User {user_id} has no row on shard {source}.")
+
+        with db.get_connection(shard=target) as (dst_conn, dst_cursor):
+            if not dst_conn:
+                raise ConnectionError(f"Cannot reach shard {target}.")
+            dst_cursor.execute(
+                'INSERT INTO "USER" (user_id, username, email, password, verification_status) VALUES (%s, %s, %s, %s, %s);',
+                user_row
+            )
+            if password_rows:
+                dst_cursor.execute_values(
+                    "INSERT INTO passwords (id, user_id, website, username, password, totp_secret) VALUES %s;",
+                    password_rows
+                )
+            if revision_rows:
+                dst_cursor.execute_values(
+                    f"INSERT INTO password_revisions ({REVISION_COLUMNS}) VALUES %s;", revision_rows
+                )
+            if attachment_rows:
+                dst_cursor.execute_values(
+                    f"INSERT INTO attachments ({ATTACHMENT_COLUMNS}) VALUES %s;", attachment_rows
+                )
+                _copy_attachment_chunks(db, source, [row[0] for row in attachment_rows], dst_cursor)
+            dst_conn.commit()
+            copied = True
+
+        _set_directory(db, user_id, shard=target, fenced=False)
+    except Exception:
+        if copied:
+            # Undo the copy so the target does not keep an orphaned duplicate
+            with db.get_connection(shard=target) as (dst_conn, dst_cursor):
+                if dst_conn:
+                    dst_cursor.execute('DELETE FROM "USER" WHERE user_id = %s;', (user_id,))
+                    dst_conn.commit()
+        _set_directory(db, user_id, fenced=False)
+        raise
+
+    # Workers may still route reads to the source from their cache for up to the TTL
+    time.sleep(sharding.SHARD_DIRECTORY_TTL)
+    with db.get_connection(shard=source) as (src_conn, src_cursor):
+        if src_conn:
+            src_cursor.execute('DELETE FROM "USER" WHERE user_id = %s;', (user_id,)) # Cascades to passwords, revisions and attachments
+            src_conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move users to the shard the hash ring assigns them.")
+    parser.add_argument("--dry-run", action="store_true", help="only list the users that would move")
+    parser.add_argument("--user", type=int, help="move just this user_id")
+    parser.add_argument("--limit", type=int, help="move at most this many users")
+    args = parser.parse_args()
+
+    if not sharding.SHARD_URLS:
+        parser.error("DATABASE_SHARD_URLS is not set.")
+    db = Database()
+
+    moved = failed = 0
+    for user_id, source, target in misplaced_users(db, args.user, args.limit):
+        if args.dry_run:
+            print(f"user {user_id}: {source} -> {target}")
+            continue
+        started = time.monotonic()
+        try:
+            move_user(db, user_id, source, target)
+            moved += 1
+            print(f"✅ user {user_id}: {source} -> {target} ({time.monotonic() - started:.1f}s)")
+        except (psycopg2.Error, ConnectionError, LookupError) as e:
+            failed += 1
+            print(f"❌ user {user_id}: {source} -> {target} failed: {e}")
+    if not args.dry_run:
+        print(f"Done: {moved} moved, {failed} failed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import gzip
+import itertools
+import json
+import zlib
+from typing import Any, Iterable, Iterator, Optional
+
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+import tracing
+
+# orjson is the fast path; the stdlib json module is used if it is not installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Brotli and MessagePack are optional extras
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+COMPRESSION_MIN_SIZE = 1024 # Bodies smaller than this are sent uncompressed
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4 # Low qualities keep brotli faster than gzip while still compressing better
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+STREAM_CHUNK_SIZE = 64 * 1024 # Bytes of output collected before a streamed response writes them
+
+
+def dumps_json(content: Any) -> bytes:
+    """Serializes content to compact UTF-8 JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class ORJSONResponse(Response):
+    """JSONResponse replacement that serializes with orjson when available."""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps_json(content)
+
+
+def _accepted_encodings(header: str) -> dict:
+    """Returns the content codings in an Accept-Encoding header with their q-values (q=0 ones included)."""
+    accepted = {}
+    for part in header.split(","):
+        coding, *params = (piece.strip() for piece in part.split(";"))
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0 # Malformed weight: do not pick that coding
+        if coding:
+            accepted[coding.lower()] = quality
+    return accepted
+
+
+def negotiate_encoding(request: Request) -> Optional[str]:
+    """
+    Picks the supported compression with the highest q-value (br wins ties,
+    then gzip), or None when the client accepts neither or prefers identity.
+    """
+    accepted = _accepted_encodings(request.headers.get("accept-encoding", ""))
+    wildcard = accepted.get("*", 0.0)
+    best, best_quality = None, 0.0
+    for coding in ("br", "gzip"):
+        if coding == "br" and brotli is None:
+            continue
+        quality = accepted.get(coding, wildcard)
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    if best is not None and accepted.get("identity", 0.0) > best_quality:
+        return None
+    return best
+
+
+def compress(body: bytes, encoding: Optional[str]) -> bytes:
+    """Compresses body with the given content coding ("br", "gzip" or None)."""
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=GZIP_LEVEL)
+    return body
+
+
+def vault_response(request: Request, content: Any, status_code: int = 200) -> Response:
+    """
+    Builds a response for (potentially large) vault payloads.
+
+    The body is MessagePack when the client asks for it in the Accept header and
+    msgpack is installed, otherwise JSON. Bodies above COMPRESSION_MIN_SIZE are
+    compressed with the best encoding the client accepts.
+    """
+    if msgpack is not None and MSGPACK_MEDIA_TYPE in request.headers.get("accept", ""):
+        with tracing.span("response.encode", format="msgpack"):
+            body = msgpack.packb(content, use_bin_type=True)
+        media_type = MSGPACK_MEDIA_TYPE
+    else:
+        with tracing.span("response.encode", format="json"):
+            body = dumps_json(content)
+        media_type = ORJSONResponse.media_type
+
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if len(body) >= COMPRESSION_MIN_SIZE:
+        encoding = negotiate_encoding(request)
+        if encoding:
+            with tracing.span("response.compress", encoding=encoding, bytes_in=len(body)):
+                body = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+
+    return Response(content=body, status_code=status_code, media_type=media_type, headers=headers)
+
+
+def _json_list_pieces(key: str, items: Iterator[Any]) -> Iterator[bytes]:
+    """Yields {"key": [item, ...]} as JSON, one item at a time."""
+    yield b"{" + dumps_json(key) + b":["
+    for index, item in enumerate(items):
+        yield (b"," if index else b"") + dumps_json(item)
+    yield b"]}"
+
+
+def _compressor(encoding: str):
+    """Returns an object with process(bytes) and finish() for incremental compression."""
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        return compressor.process, compressor.finish
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS) # gzip container
+    return compressor.compress, compressor.flush
+
+
+def vault_list_response(request: Request, key: str, items: Iterable[Any], status_code: int = 200) -> Response:
+    """
+    Builds the response for {key: [item, ...]} from a lazy iterable of items.
+
+    The JSON body is streamed: each item is serialized (and compressed) as it
+    is produced, so the whole list is never held in memory, decrypted or
+    encoded. Lists that fit under COMPRESSION_MIN_SIZE are sent in one piece,
+    and MessagePack bodies are built whole with vault_response.
+    """
+    if msgpack is not None and MSGPACK_MEDIA_TYPE in request.headers.get("accept", ""):
+        return vault_response(request, {key: list(items)}, status_code=status_code)
+
+    pieces = _json_list_pieces(key, iter(items))
+    head, size = [], 0
+    for piece in pieces:
+        head.append(piece)
+        size += len(piece)
+        if size >= COMPRESSION_MIN_SIZE:
+            break
+    else:
+        return Response(content=b"".join(head), status_code=status_code, media_type=ORJSONResponse.media_type,
+                        headers={"Vary": "Accept, Accept-Encoding"})
+
+    encoding = negotiate_encoding(request)
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+
+    def body() -> Iterator[bytes]:
+        process, finish = _compressor(encoding) if encoding else (None, None)
+        buffered, buffered_size = [], 0
+        for piece in itertools.chain(head, pieces):
+            out = process(piece) if process else piece
+            if out:
+                buffered.append(out)
+                buffered_size += len(out)
+            if buffered_size >= STREAM_CHUNK_SIZE:
+                yield b"".join(buffered)
+                buffered, buffered_size = [], 0
+        if finish:
+            buffered.append(finish())
+        yield b"".join(buffered)
+
+    return StreamingResponse(body(), status_code=status_code, media_type=ORJSONResponse.media_type, headers=headers)
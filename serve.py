@@ -0,0 +1,47 @@
+"""
+Multi-process serving mode.
+
+    python serve.py --workers 4 [--host 0.0.0.0] [--port 8000] [--init-key]
+
+The parent process loads (or, with the file provider and --init-key,
+creates exactly once) the vault key before any worker starts and exports its fingerprint as
+VAULT_KEY_FINGERPRINT. Every worker then loads the key from the same
+provider and refuses to start if its fingerprint differs, and creates its
+own database pool after the worker process has started.
+"""
+import argparse
+import os
+
+import uvicorn
+
+import keys
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run SecureVault with several worker processes.")
+    parser.add_argument("--host", default=os.getenv("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)))
+    parser.add_argument("--init-key", action="store_true", help="create the key file if it does not exist (new vault)")
+    args = parser.parse_args()
+
+    # Load (or create) the key once, here, so workers only ever read it
+    provider = keys.get_key_provider()
+    if isinstance(provider, keys.FileKeyProvider):
+        provider.create = args.init_key
+    try:
+        key = provider.load_key()
+    except keys.KeyProviderError as e:
+        raise SystemExit(f"❌ {e}")
+    fingerprint = keys.key_fingerprint(key)
+
+    os.environ[keys.FINGERPRINT_ENV] = fingerprint
+    print(f"🔑 Vault key fingerprint {fingerprint}; starting {args.workers} worker(s).")
+
+    # uvicorn starts each worker as a fresh process that imports web.py itself,
+    # so no database connection is created before the workers exist
+    uvicorn.run("web:app", host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import bisect
+import hashlib
+import os
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SHARD_VIRTUAL_NODES = int(os.getenv("SHARD_VIRTUAL_NODES", "128")) # Ring points per shard; more points, smoother spread
+SHARD_DIRECTORY_TTL = float(os.getenv("SHARD_DIRECTORY_TTL", "2")) # Seconds a directory lookup is cached per worker
+SHARD_ID_STRIDE = int(os.getenv("SHARD_ID_STRIDE", "64")) # Max shards; row ids are striped across shards by this step
+
+
+def parse_shard_urls(value: str) -> Dict[str, str]:
+    """
+    Parses DATABASE_SHARD_URLS: comma-separated "name=dsn" pairs, e.g.
+    "s1=postgresql://.../vault1,s2=postgresql://.../vault2".
+    Order matters: a shard's position fixes its row-id slot, so only ever append.
+    """
+    shards: Dict[str, str] = {}
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, sep, url = part.partition("=")
+        if not sep or not name.strip() or not url.strip():
+            raise ValueError(f"Invalid DATABASE_SHARD_URLS entry '{part}'; expected name=dsn.")
+        shards[name.strip()] = url.strip()
+    if len(shards) > SHARD_ID_STRIDE:
+        raise ValueError(f"At most {SHARD_ID_STRIDE} shards are supported (SHARD_ID_STRIDE).")
+    return shards
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent-hash ring with virtual nodes. Adding a shard only takes over
+    roughly 1/N of the keys, so a rebalance moves few users.
+    """
+
+    def __init__(self, nodes: List[str], virtual_nodes: int = SHARD_VIRTUAL_NODES):
+        points = sorted((_hash(f"{node}#{i}"), node) for node in nodes for i in range(virtual_nodes))
+        self._keys = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key) -> Optional[str]:
+        """Returns the shard owning key, or None if the ring is empty."""
+        if not self._keys:
+            return None
+        index = bisect.bisect(self._keys, _hash(str(key))) % len(self._keys)
+        return self._nodes[index]
+
+
+SHARD_URLS = parse_shard_urls(os.getenv("DATABASE_SHARD_URLS", ""))
+ring = HashRing(list(SHARD_URLS))
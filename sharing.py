@@ -0,0 +1,58 @@
+import base64
+import threading
+from typing import Dict
+
+from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+ROLES = ("owner", "admin", "member") # Organization roles; owners and admins manage members and collections
+PERMISSIONS = ("read", "write", "manage") # Collection permissions, each including the ones before it
+
+
+def new_collection_key() -> bytes:
+    """Generates a collection's data key. Entries of the collection are encrypted with it, never re-encrypted."""
+    return Fernet.generate_key()
+
+
+class MemberKeyring:
+    """
+    Wraps collection data keys for individual members.
+
+    Each member gets their own key-encryption key, derived from the vault key
+    with HKDF, and each collection key is stored once per member, wrapped with
+    it. Sharing a collection wraps the key once more; revoking deletes that
+    member's copy. A membership row can only be unwrapped for the user it
+    was written for.
+    """
+
+    def __init__(self, vault_key: bytes):
+        self._vault_key = vault_key
+        self._fernets: Dict[int, Fernet] = {}
+        self._lock = threading.Lock()
+
+    def _fernet(self, user_id: int) -> Fernet:
+        with self._lock:
+            fernet = self._fernets.get(user_id)
+            if fernet is None:
+                derived = HKDF(
+                    algorithm=hashes.SHA256(), length=32, salt=None,
+                    info=b"securevault collection member %d" % user_id,
+                ).derive(self._vault_key)
+                fernet = self._fernets[user_id] = Fernet(base64.urlsafe_b64encode(derived))
+                if len(self._fernets) > 10000:
+                    self._fernets.clear() # Cheap to re-derive; just keep the map bounded
+                    self._fernets[user_id] = fernet
+            return fernet
+
+    def wrap(self, user_id: int, data_key: bytes) -> bytes:
+        """Encrypts a collection key for one member."""
+        return self._fernet(user_id).encrypt(data_key)
+
+    def unwrap(self, user_id: int, wrapped_key) -> bytes:
+        """Decrypts a member's copy of a collection key (raises InvalidToken if it is not theirs)."""
+        return self._fernet(user_id).decrypt(bytes(wrapped_key))
+
+    def collection_fernet(self, user_id: int, wrapped_key) -> Fernet:
+        """Returns the Fernet for a collection's entries, from the member's wrapped key."""
+        return Fernet(self.unwrap(user_id, wrapped_key))
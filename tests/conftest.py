@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+from cryptography.fernet import Fernet
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Tests never touch a real key file
+os.environ["VAULT_KEY_PROVIDER"] = "env"
+os.environ.setdefault("VAULT_KEY", Fernet.generate_key().decode())
+
+
+@pytest.fixture(scope="session")
+def database():
+    """The Database on TEST_DATABASE_URL (a scratch PostgreSQL database); skips the test without one."""
+    url = os.getenv("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    os.environ["DATABASE_URL"] = url
+    import databse
+    return databse.Database()
+
+
+@pytest.fixture
+def vault_user(database):
+    """A throwaway user; returns its id and deletes it (and its whole vault) afterwards."""
+    email = f"test-{os.urandom(6).hex()}@example.com"
+    success, message = database.create_user(username="test", email=email, password="Test-Passw0rd!")
+    assert success, message
+    yield database.get_user(email)[0]
+    database.delete_user(email)
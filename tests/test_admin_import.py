@@ -0,0 +1,101 @@
+import argparse
+import csv
+import importlib
+import json
+
+import pytest
+
+ROWS = 10
+BATCH_SIZE = 2 # Batches start at rows 0, 2, 4, 6 and 8
+
+
+class RecordingDatabase:
+    """Stands in for Database: records what batch_vault_operations creates."""
+
+    def __init__(self):
+        self.created = []
+
+    def batch_vault_operations(self, user_id, creates, updates, deletes):
+        self.created.extend(website for website, *_ in creates)
+        return True, {"created": list(range(len(self.created) - len(creates), len(self.created))),
+                      "updated": [], "deleted": []}
+
+
+@pytest.fixture
+def admin(monkeypatch):
+    import databse
+    monkeypatch.setattr(databse, "Database", lambda: None) # No database server for these tests
+    module = importlib.import_module("admin")
+    monkeypatch.setattr(module, "db", RecordingDatabase())
+    monkeypatch.setattr(module, "resolve_user", lambda value: (1, "alice@example.com"))
+    monkeypatch.setattr(module.audit, "record", lambda *args, **kwargs: None)
+    return module
+
+
+def interrupted_after(order):
+    """A run_batches that completes the batches at the given task positions, in that order, then is interrupted."""
+    def run_batches(tasks, workers, on_result, in_flight=None):
+        tasks = list(tasks)
+        for position in order:
+            key, function, *args = tasks[position]
+            on_result(key, function(*args))
+        raise KeyboardInterrupt
+    return run_batches
+
+
+def run_in_order(tasks, workers, on_result, in_flight=None):
+    for key, function, *args in tasks:
+        on_result(key, function(*args))
+
+
+def import_args(tmp_path):
+    path = tmp_path / "entries.csv"
+    with open(path, "w", newline="", encoding="utf-8") as entries_file:
+        writer = csv.writer(entries_file)
+        writer.writerow(("website", "username", "password"))
+        writer.writerows((f"site-{row}.example.com", "alice", f"Passw0rd-{row}") for row in range(ROWS))
+    return argparse.Namespace(user="1", file=str(path), format="csv", workers=2, batch_size=BATCH_SIZE,
+                              checkpoint=str(tmp_path / "import.checkpoint"))
+
+
+def test_resumed_import_skips_batches_that_finished_out_of_order(admin, monkeypatch, tmp_path):
+    args = import_args(tmp_path)
+    # Rows 2-3 and 6-7 commit while rows 0-1 are still running when the run is interrupted
+    monkeypatch.setattr(admin, "run_batches", interrupted_after([1, 3]))
+    with pytest.raises(KeyboardInterrupt):
+        admin.command_import(args)
+    with open(args.checkpoint, encoding="utf-8") as checkpoint_file:
+        assert json.load(checkpoint_file)["progress"]["rows"] == {"done": 0, "finished": [[2, 4], [6, 8]]}
+
+    monkeypatch.setattr(admin, "run_batches", run_in_order)
+    admin.command_import(args)
+
+    created = admin.db.created
+    assert sorted(created) == sorted(f"site-{row}.example.com" for row in range(ROWS))
+    assert len(created) == len(set(created)) == ROWS
+
+
+def test_resuming_with_another_batch_size_imports_each_row_once(admin, monkeypatch, tmp_path):
+    args = import_args(tmp_path)
+    monkeypatch.setattr(admin, "run_batches", interrupted_after([2, 4]))
+    with pytest.raises(KeyboardInterrupt):
+        admin.command_import(args)
+
+    args.batch_size = 3
+    monkeypatch.setattr(admin, "run_batches", run_in_order)
+    admin.command_import(args)
+    assert sorted(admin.db.created) == sorted(f"site-{row}.example.com" for row in range(ROWS))
+
+
+def test_old_checkpoints_resume_from_their_watermark(admin, tmp_path):
+    path = tmp_path / "old.checkpoint"
+    path.write_text(json.dumps({"command": "verify", "progress": {"passwords@primary": 41}}))
+    watermark = admin.Checkpoint(str(path), "verify").watermark("passwords@primary", 1)
+    assert (watermark.value, watermark.finished()) == (41, [])
+
+
+def test_watermark_lists_what_is_left(admin):
+    watermark = admin.Watermark(0, [[10, 20], [30, 40]])
+    assert list(watermark.pending(0, 50)) == [(0, 10), (20, 30), (40, 50)]
+    assert watermark.finish(0, 10) == 20
+    assert watermark.finished() == [[30, 40]]
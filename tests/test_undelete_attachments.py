@@ -0,0 +1,63 @@
+import asyncio
+
+from cryptography.fernet import Fernet
+
+import attachments
+
+CONTENT = bytes(range(256)) * 1500 # Several chunks
+
+
+def read_attachment(database, fernet, user_id, attachment_id) -> bytes:
+    meta = database.get_attachment(user_id, attachment_id)
+    assert meta is not None
+    return b"".join(attachments.iter_plaintext(database, fernet, user_id, meta, 0, meta["size"] - 1))
+
+
+def test_undelete_brings_back_the_entry_attachments(database, vault_user):
+    fernet = Fernet(Fernet.generate_key())
+    success, data = database.batch_vault_operations(vault_user, creates=[("example.com", "alice", b"secret", None)],
+                                                    updates=[], deletes=[])
+    assert success, data
+    entry_id = data["created"][0]
+    success, attachment_id = asyncio.run(attachments.store_stream(
+        database, fernet, vault_user, attachments.bytes_stream(CONTENT), "file", "recovery-codes.bin",
+        "application/octet-stream", password_id=entry_id
+    ))
+    assert success, attachment_id
+
+    success, message = database.delete_password(entry_id, vault_user)
+    assert success, message
+    # Hidden while the entry is deleted, but its chunks are kept
+    assert attachment_id not in [item["id"] for item in database.list_attachments(vault_user)[1]]
+    assert database.get_attachment(vault_user, attachment_id) is None
+    assert database.get_attachment_chunk(vault_user, attachment_id, 0) is not None
+
+    success, message = database.undelete_password(vault_user, entry_id)
+    assert success, message
+    items = {item["id"]: item for item in database.list_attachments(vault_user)[1]}
+    assert items[attachment_id]["password_id"] == entry_id
+    assert read_attachment(database, fernet, vault_user, attachment_id) == CONTENT
+
+
+def test_attachments_of_an_expired_deleted_entry_are_pruned(database, vault_user):
+    fernet = Fernet(Fernet.generate_key())
+    success, data = database.batch_vault_operations(vault_user, creates=[("example.com", "bob", b"secret", None)],
+                                                    updates=[], deletes=[])
+    assert success, data
+    entry_id = data["created"][0]
+    success, attachment_id = asyncio.run(attachments.store_stream(
+        database, fernet, vault_user, attachments.bytes_stream(b"note"), "note", "pin", "text/plain",
+        password_id=entry_id
+    ))
+    assert success, attachment_id
+    success, data = database.batch_vault_operations(vault_user, creates=[], updates=[], deletes=[entry_id])
+    assert success and data["deleted"] == [entry_id], data
+
+    # Still undeletable: kept
+    database.prune_detached_attachments(1000)
+    assert database.get_attachment_chunk(vault_user, attachment_id, 0) is not None
+    with database.get_connection() as (conn, cursor):
+        cursor.execute("DELETE FROM password_revisions WHERE user_id = %s AND password_id = %s;", (vault_user, entry_id))
+        conn.commit()
+    database.prune_detached_attachments(1000)
+    assert database.get_attachment_chunk(vault_user, attachment_id, 0) is None
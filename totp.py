@@ -0,0 +1,115 @@
+import base64
+import hmac
+import os
+import struct
+import threading
+import time
+from typing import Dict, Hashable, Iterable, Optional
+from urllib.parse import parse_qs, urlparse
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TOTP_PERIOD = 30 # Seconds per code (RFC 6238 default, used by virtually every issuer)
+TOTP_DIGITS = 6
+TOTP_CACHE_SECONDS = float(os.getenv("TOTP_CACHE_SECONDS", "120")) # How long a session keeps decrypted seeds
+TOTP_CACHE_MAX_SESSIONS = int(os.getenv("TOTP_CACHE_MAX_SESSIONS", "10000")) # Per worker
+
+_DIGITS_MODULUS = 10 ** TOTP_DIGITS
+_PACK_COUNTER = struct.Struct(">Q").pack
+
+
+def parse_secret(value: str) -> bytes:
+    """
+    Turns a user-supplied 2FA seed into the raw HMAC key.
+    Accepts a base32 seed (spaces, dashes and case are ignored) or an
+    otpauth://totp/... URI. Raises ValueError if it is neither.
+    """
+    value = value.strip()
+    if value.lower().startswith("otpauth://"):
+        uri = urlparse(value)
+        if uri.netloc.lower() != "totp":
+            raise ValueError("Only time-based (totp) otpauth URIs are supported.")
+        params = parse_qs(uri.query)
+        if params.get("algorithm", ["SHA1"])[0].upper() != "SHA1" or params.get("digits", ["6"])[0] != "6" \
+                or params.get("period", ["30"])[0] != "30":
+            raise ValueError("Only SHA1, 6-digit, 30-second TOTP seeds are supported.")
+        value = params.get("secret", [""])[0]
+    seed = value.replace(" ", "").replace("-", "").upper().rstrip("=")
+    if not seed:
+        raise ValueError("TOTP secret is empty.")
+    try:
+        return base64.b32decode(seed + "=" * (-len(seed) % 8))
+    except ValueError: # binascii.Error is a ValueError
+        raise ValueError("TOTP secret must be base32 (A-Z, 2-7).")
+
+
+def current_codes(keys: Dict[int, bytes], now: Optional[float] = None) -> Dict[int, str]:
+    """
+    Computes the current code for every key in one pass. The counter is packed
+    once for the whole batch and each code is a single one-shot HMAC call.
+    """
+    message = _PACK_COUNTER(int(time.time() if now is None else now) // TOTP_PERIOD)
+    digest = hmac.digest
+    codes = {}
+    for entry_id, key in keys.items():
+        mac = digest(key, message, "sha1")
+        offset = mac[19] & 0x0F
+        binary = int.from_bytes(mac[offset:offset + 4], "big") & 0x7FFFFFFF
+        codes[entry_id] = str(binary % _DIGITS_MODULUS).zfill(TOTP_DIGITS)
+    return codes
+
+
+def seconds_remaining(now: Optional[float] = None) -> int:
+    """Seconds until the current codes roll over."""
+    return TOTP_PERIOD - int(time.time() if now is None else now) % TOTP_PERIOD
+
+
+class SecretCache:
+    """
+    Short-lived, per-worker cache of decrypted TOTP keys, keyed by
+    (user_id, session). A dashboard polling every 30 seconds then decrypts its
+    seeds once per TOTP_CACHE_SECONDS instead of on every refresh.
+    """
+
+    def __init__(self, ttl: float = TOTP_CACHE_SECONDS, max_sessions: int = TOTP_CACHE_MAX_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._entries: Dict[Hashable, tuple] = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int, session: str) -> Optional[Dict[int, bytes]]:
+        with self._lock:
+            entry = self._entries.get((user_id, session))
+            if entry is None:
+                return None
+            expires, keys = entry
+            if expires <= time.monotonic():
+                del self._entries[(user_id, session)]
+                return None
+            return keys
+
+    def put(self, user_id: int, session: str, keys: Dict[int, bytes]):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._entries) >= self.max_sessions:
+                # Drop expired sessions first; if that is not enough, the oldest inserted one
+                for cache_key in [k for k, (expires, _) in self._entries.items() if expires <= now]:
+                    del self._entries[cache_key]
+                if len(self._entries) >= self.max_sessions:
+                    del self._entries[next(iter(self._entries))]
+            self._entries[(user_id, session)] = (now + self.ttl, keys)
+
+    def invalidate(self, user_id: int):
+        """Forgets every session of user_id, e.g. after an entry's seed changed."""
+        with self._lock:
+            for cache_key in [k for k in self._entries if k[0] == user_id]:
+                del self._entries[cache_key]
+
+
+def select(keys: Dict[int, bytes], ids: Optional[Iterable[int]]) -> Dict[int, bytes]:
+    """Restricts keys to the requested entry ids (all of them when ids is None)."""
+    if ids is None:
+        return keys
+    return {entry_id: keys[entry_id] for entry_id in ids if entry_id in keys}
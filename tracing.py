@@ -0,0 +1,273 @@
+import contextvars
+import json
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+import psycopg2.extensions
+from psycopg2 import extras
+from dotenv import load_dotenv
+from fastapi.templating import Jinja2Templates
+
+load_dotenv()
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0")) # Fraction of requests traced (0 disables tracing)
+TRACE_EXPORT_FILE = os.getenv("TRACE_EXPORT_FILE", "traces.jsonl") # OTLP/JSON, one export request per line
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200")) # Queries at least this slow are logged
+SLOW_QUERY_SAMPLE_RATE = float(os.getenv("SLOW_QUERY_SAMPLE_RATE", "1")) # Fraction of slow queries logged (with their plan)
+SLOW_QUERY_LOG_FILE = os.getenv("SLOW_QUERY_LOG_FILE", "slow_queries.jsonl")
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "securevault")
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("current_trace", default=None)
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """One timed stage of a request. Times are wall-clock nanoseconds, as OTLP expects."""
+    __slots__ = ("span_id", "parent_id", "name", "start_ns", "end_ns", "attributes")
+
+    def __init__(self, name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.span_id = "%016x" % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+
+
+class Trace:
+    """All spans recorded for one sampled request."""
+    __slots__ = ("trace_id", "spans")
+
+    def __init__(self):
+        self.trace_id = "%032x" % random.getrandbits(128)
+        self.spans: List[Span] = []
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Records a nested span inside the current request's trace.
+    Outside a sampled request this is a no-op costing one ContextVar lookup.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+    parent = _current_span.get()
+    current = Span(name, parent.span_id if parent else None, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    finally:
+        current.end_ns = time.time_ns()
+        _current_span.reset(token)
+        trace.spans.append(current)
+
+
+def _attribute(key: str, value: Any) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class FileSpanExporter:
+    """Appends finished traces to a file in the OTLP/JSON trace format, one export request per line."""
+
+    def __init__(self, path: str = TRACE_EXPORT_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, trace: Trace):
+        request = {"resourceSpans": [{
+            "resource": {"attributes": [_attribute("service.name", SERVICE_NAME),
+                                        _attribute("process.pid", os.getpid())]},
+            "scopeSpans": [{
+                "scope": {"name": "securevault.tracing"},
+                "spans": [{
+                    "traceId": trace.trace_id,
+                    "spanId": s.span_id,
+                    **({"parentSpanId": s.parent_id} if s.parent_id else {}),
+                    "name": s.name,
+                    "kind": 2 if s.parent_id is None else 1, # SERVER for the root, INTERNAL otherwise
+                    "startTimeUnixNano": str(s.start_ns),
+                    "endTimeUnixNano": str(s.end_ns),
+                    "attributes": [_attribute(k, v) for k, v in s.attributes.items()],
+                } for s in trace.spans],
+            }],
+        }]}
+        line = json.dumps(request, separators=(",", ":"))
+        with self._lock, open(self.path, "a", encoding="utf-8") as export_file:
+            export_file.write(line + "\n")
+
+
+exporter = FileSpanExporter()
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware that traces a sampled fraction (TRACE_SAMPLE_RATE) of HTTP
+    requests. Spans opened anywhere during the request (pool wait, SQL,
+    decryption, encoding, template rendering) nest under the request's root
+    span, and the finished trace is handed to the exporter.
+    """
+
+    def __init__(self, app, sample_rate: float = TRACE_SAMPLE_RATE):
+        self.app = app
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace()
+        trace_token = _current_trace.set(trace)
+        status = {"code": 0}
+
+        async def send_with_trace_id(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-trace-id", trace.trace_id.encode())]
+            await send(message)
+
+        try:
+            with span(f"{scope['method']} {scope['path']}", **{"http.method": scope["method"], "http.target": scope["path"]}) as root:
+                try:
+                    await self.app(scope, receive, send_with_trace_id)
+                finally:
+                    root.attributes["http.status_code"] = status["code"]
+        finally:
+            _current_trace.reset(trace_token)
+            try:
+                exporter.export(trace)
+            except OSError as e:
+                print(f"❌ Failed to export trace {trace.trace_id}: {e}")
+
+
+def _param_shape(params: Any) -> Any:
+    """Describes query parameters by type (and length for sequences) without their values."""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {k: _param_shape(v) for k, v in params.items()}
+    if isinstance(params, (list, tuple)):
+        if len(params) > 10:
+            return f"{type(params).__name__}[{len(params)}]"
+        return [_param_shape(p) if isinstance(p, (list, tuple, dict)) else type(p).__name__ for p in params]
+    return type(params).__name__
+
+
+_slow_log_lock = threading.Lock()
+
+
+_POSITIONAL = re.compile(r"%s|%%")
+PREFORMATTED = "(pre-formatted statement)" # Shown instead of SQL that has values interpolated into it
+
+
+def _statement_text(query: Any) -> str:
+    return query.decode() if isinstance(query, bytes) else str(query)
+
+
+def _generic_plan(cursor, statement: str) -> Any:
+    """
+    Returns the generic plan of a %s-parameterized statement, planned without
+    any parameter values so none of them can appear in it (PostgreSQL 16+).
+    """
+    if cursor.connection.server_version < 160000:
+        return "unavailable: generic plans need PostgreSQL 16"
+    if "%(" in statement:
+        return "unavailable: named parameters"
+    counter = iter(range(1, 1_000_000))
+    numbered = _POSITIONAL.sub(lambda match: "%" if match.group() == "%%" else f"${next(counter)}", statement)
+    # A separate cursor keeps the original cursor's pending result set intact, and the
+    # savepoint keeps a failed EXPLAIN from aborting the caller's transaction
+    with cursor.connection.cursor() as plan_cursor:
+        plan_cursor.execute("SAVEPOINT slow_query_plan;")
+        try:
+            # No params are passed, so psycopg2 sends the text as is and the $n stay placeholders
+            plan_cursor.execute("EXPLAIN (GENERIC_PLAN, FORMAT JSON) " + numbered)
+            plan = plan_cursor.fetchone()[0]
+            plan_cursor.execute("RELEASE SAVEPOINT slow_query_plan;")
+            return plan
+        except psycopg2.Error as e:
+            plan_cursor.execute("ROLLBACK TO SAVEPOINT slow_query_plan;")
+            return f"unavailable: {e}".strip()
+
+
+def _log_slow_query(cursor, statement: Optional[str], params: Any, duration_ms: float, rows: Optional[int] = None):
+    """
+    Logs a slow statement by its SQL template, parameter types and generic plan;
+    never a parameter value. statement is None for a pre-formatted statement.
+    rows is the number of argument rows of an execute_values statement, whose
+    plan is not taken (its VALUES list was expanded with the values).
+    """
+    plan = None
+    if statement is not None and rows is None \
+            and statement.lstrip().split(None, 1)[0].upper() in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH"):
+        plan = _generic_plan(cursor, statement)
+    entry = {
+        "ts": time.time(),
+        "duration_ms": round(duration_ms, 3),
+        "sql": " ".join(statement.split()) if statement is not None else PREFORMATTED,
+        "params_shape": _param_shape(params) if rows is None else f"rows[{rows}]",
+        "plan": plan,
+    }
+    with _slow_log_lock, open(SLOW_QUERY_LOG_FILE, "a", encoding="utf-8") as log_file:
+        log_file.write(json.dumps(entry, default=str) + "\n")
+
+
+class TracedCursor(psycopg2.extensions.cursor):
+    """
+    Cursor that records a span per statement and feeds the slow-query log.
+    Use its execute_values() rather than extras.execute_values(), so the
+    statement is traced and logged by its template instead of with the values
+    interpolated into it.
+    """
+    _template: Optional[str] = None # Set while execute_values() runs
+    _template_rows: Optional[int] = None
+
+    def execute(self, query, vars=None):
+        if self._template is not None:
+            statement = self._template
+        elif vars is None and isinstance(query, bytes):
+            statement = None # Already mogrified by the caller: it contains values
+        else:
+            statement = _statement_text(query)
+        start = time.perf_counter()
+        label = " ".join(statement.split())[:200] if statement is not None else PREFORMATTED
+        with span("db.query", **{"db.system": "postgresql", "db.statement": label}):
+            result = super().execute(query, vars)
+        duration_ms = (time.perf_counter() - start) * 1000
+        if duration_ms >= SLOW_QUERY_MS and random.random() < SLOW_QUERY_SAMPLE_RATE:
+            try:
+                _log_slow_query(self, statement, vars, duration_ms, rows=self._template_rows)
+            except Exception as e:
+                print(f"❌ Failed to log slow query: {e}")
+        return result
+
+    def execute_values(self, sql: str, argslist, **kwargs):
+        """extras.execute_values() on this cursor, traced by its SQL template."""
+        self._template, self._template_rows = sql, len(argslist)
+        try:
+            return extras.execute_values(self, sql, argslist, **kwargs)
+        finally:
+            self._template = self._template_rows = None
+
+
+class TracedTemplates(Jinja2Templates):
+    """Jinja2Templates whose rendering shows up as a span."""
+
+    def TemplateResponse(self, *args, **kwargs):
+        name = kwargs.get("name") or next((arg for arg in args if isinstance(arg, str)), "")
+        with span("template.render", template=name):
+            return super().TemplateResponse(*args, **kwargs)
@@ -0,0 +1,70 @@
+from typing import Callable, Dict, Iterable, Iterator, Optional, Union
+import binascii
+
+from cryptography.fernet import Fernet, InvalidToken
+
+DECRYPTION_FAILED = "[Decryption Failed - Key Mismatch/Corruption]"
+PROCESSING_ERROR = "[Processing Error]"
+
+
+class VaultRow:
+    """
+    A single row of the passwords table as fetched from the cursor.
+
+    Uses __slots__ so a listing holds one small object per row instead of a
+    dict, and keeps the BYTEA ciphertext as the memoryview psycopg2 returns
+    so it is only copied once, right before decryption.
+    """
+    __slots__ = ("id", "website", "username", "encrypted_password", "has_totp", "collection_id", "wrapped_key")
+
+    def __init__(self, id: int, website: str, username: str, encrypted_password: Union[memoryview, bytes, str],
+                 has_totp: bool = False, collection_id: Optional[int] = None, wrapped_key: Optional[memoryview] = None):
+        self.id = id
+        self.website = website
+        self.username = username
+        self.encrypted_password = encrypted_password
+        self.has_totp = has_totp
+        self.collection_id = collection_id # Set for entries of a shared collection
+        self.wrapped_key = wrapped_key # The collection key, wrapped for the listing user
+
+
+def ciphertext_bytes(raw: Union[memoryview, bytes, str]) -> bytes:
+    """Returns the ciphertext as the bytes Fernet expects."""
+    if isinstance(raw, str):
+        # Decode from hex if PostgreSQL returned a hex string (BYTEA behavior)
+        return binascii.unhexlify(raw[2:] if raw.startswith('\\x') else raw)
+    return bytes(raw)
+
+
+def iter_decrypted(fernet: Fernet, rows: Iterable[VaultRow],
+                   collection_fernet: Optional[Callable[[memoryview], Fernet]] = None) -> Iterator[dict]:
+    """
+    Lazily decrypts rows into the dicts returned by the listing API.
+
+    Personal rows are decrypted with fernet. Shared rows are decrypted with
+    their collection's key, which collection_fernet unwraps once per collection.
+    Rows that fail to decrypt are still yielded, with a placeholder password,
+    so one corrupted entry does not hide the rest of the vault.
+    Shared rows carry their id as collection_entry_id and a null id: the two
+    tables number their rows independently, so the ids would collide.
+    """
+    collection_keys: Dict[int, Fernet] = {}
+    for row in rows:
+        try:
+            row_fernet = fernet
+            if row.collection_id is not None:
+                row_fernet = collection_keys.get(row.collection_id)
+                if row_fernet is None:
+                    row_fernet = collection_keys[row.collection_id] = collection_fernet(row.wrapped_key)
+            password = row_fernet.decrypt(ciphertext_bytes(row.encrypted_password)).decode()
+        except InvalidToken as e:
+            print(f"Skipping password for website {row.website} due to decryption error: {e!r}")
+            password = DECRYPTION_FAILED
+        except Exception as e:
+            print(f"Unexpected error for website {row.website}: {e}")
+            password = PROCESSING_ERROR
+        entry = {"id": row.id, "website": row.website, "username": row.username, "password": password,
+                 "totp": row.has_totp, "collection_id": row.collection_id}
+        if row.collection_id is not None:
+            entry["id"], entry["collection_entry_id"] = None, row.id
+        yield entry
@@ -1,33 +1,67 @@
-from typing import Union
+from typing import Union, Optional
+from datetime import datetime, timedelta, timezone
 import re
-from fastapi import FastAPI, Request, Form, HTTPException, Depends
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+import secrets
+from urllib.parse import quote
+from fastapi import FastAPI, Request, Form, HTTPException, Depends, Query
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.sessions import SessionMiddleware
 from starlette.status import HTTP_303_SEE_OTHER
 
 # Assuming the corrected database class is in database.py
+import databse
 from databse import Database
 import sendmail
 from main import PasswordManager # Import the new PasswordManager
+from responses import vault_list_response, vault_response
+import attachments
+import audit
+import history
+import pages
+import totp
+import tracing
 
 # --- Configuration and Initialization ---
 
 SECRET_KEY = "@tuzi$layki$nahi$bhava@" # Replace with a strong, randomly generated key in production
 PASSWORD_REGEX = re.compile(r"^(?=.*[A-Z])(?=.*[a-z])(?=.*\d)(?=.*[@$!%*?&])[A-Za-z\d@$!%*?&]{8,}$")
 STRONG_PASSWORD_MESSAGE = "Password must be at least 8 characters long and include one uppercase letter, one lowercase letter, one number, and one special character."
+MAX_BATCH_OPERATIONS = 1000 # Upper bound on operations accepted by /vault/batch
 
 app = FastAPI()
+app.add_middleware(databse.ReadYourWritesMiddleware) # Added first so it runs inside SessionMiddleware
 app.add_middleware(SessionMiddleware, secret_key=SECRET_KEY)
+app.add_middleware(tracing.TracingMiddleware) # Samples TRACE_SAMPLE_RATE of requests; off by default
 # Assuming 'static' directory exists in the same location as your website.py
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 # Assuming 'templates' directory exists in the same location as your website.py
-templates = Jinja2Templates(directory="templates")
+templates = tracing.TracedTemplates(env=pages.template_environment())
+page_cache = pages.PageCache(templates) # Pre-rendered, pre-compressed copies of the context-free pages
 db = Database() # Database instance
 pm = PasswordManager() # PasswordManager instance
 
+@app.on_event("startup")
+def start_audit_log():
+    """Starts the background audit flusher in this worker."""
+    audit.audit_log.start(db.get_connection)
+
+@app.on_event("startup")
+def start_history_pruner():
+    """Starts the background job that enforces the revision history retention policy."""
+    history.pruner.start(db)
+
+@app.on_event("shutdown")
+def stop_audit_log():
+    """Writes any buffered audit events before the worker exits."""
+    audit.audit_log.close()
+
+@app.on_event("shutdown")
+def stop_history_pruner():
+    history.pruner.close()
+
 # --- Helper Functions and Dependencies ---
 
 def is_strong_password(password: str) -> bool:
@@ -52,17 +86,17 @@ def get_current_user(request: Request) -> dict:
 # --- Route Handlers ---
 
 @app.get("/", response_class=HTMLResponse)
-def read_root(request: Request):
+async def read_root(request: Request):
     """Renders the root page."""
-    return templates.TemplateResponse("index.html", {"request": request})
+    return page_cache.response(request, "index.html")
 
 @app.get("/signup", response_class=HTMLResponse)
-def get_signup(request: Request):
+async def get_signup(request: Request):
     """Renders the signup page."""
-    return templates.TemplateResponse("signup.html", {"request": request})
+    return page_cache.response(request, "signup.html")
 
 @app.post("/signup")
-async def post_signup(
+def post_signup(
     request: Request,
     username: str = Form(...),
     email: str = Form(...),
@@ -93,7 +127,7 @@ def get_verification_page(request: Request, email: str = Depends(get_session_ema
     return templates.TemplateResponse("verify.html", {"request": request, "email": email})
 
 @app.post("/verify")
-async def post_verification(
+def post_verification(
     request: Request,
     code: str = Form(...),
     email: str = Depends(get_session_email)
@@ -113,12 +147,12 @@ async def post_verification(
     return RedirectResponse(url="/login", status_code=HTTP_303_SEE_OTHER)
 
 @app.get("/login", response_class=HTMLResponse)
-def get_login(request: Request):
+async def get_login(request: Request):
     """Renders the login page."""
-    return templates.TemplateResponse("login.html", {"request": request})
+    return page_cache.response(request, "login.html")
 
 @app.post("/login")
-async def post_login(request: Request, email: str = Form(...), password: str = Form(...)):
+def post_login(request: Request, email: str = Form(...), password: str = Form(...)):
     """Handles user login."""
     is_valid, user_data_or_error = db.get_user_for_login(email=email, password=password)
     
@@ -134,16 +168,18 @@ def get_dashboard(request: Request, user: dict = Depends(get_current_user)):
     return templates.TemplateResponse("dashbord.html", {"request": request, "username": user['username']})
 
 @app.post("/dashboard")
-async def add_new_password(
+def add_new_password(
     request: Request, 
     website: str = Form(...), 
     username: str = Form(...), 
     password: str = Form(...),
+    totp_secret: str = Form(None), # Optional 2FA seed (base32 or otpauth:// URI)
     current_user: dict = Depends(get_current_user)
 ):
     """Handles adding a new password entry."""
     user_id = current_user['id']
-    success, message = pm.add_password(user_id=user_id, website=website, username=username, raw_password=password)
+    success, message = pm.add_password(user_id=user_id, website=website, username=username, raw_password=password,
+                                       totp_secret=totp_secret or None)
     
     if success:
         return JSONResponse({"message": message}, status_code=200)
@@ -151,18 +187,41 @@ async def add_new_password(
         raise HTTPException(status_code=400, detail=message)
 
 @app.get("/list_passwords")
-async def list_user_passwords(request: Request, current_user: dict = Depends(get_current_user)):
+def list_user_passwords(request: Request, current_user: dict = Depends(get_current_user)):
     """API endpoint to list all passwords for the authenticated user."""
     user_id = current_user['id']
     success, passwords_data = pm.get_passwords(user_id=user_id)
-    
+
     if success:
-        return JSONResponse({"passwords": passwords_data}, status_code=200)
+        # passwords_data is a lazy iterator; each row is decrypted as the response streams it
+        return vault_list_response(request, "passwords", passwords_data, status_code=200)
     else:
         raise HTTPException(status_code=500, detail=passwords_data) # passwords_data will be an error message here
 
+@app.get("/totp_codes")
+def list_totp_codes(request: Request, ids: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    """
+    API endpoint returning the current TOTP codes of the user's entries in one call.
+    ids is an optional comma-separated list (e.g. the entries visible on the page).
+    """
+    try:
+        entry_ids = [int(entry_id) for entry_id in ids.split(",") if entry_id.strip()] if ids else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be a comma-separated list of entry IDs.")
+    # The cache is per session, so a second tab or device decrypts its own copy
+    session = request.session.setdefault("totp_session", secrets.token_urlsafe(16))
+    success, codes = pm.get_totp_codes(current_user['id'], session, entry_ids)
+
+    if success:
+        return JSONResponse(
+            {"period": totp.TOTP_PERIOD, "expires_in": totp.seconds_remaining(), "codes": codes},
+            status_code=200, headers={"Cache-Control": "no-store"}
+        )
+    else:
+        raise HTTPException(status_code=500, detail=codes)
+
 @app.delete("/delete_password/{item_id}")
-async def delete_user_password(request: Request, item_id: int, current_user: dict = Depends(get_current_user)):
+def delete_user_password(request: Request, item_id: int, current_user: dict = Depends(get_current_user)):
     """API endpoint to delete a specific password entry."""
     user_id = current_user['id']
     success, message = pm.delete_password(password_id=item_id, user_id=user_id)
@@ -173,12 +232,14 @@ async def delete_user_password(request: Request, item_id: int, current_user: dic
         raise HTTPException(status_code=400, detail=message)
 
 @app.put("/update_password/{item_id}")
-async def update_user_password(
+def update_user_password(
     request: Request,
     item_id: int,
     website: str = Form(...),
     username: str = Form(...),
     password: str = Form(None),  # Password can be None if not changing
+    totp_secret: str = Form(None), # Omitted or empty keeps the current 2FA seed
+    clear_totp: bool = Form(False), # Removes the 2FA seed
     current_user: dict = Depends(get_current_user)
 ):
     """API endpoint to update a specific password entry."""
@@ -189,7 +250,9 @@ async def update_user_password(
         user_id=user_id,
         website=website,
         username=username,
-        raw_password=password if password else None  # Pass None if password field was empty on the form
+        raw_password=password if password else None,  # Pass None if password field was empty on the form
+        totp_secret=totp_secret or None,
+        clear_totp=clear_totp
     )
 
     if success:
@@ -198,13 +261,326 @@ async def update_user_password(
         # Consider more specific error codes, e.g., 404 if item_id not found
         raise HTTPException(status_code=400, detail=message)
 
+@app.get("/passwords/deleted")
+def list_deleted_passwords(request: Request, current_user: dict = Depends(get_current_user)):
+    """API endpoint listing deleted entries that can still be undeleted."""
+    success, data = pm.get_deleted_passwords(current_user['id'])
+    if success:
+        return JSONResponse({"deleted": data})
+    else:
+        raise HTTPException(status_code=500, detail=data)
+
+@app.get("/passwords/{item_id}/history")
+def password_history(request: Request, item_id: int, current_user: dict = Depends(get_current_user)):
+    """API endpoint listing the earlier versions of an entry, newest first."""
+    success, data = pm.get_history(current_user['id'], item_id)
+    if success:
+        return JSONResponse({"revisions": data})
+    else:
+        raise HTTPException(status_code=500, detail=data)
+
+@app.post("/passwords/{item_id}/restore")
+def restore_password_revision(
+    request: Request,
+    item_id: int,
+    revision_id: int = Form(...),
+    current_user: dict = Depends(get_current_user)
+):
+    """API endpoint to put an earlier version of an entry back (undeleting it if needed)."""
+    success, message = pm.restore_revision(current_user['id'], item_id, revision_id)
+    if success:
+        return JSONResponse({"message": message}, status_code=200)
+    else:
+        raise HTTPException(status_code=400, detail=message)
+
+@app.post("/passwords/{item_id}/undelete")
+def undelete_password(request: Request, item_id: int, current_user: dict = Depends(get_current_user)):
+    """API endpoint to bring back a deleted entry as it was when it was deleted."""
+    success, message = pm.undelete_password(current_user['id'], item_id)
+    if success:
+        return JSONResponse({"message": message}, status_code=200)
+    else:
+        raise HTTPException(status_code=400, detail=message)
+
+@app.post("/vault/batch")
+async def batch_vault_operations(request: Request, current_user: dict = Depends(get_current_user)):
+    """
+    API endpoint to apply many create/update/delete operations in one transaction.
+    Expects a JSON body of the form {"operations": [{"op": "delete", "id": 3}, ...]}.
+    """
+    try:
+        body = await request.json()
+        operations = body["operations"]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Body must be JSON with an 'operations' list.")
+    if not isinstance(operations, list) or not all(isinstance(op, dict) for op in operations):
+        raise HTTPException(status_code=400, detail="'operations' must be a list of objects.")
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        raise HTTPException(status_code=413, detail=f"A batch may contain at most {MAX_BATCH_OPERATIONS} operations.")
+
+    # The batch runs on the threadpool: its database retries sleep, which must not block the event loop
+    success, results = await run_in_threadpool(pm.apply_batch, user_id=current_user['id'], operations=operations)
+
+    if success:
+        return JSONResponse({"results": results}, status_code=200)
+    else:
+        raise HTTPException(status_code=400, detail=results)
+
+@app.get("/audit")
+def list_audit_events(
+    request: Request,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    action: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=audit.AUDIT_QUERY_LIMIT),
+    current_user: dict = Depends(get_current_user)
+):
+    """API endpoint to list the authenticated user's audit events (default: last 30 days)."""
+    until = until or datetime.now(timezone.utc)
+    since = since or until - timedelta(days=30)
+    success, events = audit.audit_log.query(current_user['id'], since, until, action=action, limit=limit)
+
+    if success:
+        return vault_response(request, {"events": events}, status_code=200)
+    else:
+        raise HTTPException(status_code=500, detail=events)
+
+@app.post("/attachments")
+async def upload_attachment(
+    request: Request,
+    filename: str,
+    entry_id: Optional[int] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    API endpoint to upload a file as the raw request body. The body is encrypted
+    and stored chunk by chunk as it arrives, so it is never held in memory whole.
+    Optionally attaches the file to the vault entry entry_id.
+    """
+    success, result = await attachments.store_stream(
+        db, pm.fernet, current_user['id'], request.stream(), "file", filename,
+        request.headers.get("content-type", "application/octet-stream"), password_id=entry_id
+    )
+
+    if success:
+        return JSONResponse({"id": result}, status_code=201)
+    else:
+        raise HTTPException(status_code=413 if result == attachments.QUOTA_EXCEEDED else 400, detail=result)
+
+@app.post("/notes")
+async def add_secure_note(
+    request: Request,
+    title: str = Form(...),
+    body: str = Form(...),
+    entry_id: Optional[int] = Form(None),
+    current_user: dict = Depends(get_current_user)
+):
+    """API endpoint to store an encrypted secure note (kept alongside attachments)."""
+    success, result = await attachments.store_stream(
+        db, pm.fernet, current_user['id'], attachments.bytes_stream(body.encode("utf-8")), "note", title,
+        "text/plain; charset=utf-8", password_id=entry_id
+    )
+
+    if success:
+        return JSONResponse({"id": result}, status_code=201)
+    else:
+        raise HTTPException(status_code=413 if result == attachments.QUOTA_EXCEEDED else 400, detail=result)
+
+@app.get("/attachments")
+def list_user_attachments(request: Request, current_user: dict = Depends(get_current_user)):
+    """API endpoint to list the authenticated user's attachments and notes (metadata only)."""
+    success, items = db.list_attachments(current_user['id'])
+
+    if success:
+        return vault_response(request, {"attachments": items}, status_code=200)
+    else:
+        raise HTTPException(status_code=500, detail=items)
+
+@app.get("/attachments/{attachment_id}")
+def download_attachment(request: Request, attachment_id: int, current_user: dict = Depends(get_current_user)):
+    """
+    API endpoint to download an attachment or note, decrypting it chunk by chunk.
+    Supports single byte ranges (Range: bytes=start-end) for resuming and seeking.
+    """
+    user_id = current_user['id']
+    meta = db.get_attachment(user_id, attachment_id)
+    if meta is None:
+        raise HTTPException(status_code=404, detail="Attachment not found.")
+
+    size = meta["size"]
+    byte_range = attachments.parse_range(request.headers.get("range"), size)
+    if byte_range is False:
+        raise HTTPException(status_code=416, detail="Range not satisfiable.", headers={"Content-Range": f"bytes */{size}"})
+    start, end = byte_range or (0, size - 1)
+    audit.record("attachment_download", user_id=user_id, entry_id=attachment_id)
+
+    disposition = "inline" if meta["kind"] == "note" else "attachment"
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Length": str(max(end - start + 1, 0)),
+        "Content-Disposition": f"{disposition}; filename*=UTF-8''{quote(meta['filename'])}",
+    }
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    body = attachments.iter_plaintext(db, pm.fernet, user_id, meta, start, end) if size else iter(())
+    return StreamingResponse(body, status_code=206 if byte_range else 200, media_type=meta["content_type"], headers=headers)
+
+@app.delete("/attachments/{attachment_id}")
+def delete_user_attachment(request: Request, attachment_id: int, current_user: dict = Depends(get_current_user)):
+    """API endpoint to delete an attachment or note."""
+    user_id = current_user['id']
+    success, message = db.delete_attachment(user_id, attachment_id)
+    audit.record("attachment_delete", user_id=user_id, entry_id=attachment_id, success=success)
+
+    if success:
+        return JSONResponse({"message": message}, status_code=200)
+    else:
+        raise HTTPException(status_code=400, detail=message)
+
+@app.get("/organizations")
+def list_user_organizations(request: Request, current_user: dict = Depends(get_current_user)):
+    """API endpoint to list the user's organizations and the collections shared with them."""
+    success, organizations = db.list_organizations(current_user['id'])
+    if not success:
+        raise HTTPException(status_code=500, detail=organizations)
+    success, collections = db.list_collections(current_user['id'])
+    if not success:
+        raise HTTPException(status_code=500, detail=collections)
+    return vault_response(request, {"organizations": organizations, "collections": collections}, status_code=200)
+
+@app.post("/organizations")
+def create_organization(request: Request, name: str = Form(...), current_user: dict = Depends(get_current_user)):
+    """API endpoint to create an organization owned by the current user."""
+    success, result = pm.create_organization(current_user['id'], name)
+
+    if success:
+        return JSONResponse({"id": result}, status_code=201)
+    else:
+        raise HTTPException(status_code=400, detail=result)
+
+@app.put("/organizations/{organization_id}/members")
+def set_organization_member(
+    request: Request,
+    organization_id: int,
+    email: str = Form(...),
+    role: str = Form("member"),
+    current_user: dict = Depends(get_current_user)
+):
+    """API endpoint to add a user to an organization or change their role."""
+    success, message = pm.set_organization_member(organization_id, current_user['id'], email, role)
+
+    if success:
+        return JSONResponse({"message": message}, status_code=200)
+    else:
+        raise HTTPException(status_code=400, detail=message)
+
+@app.delete("/organizations/{organization_id}/members/{user_id}")
+def remove_organization_member(
+    request: Request, organization_id: int, user_id: int, current_user: dict = Depends(get_current_user)
+):
+    """API endpoint to remove a member from an organization (and all of its collections)."""
+    success, message = pm.remove_organization_member(organization_id, current_user['id'], user_id)
+
+    if success:
+        return JSONResponse({"message": message}, status_code=200)
+    else:
+        raise HTTPException(status_code=400, detail=message)
+
+@app.post("/organizations/{organization_id}/collections")
+def create_collection(
+    request: Request, organization_id: int, name: str = Form(...), current_user: dict = Depends(get_current_user)
+):
+    """API endpoint to create a shared collection in an organization."""
+    success, result = pm.create_collection(organization_id, current_user['id'], name)
+
+    if success:
+        return JSONResponse({"id": result}, status_code=201)
+    else:
+        raise HTTPException(status_code=400, detail=result)
+
+@app.put("/collections/{collection_id}/members")
+def share_collection(
+    request: Request,
+    collection_id: int,
+    email: str = Form(...),
+    permission: str = Form("read"),
+    current_user: dict = Depends(get_current_user)
+):
+    """API endpoint to share a collection with an organization member, or change their permission."""
+    success, message = pm.share_collection(collection_id, current_user['id'], email, permission)
+
+    if success:
+        return JSONResponse({"message": message}, status_code=200)
+    else:
+        raise HTTPException(status_code=400, detail=message)
+
+@app.delete("/collections/{collection_id}/members/{user_id}")
+def unshare_collection(
+    request: Request, collection_id: int, user_id: int, current_user: dict = Depends(get_current_user)
+):
+    """API endpoint to revoke a member's access to a collection."""
+    success, message = pm.unshare_collection(collection_id, current_user['id'], user_id)
+
+    if success:
+        return JSONResponse({"message": message}, status_code=200)
+    else:
+        raise HTTPException(status_code=400, detail=message)
+
+@app.post("/collections/{collection_id}/entries")
+def add_collection_entry(
+    request: Request,
+    collection_id: int,
+    website: str = Form(...),
+    username: str = Form(...),
+    password: str = Form(...),
+    current_user: dict = Depends(get_current_user)
+):
+    """API endpoint to add an entry to a shared collection."""
+    success, result = pm.add_collection_entry(collection_id, current_user['id'], website, username, password)
+
+    if success:
+        return JSONResponse({"id": result}, status_code=201)
+    else:
+        raise HTTPException(status_code=400, detail=result)
+
+@app.put("/collections/{collection_id}/entries/{entry_id}")
+def update_collection_entry(
+    request: Request,
+    collection_id: int,
+    entry_id: int,
+    website: str = Form(None),
+    username: str = Form(None),
+    password: str = Form(None), # Password can be None if not changing
+    current_user: dict = Depends(get_current_user)
+):
+    """API endpoint to update an entry of a shared collection."""
+    success, message = pm.update_collection_entry(collection_id, entry_id, current_user['id'], website, username,
+                                                  password or None)
+
+    if success:
+        return JSONResponse({"message": message}, status_code=200)
+    else:
+        raise HTTPException(status_code=400, detail=message)
+
+@app.delete("/collections/{collection_id}/entries/{entry_id}")
+def delete_collection_entry(
+    request: Request, collection_id: int, entry_id: int, current_user: dict = Depends(get_current_user)
+):
+    """API endpoint to delete an entry of a shared collection."""
+    success, message = pm.delete_collection_entry(collection_id, entry_id, current_user['id'])
+
+    if success:
+        return JSONResponse({"message": message}, status_code=200)
+    else:
+        raise HTTPException(status_code=400, detail=message)
+
 @app.get("/forgot_passsword", response_class=HTMLResponse)
-def get_forgot_password(request: Request):
+async def get_forgot_password(request: Request):
     """Renders the forgot password page."""
-    return templates.TemplateResponse("forgotpassword.html", {"request": request})
+    return page_cache.response(request, "forgotpassword.html")
 
 @app.post("/forgot_passsword")
-async def post_forgot_password(request: Request, email: str = Form(...)):
+def post_forgot_password(request: Request, email: str = Form(...)):
     """Handles the forgot password request and sends a reset code."""
     if not db.get_user(email=email):
         return templates.TemplateResponse("forgotpassword.html", {"request": request, "message": "Email not found."})
@@ -215,9 +591,9 @@ async def post_forgot_password(request: Request, email: str = Form(...)):
     return RedirectResponse(url="/reset_password_verify", status_code=HTTP_303_SEE_OTHER)
 
 @app.get("/reset_password_verify", response_class=HTMLResponse)
-def get_reset_password_verify(request: Request):
+async def get_reset_password_verify(request: Request):
     """Renders the reset password code verification page."""
-    return templates.TemplateResponse("reset_password_code_verification.html", {"request": request})
+    return page_cache.response(request, "reset_password_code_verification.html")
 
 @app.post("/reset_password_verify")
 async def post_reset_password_verify(
@@ -233,12 +609,12 @@ async def post_reset_password_verify(
     return RedirectResponse(url="/reset_password", status_code=HTTP_303_SEE_OTHER)
 
 @app.get("/reset_password", response_class=HTMLResponse)
-def get_reset_password(request: Request):
+async def get_reset_password(request: Request):
     """Renders the reset password page."""
-    return templates.TemplateResponse("reset_password.html", {"request": request})
+    return page_cache.response(request, "reset_password.html")
 
 @app.post("/reset_password")
-async def post_reset_password(
+def post_reset_password(
     request: Request,
     new_password: str = Form(...),
     email: str = Depends(lambda r: get_session_email(r, "reset_email")) # Ensure email is present